@@ -377,6 +377,8 @@ class TestBaseCommand(distutils.core.Command):
          "Run only testcases whose name contains the passed string"),
         ("testfile=", None, "Specific test file to run (e.g "
                             "validation, storage, ...)"),
+        ("xmlapi=", None, "XML backend to run the tests against "
+                          "(libxml2, lxml)"),
     ]
 
     def initialize_options(self):
@@ -388,6 +390,7 @@ class TestBaseCommand(distutils.core.Command):
         self._testfiles = []
         self._dir = os.getcwd()
         self.testfile = None
+        self.xmlapi = None
         self._force_verbose = False
         self._external_coverage = False
 
@@ -427,6 +430,10 @@ class TestBaseCommand(distutils.core.Command):
             if not self._external_coverage:
                 cov.start()
 
+        if self.xmlapi:
+            # Needs to be set before virtinst is imported
+            os.environ["VIRTINST_XMLAPI"] = self.xmlapi
+
         import tests as testsmodule
         testsmodule.utils.clistate.regenerate_output = bool(
                 self.regenerate_output)
@@ -488,7 +495,8 @@ class TestCommand(TestBaseCommand):
         '''
         Finds all the tests modules in tests/, and runs them.
         '''
-        excludes = ["dist.py", "test_urls.py", "test_inject.py"]
+        excludes = ["dist.py", "test_urls.py", "test_inject.py",
+                    "benchmark.py"]
         testfiles = self._find_tests_in_dir("tests", excludes)
 
         # Put clitest at the end, since it takes the longest
@@ -568,6 +576,46 @@ class TestDist(TestBaseCommand):
         TestBaseCommand.run(self)
 
 
+class TestBenchmark(distutils.core.Command):
+    description = "Run XML parsing micro benchmarks"
+    user_options = [
+        ("iterations=", "i", "Number of passes over each XML corpus"),
+        ("only=", None,
+         "Run only benchmarks whose name contains the passed string"),
+        ("save-baseline=", None, "Save results as JSON to the passed file"),
+        ("compare-baseline=", None,
+         "Compare results against the passed JSON baseline file"),
+        ("threshold=", None,
+         "Fractional slowdown to flag as a regression (default: 0.1)"),
+        ("xmlapi=", None, "XML backend to benchmark (libxml2, lxml)"),
+    ]
+
+    def initialize_options(self):
+        self.iterations = 20
+        self.only = None
+        self.save_baseline = None
+        self.compare_baseline = None
+        self.threshold = 0.1
+        self.xmlapi = None
+
+    def finalize_options(self):
+        self.iterations = int(self.iterations)
+        self.threshold = float(self.threshold)
+
+    def run(self):
+        if self.xmlapi:
+            os.environ["VIRTINST_XMLAPI"] = self.xmlapi
+
+        import tests as testsmodule
+        testsmodule.setup_logging()
+        from tests import benchmark
+        sys.exit(benchmark.main(self.iterations,
+                                only=self.only,
+                                save=self.save_baseline,
+                                compare=self.compare_baseline,
+                                threshold=self.threshold))
+
+
 class CheckSpell(distutils.core.Command):
     user_options = []
     description = "Check code for common misspellings"
@@ -716,6 +764,7 @@ distutils.core.setup(
         'test_urls': TestURLFetch,
         'test_initrd_inject': TestInitrdInject,
         'test_dist': TestDist,
+        'benchmark': TestBenchmark,
     },
 
     distclass=VMMDistribution,
@@ -0,0 +1,271 @@
+# Copyright (C) 2019 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+"""
+Micro benchmarks for the virtinst XML object models. Run them with:
+
+    ./setup.py benchmark
+
+Each XML class is exercised against the XML corpora already used by
+the test suite. For every class we time parsing, reading every
+XMLProperty, setting every XMLProperty and a get_xml() roundtrip, and
+report ops/sec plus the peak python memory allocated by one pass over
+the corpus. Results can be saved as a JSON baseline and compared
+against by a later run to flag regressions.
+"""
+
+import glob
+import json
+import re
+import time
+import tracemalloc
+
+import virtinst
+
+from tests import utils
+
+
+# pylint: disable=protected-access
+# We poke at XMLBuilder internals to walk every property
+
+
+class _Corpus(object):
+    """
+    A set of XML documents that all parse with the same virtinst class
+
+    :param embedded: The documents are unindented <rootname> elements
+        inside a bigger file, like the test driver XML, rather than one
+        per file
+    """
+    def __init__(self, name, parsefunc, globs, rootname, embedded=False):
+        self.name = name
+        self._parsefunc = parsefunc
+        self._globs = globs
+        self._rootname = rootname
+        self._embedded = embedded
+        self._xmls = None
+
+    def _load(self):
+        ret = []
+        for pattern in self._globs:
+            for path in sorted(glob.glob(pattern)):
+                xml = open(path).read()
+                if self._embedded:
+                    ret.extend(re.findall(r"^<%s>.*?^</%s>" %
+                                          (self._rootname, self._rootname),
+                                          xml, re.DOTALL | re.MULTILINE))
+                    continue
+
+                # xmlparse-xml and storage-xml mix several object types
+                match = re.search(r"<([a-zA-Z][^\s/>]*)", xml)
+                if not match or match.group(1) != self._rootname:
+                    continue
+                ret.append(xml)
+        return ret
+
+    @property
+    def xmls(self):
+        if self._xmls is None:
+            self._xmls = self._load()
+        return self._xmls
+
+    def parse(self, conn, xml):
+        return self._parsefunc(conn, xml)
+
+
+def _get_corpora():
+    return [
+        _Corpus("Guest",
+                lambda c, x: virtinst.Guest(c, parsexml=x),
+                ["tests/xmlparse-xml/*.xml", "tests/xmlconfig-xml/*.xml"],
+                "domain"),
+        _Corpus("StoragePool",
+                lambda c, x: virtinst.StoragePool(c, parsexml=x),
+                ["tests/storage-xml/*.xml", "tests/xmlparse-xml/*.xml"],
+                "pool"),
+        _Corpus("StorageVolume",
+                lambda c, x: virtinst.StorageVolume(c, parsexml=x),
+                ["tests/storage-xml/*.xml", "tests/xmlparse-xml/*.xml"],
+                "volume"),
+        _Corpus("NodeDevice",
+                virtinst.NodeDevice.parse,
+                ["tests/testdriver.xml"],
+                "device", embedded=True),
+        _Corpus("Capabilities",
+                virtinst.Capabilities,
+                ["tests/capabilities-xml/*.xml"],
+                "capabilities"),
+        _Corpus("DomainCapabilities",
+                virtinst.DomainCapabilities,
+                ["tests/capabilities-xml/*.xml"],
+                "domainCapabilities"),
+    ]
+
+
+#######################
+# Benchmark functions #
+#######################
+
+def _walk_objects(obj):
+    yield obj
+    for propname in obj._all_child_props():
+        for child in virtinst.util.listify(getattr(obj, propname)):
+            for ret in _walk_objects(child):
+                yield ret
+
+
+def _op_parse(conn, corpus, xml):
+    corpus.parse(conn, xml)
+
+
+def _op_access(conn, corpus, xml):
+    obj = corpus.parse(conn, xml)
+    for o in _walk_objects(obj):
+        for propname in o._all_xml_props():
+            getattr(o, propname)
+
+
+def _op_mutate(conn, corpus, xml):
+    obj = corpus.parse(conn, xml)
+    for o in _walk_objects(obj):
+        for propname in o._all_xml_props():
+            val = getattr(o, propname)
+            if val is not None:
+                setattr(o, propname, val)
+    obj.get_xml()
+
+
+def _op_roundtrip(conn, corpus, xml):
+    corpus.parse(conn, xml).get_xml()
+
+
+_OPS = [
+    ("parse", _op_parse),
+    ("access", _op_access),
+    ("mutate", _op_mutate),
+    ("roundtrip", _op_roundtrip),
+]
+
+
+def _run_one(conn, corpus, opfunc, iterations):
+    # Warm up caches and check the op works at all
+    for xml in corpus.xmls:
+        opfunc(conn, corpus, xml)
+
+    start = time.perf_counter()
+    for ignore in range(iterations):
+        for xml in corpus.xmls:
+            opfunc(conn, corpus, xml)
+    elapsed = time.perf_counter() - start
+
+    # Measured separately, since tracemalloc skews the timing
+    tracemalloc.start()
+    try:
+        for xml in corpus.xmls:
+            opfunc(conn, corpus, xml)
+        ignore, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    ops = iterations * len(corpus.xmls)
+    return {
+        "ops": ops,
+        "ops_per_sec": elapsed and (ops / elapsed) or 0,
+        "peak_kib": peak / 1024.0,
+    }
+
+
+def run_benchmarks(iterations, only=None):
+    """
+    Run all benchmarks and return a dict of name -> result dict
+    """
+    conn = utils.URIs.open_testdriver_cached()
+    results = {}
+    for corpus in _get_corpora():
+        for opname, opfunc in _OPS:
+            name = "%s.%s" % (corpus.name, opname)
+            if only and only not in name:
+                continue
+            if not corpus.xmls:
+                # Don't let a benchmark silently disappear if its
+                # test XML moves
+                raise RuntimeError("No XML found for the %s benchmark "
+                                   "corpus" % corpus.name)
+            results[name] = _run_one(conn, corpus, opfunc, iterations)
+            print("%-32s %12.1f ops/sec %10.1f KiB peak" %
+                  (name, results[name]["ops_per_sec"],
+                   results[name]["peak_kib"]))
+    return results
+
+
+#####################
+# Baseline handling #
+#####################
+
+def save_baseline(path, results):
+    data = {
+        "xmlapi": virtinst.xmlapi.get_xmlapi_backend(),
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+    print("Saved baseline to %s" % path)
+
+
+def compare_baseline(path, results, threshold):
+    """
+    Compare results against the baseline saved at path. Anything whose
+    ops/sec dropped, or whose peak memory grew, by more than threshold
+    (a fraction like 0.1) is reported as a regression.
+
+    :returns: List of regression description strings
+    """
+    baseline = json.load(open(path))["results"]
+    regressions = []
+
+    print("\nComparing against baseline %s" % path)
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        new = results[name]
+        old = baseline[name]
+
+        speed = 0
+        if old["ops_per_sec"]:
+            speed = (new["ops_per_sec"] / old["ops_per_sec"]) - 1
+        mem = 0
+        if old["peak_kib"]:
+            mem = (new["peak_kib"] / old["peak_kib"]) - 1
+
+        flag = ""
+        if speed < -threshold:
+            flag = "SLOWER"
+        elif mem > threshold:
+            flag = "MORE MEMORY"
+        if flag:
+            regressions.append("%s: %+.1f%% ops/sec, %+.1f%% peak memory" %
+                               (name, speed * 100, mem * 100))
+
+        print("%-32s %+8.1f%% ops/sec %+8.1f%% peak %s" %
+              (name, speed * 100, mem * 100, flag))
+
+    return regressions
+
+
+def main(iterations, only=None, save=None, compare=None, threshold=0.1):
+    results = run_benchmarks(iterations, only=only)
+
+    regressions = []
+    if compare:
+        regressions = compare_baseline(compare, results, threshold)
+    if save:
+        save_baseline(save, results)
+
+    if regressions:
+        print("\nFound %d regression(s):" % len(regressions))
+        for r in regressions:
+            print("  %s" % r)
+        return 1
+    return 0
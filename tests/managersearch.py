@@ -0,0 +1,58 @@
+# Copyright (C) 2019 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+import unittest
+
+try:
+    import gi
+    gi.require_version("Gtk", "3.0")
+    from virtManager.manager import _SearchIndex
+except (ImportError, ValueError):
+    _SearchIndex = None
+
+
+@unittest.skipIf(_SearchIndex is None, "virtManager UI modules not available")
+class TestSearchIndex(unittest.TestCase):
+    """
+    Test the type-ahead search index of the manager VM list
+    """
+    def _make_index(self):
+        index = _SearchIndex()
+        index.set("fedora", "Fedora", "Fedora Workstation 30")
+        index.set("debian", "debian10", None)
+        index.set("win", "Windows", "Windows 10 desktop")
+        return index
+
+    def testSearch(self):
+        index = self._make_index()
+        self.assertEqual(index.search("FED"), {"fedora"})
+        self.assertEqual(index.search(" 10 "), {"debian", "win"})
+        self.assertEqual(index.search("desktop"), {"win"})
+        self.assertEqual(index.search("nomatch"), set())
+        self.assertEqual(index.search(""), {"fedora", "debian", "win"})
+
+    def testNarrowing(self):
+        index = self._make_index()
+        self.assertEqual(index.search("d"), {"fedora", "debian", "win"})
+        self.assertEqual(index.search("de"), {"debian", "win"})
+        self.assertEqual(index.search("deb"), {"debian"})
+
+        # Deleting a character has to search everything again
+        self.assertEqual(index.search("de"), {"debian", "win"})
+        self.assertEqual(index.search("w"), {"fedora", "win"})
+
+    def testChangesResetNarrowing(self):
+        index = self._make_index()
+        self.assertEqual(index.search("win"), {"win"})
+
+        # A new or changed row must be found by the next, narrower query
+        index.set("fedora", "Fedora", "Windows guest tools")
+        self.assertEqual(index.search("wind"), {"fedora", "win"})
+
+        index.remove("win")
+        self.assertEqual(index.search("windo"), {"fedora"})
+
+        index.clear()
+        self.assertEqual(index.search("windo"), set())
@@ -0,0 +1,165 @@
+# Copyright (C) 2019 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+import random
+import unittest
+
+from virtManager import statsanalysis
+
+
+class _FakeVM(object):
+    def __init__(self, connkey, cpu=0, memory=0, disk=0, net=0):
+        self.connkey = connkey
+        self.active = True
+        self.cpu = cpu
+        self.memory = memory
+        self.disk = disk
+        self.net = net
+
+    def get_connkey(self):
+        return self.connkey
+    def is_active(self):
+        return self.active
+    def host_cpu_time_percentage(self):
+        return self.cpu
+    def stats_memory_percentage(self):
+        return self.memory
+    def disk_io_rate(self):
+        return self.disk
+    def network_traffic_rate(self):
+        return self.net
+
+
+class TestStatsAnalysis(unittest.TestCase):
+    """
+    Tests for the top-N heap and threshold rules in statsanalysis.py
+    """
+    # pylint: disable=protected-access
+
+    def _check_heap(self, heap, expected):
+        # Every parent is at least as big as its children, and every
+        # key knows its own position
+        entries = heap._heap
+        for idx, (value, key) in enumerate(entries):
+            self.assertEqual(heap._pos[key], idx)
+            if idx:
+                self.assertTrue(entries[(idx - 1) // 2][0] >= value)
+        self.assertEqual(len(heap), len(expected))
+
+        ordered = sorted(expected.items(), key=lambda i: -i[1])
+        self.assertEqual(heap.top(len(expected) + 1), ordered)
+        self.assertEqual(heap.top(3), ordered[:3])
+
+    def testHeapUpdate(self):
+        heap = statsanalysis._IndexedHeap()
+        self.assertEqual(heap.top(5), [])
+
+        expected = {}
+        for key, value in [("a", 5), ("b", 1), ("c", 9), ("d", 3)]:
+            heap.update(key, value)
+            expected[key] = value
+        self._check_heap(heap, expected)
+
+        # Moving up, down, and staying put
+        for key, value in [("b", 20), ("c", 0), ("a", 5)]:
+            heap.update(key, value)
+            expected[key] = value
+            self._check_heap(heap, expected)
+
+    def testHeapRemove(self):
+        heap = statsanalysis._IndexedHeap()
+        expected = {}
+        for idx in range(10):
+            heap.update(idx, idx * 10)
+            expected[idx] = idx * 10
+
+        # Missing key, the root, a leaf, and something in between
+        for key in ["nosuchkey", 9, 0, 4]:
+            heap.remove(key)
+            expected.pop(key, None)
+            self._check_heap(heap, expected)
+
+        for key in list(expected):
+            heap.remove(key)
+        self.assertEqual(len(heap), 0)
+        self.assertEqual(heap.top(5), [])
+
+    def testHeapRandom(self):
+        rand = random.Random(1234)
+        heap = statsanalysis._IndexedHeap()
+        expected = {}
+        for ignore in range(500):
+            key = rand.randrange(50)
+            if rand.random() < 0.2:
+                heap.remove(key)
+                expected.pop(key, None)
+            else:
+                # Unique values, so the top order is well defined
+                value = rand.random()
+                heap.update(key, value)
+                expected[key] = value
+        self._check_heap(heap, expected)
+
+    def testRuleParse(self):
+        rule = statsanalysis.StatsRule(" cpu > 90 : 75 ")
+        self.assertEqual(rule.rulestr, "cpu > 90 : 75")
+        self.assertEqual(rule.metric, "cpu")
+        self.assertEqual(rule.raise_value, 90)
+        self.assertEqual(rule.clear_value, 75)
+
+        # Clear value defaults to 90% of the raise value, and can't be
+        # above it
+        self.assertEqual(statsanalysis.StatsRule("net>1000").clear_value,
+                         900)
+        self.assertEqual(statsanalysis.StatsRule("disk>10:50").clear_value,
+                         10)
+
+        for rulestr in ["cpu", "cpu<90", "cpu>", "foo>10", "cpu>1:2:3"]:
+            self.assertRaises(ValueError, statsanalysis.StatsRule, rulestr)
+
+    def testRuleHysteresis(self):
+        rule = statsanalysis.StatsRule("cpu>90:75")
+        active = False
+        results = []
+        for value in [50, 90, 91, 80, 75, 74.9, 80, 90.5]:
+            active = rule.evaluate(value, active)
+            results.append(active)
+        self.assertEqual(results,
+                         [False, False, True, True, True, False, False, True])
+
+    def testAnalyzer(self):
+        analyzer = statsanalysis.StatsAnalyzer()
+        analyzer.set_rules(["cpu>90:75", "memory>80", "bogus"])
+
+        vm1 = _FakeVM("vm1", cpu=95, disk=10)
+        vm2 = _FakeVM("vm2", cpu=50, disk=30, memory=85)
+        self.assertEqual(analyzer.update_vm(vm1), [("cpu>90:75", True)])
+        self.assertEqual(analyzer.update_vm(vm2), [("memory>80", True)])
+        self.assertEqual(analyzer.get_top("cpu"), [("vm1", 95), ("vm2", 50)])
+        self.assertEqual(analyzer.get_top("disk"), [("vm2", 30), ("vm1", 10)])
+        self.assertTrue(analyzer.check_top_changed())
+        self.assertFalse(analyzer.check_top_changed())
+
+        # Inside the hysteresis band nothing changes
+        vm1.cpu = 80
+        self.assertEqual(analyzer.update_vm(vm1), [])
+        self.assertEqual(analyzer.get_alerts("vm1"), ["cpu>90:75"])
+        vm1.cpu = 10
+        self.assertEqual(analyzer.update_vm(vm1), [("cpu>90:75", False)])
+        self.assertEqual(analyzer.get_alerts("vm1"), [])
+        self.assertTrue(analyzer.check_top_changed())
+
+        # Dropping a rule drops its alerts
+        analyzer.set_rules(["cpu>90:75"])
+        self.assertEqual(analyzer.get_alerts("vm2"), [])
+
+        # A VM that stops clears its alerts and leaves the top lists
+        vm1.cpu = 99
+        analyzer.update_vm(vm1)
+        vm1.active = False
+        self.assertEqual(analyzer.update_vm(vm1), [("cpu>90:75", False)])
+        self.assertEqual(analyzer.get_top("cpu"), [("vm2", 50)])
+        self.assertEqual(analyzer.remove_vm("vm2"), [])
+        self.assertEqual(analyzer.get_top("cpu"), [])
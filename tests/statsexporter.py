@@ -0,0 +1,70 @@
+# Copyright (C) 2019 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+import unittest
+
+try:
+    import gi
+    gi.require_version("Gtk", "3.0")
+    from virtManager import statsexporter
+except (ImportError, ValueError):
+    statsexporter = None
+
+
+@unittest.skipIf(statsexporter is None,
+                 "virtManager UI modules not available")
+class TestStatsExporter(unittest.TestCase):
+    """
+    Test the OpenMetrics text formatting of the stats exporter
+    """
+    # pylint: disable=protected-access
+
+    def testFormat(self):
+        writer = statsexporter._MetricsWriter()
+        writer.add("connection_ticks", "counter", "Number of ticks",
+                   [("uri", "qemu:///system")], 12)
+        writer.add("domain_memory_kib", "gauge", "Memory in use",
+                   [("uri", "qemu:///system"), ("domain", "vm1")], 1024)
+        writer.add("connection_ticks", "counter", "Number of ticks",
+                   [("uri", "test:///default")], 3)
+        writer.add("domain_memory_kib", "gauge", "Memory in use",
+                   [("uri", "qemu:///system"), ("domain", "vm2")], 0.5)
+
+        # Samples are grouped by family in the order they were first
+        # added, counters get _total, and the output ends with # EOF
+        self.assertEqual(writer.format(),
+            "# TYPE virt_manager_connection_ticks counter\n"
+            "# HELP virt_manager_connection_ticks Number of ticks\n"
+            "virt_manager_connection_ticks_total"
+            "{uri=\"qemu:///system\"} 12.0\n"
+            "virt_manager_connection_ticks_total"
+            "{uri=\"test:///default\"} 3.0\n"
+            "# TYPE virt_manager_domain_memory_kib gauge\n"
+            "# HELP virt_manager_domain_memory_kib Memory in use\n"
+            "virt_manager_domain_memory_kib"
+            "{uri=\"qemu:///system\",domain=\"vm1\"} 1024.0\n"
+            "virt_manager_domain_memory_kib"
+            "{uri=\"qemu:///system\",domain=\"vm2\"} 0.5\n"
+            "# EOF\n")
+
+        self.assertEqual(statsexporter._MetricsWriter().format(), "# EOF\n")
+
+    def testLabelEscaping(self):
+        writer = statsexporter._MetricsWriter()
+        writer.add("domain_memory_kib", "gauge", "Memory in use",
+                   [("domain", "a\\b \"c\"\nd")], 1)
+        self.assertEqual(writer.format().splitlines()[2],
+            "virt_manager_domain_memory_kib"
+            "{domain=\"a\\\\b \\\"c\\\"\\nd\"} 1.0")
+
+    def testValues(self):
+        for value, expected in [
+                (float("inf"), "+Inf"),
+                (float("-inf"), "-Inf"),
+                (float("nan"), "NaN"),
+                (0, "0.0"),
+                (-1.5, "-1.5"),
+                (10 ** 20, "1e+20")]:
+            self.assertEqual(statsexporter._format_value(value), expected)
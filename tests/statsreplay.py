@@ -0,0 +1,131 @@
+# Copyright (C) 2019 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from virtManager import statsreplay
+
+
+_UUID1 = "00000000-1111-2222-3333-444444444444"
+_UUID2 = "00000000-1111-2222-3333-555555555555"
+
+
+class _FakeVM(object):
+    def __init__(self, uuid):
+        self.uuid = uuid
+
+    def get_uuid(self):
+        return self.uuid
+
+
+def _make_stats(timestamp, cputime, rdbytes):
+    return {"virt-manager.timestamp": timestamp,
+            "virt-manager.statflags": 3,
+            "state.state": 1,
+            "cpu.time": cputime,
+            "block.count": 1,
+            "block.0.name": "vda",
+            "block.0.rd.bytes": rdbytes}
+
+
+class TestStatsReplay(unittest.TestCase):
+    """
+    Tests for stats recording and replay
+    """
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp(prefix="virtmanager-statsreplay")
+        self._path = os.path.join(self._tmpdir, "stats.json.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def _record(self, ticks, otheruri=None):
+        recorder = statsreplay.StatsRecorder(self._path)
+        for timestamp, allstats in ticks:
+            recorder.record("test:///default", timestamp, 0.01, allstats)
+            if otheruri:
+                # Only the first recorded connection is replayed
+                recorder.record(otheruri, timestamp, 0.01,
+                        {_UUID1: _make_stats(timestamp, -1, -1)})
+        recorder.close()
+        # Closing twice, or recording after close, is harmless
+        recorder.close()
+        recorder.record("test:///default", 0, 0, {})
+
+    def _strip_timestamp(self, domstats):
+        domstats = dict(domstats)
+        return domstats.pop("virt-manager.timestamp"), domstats
+
+    def testRoundtrip(self):
+        ticks = []
+        for idx in range(3):
+            timestamp = 1000.0 + idx * 2
+            ticks.append((timestamp, {
+                _UUID1: _make_stats(timestamp, idx * 100, idx * 4096),
+                _UUID2: _make_stats(timestamp, idx * 200, 0),
+            }))
+        self._record(ticks, otheruri="test:///other")
+
+        replayer = statsreplay.StatsReplayer(self._path,
+                                             simulate_latency=False)
+        vms = [_FakeVM(_UUID1), _FakeVM(_UUID2)]
+
+        # Two passes, to cover looping back to the start
+        replayed = [replayer.next_stats(vms) for ignore in range(6)]
+        start = replayed[0][_UUID1]["virt-manager.timestamp"]
+        for idx, allstats in enumerate(replayed):
+            origtimestamp, origstats = ticks[idx % 3]
+            self.assertEqual(sorted(allstats), sorted(origstats))
+            for uuid, domstats in allstats.items():
+                timestamp, domstats = self._strip_timestamp(domstats)
+                ignore, expected = self._strip_timestamp(origstats[uuid])
+                self.assertEqual(domstats, expected)
+
+                # Recorded tick spacing is kept, and the second pass
+                # carries on one tick interval after the first
+                self.assertAlmostEqual(timestamp - start,
+                        (origtimestamp - 1000) + (idx // 3) * 6)
+
+    def testMapping(self):
+        timestamp = 1000.0
+        self._record([(timestamp, {
+            _UUID1: _make_stats(timestamp, 1, 1),
+            _UUID2: _make_stats(timestamp, 2, 2),
+        })])
+
+        # Recorded domains are spread over however many VMs are running
+        replayer = statsreplay.StatsReplayer(self._path,
+                                             simulate_latency=False)
+        vms = [_FakeVM("uuid-%d" % idx) for idx in range(5)]
+        ret = replayer.next_stats(vms)
+        self.assertEqual(sorted(ret), sorted(vm.get_uuid() for vm in vms))
+        self.assertEqual([ret[vm.get_uuid()]["cpu.time"] for vm in vms],
+                         [1, 2, 1, 2, 1])
+
+        self.assertEqual(replayer.next_stats([]), {})
+
+    def testTruncated(self):
+        self._record([(1000.0, {_UUID1: _make_stats(1000.0, 1, 1)}),
+                      (1001.0, {_UUID1: _make_stats(1001.0, 2, 2)})])
+        with gzip.open(self._path, "rt") as f:
+            data = f.read()
+        with gzip.open(self._path, "wt") as f:
+            f.write(data[:-10])
+
+        # Everything up to the broken line is still used
+        replayer = statsreplay.StatsReplayer(self._path,
+                                             simulate_latency=False)
+        vms = [_FakeVM(_UUID1)]
+        self.assertEqual(replayer.next_stats(vms)[_UUID1]["cpu.time"], 1)
+        self.assertEqual(replayer.next_stats(vms)[_UUID1]["cpu.time"], 1)
+
+    def testBadVersion(self):
+        with gzip.open(self._path, "wt") as f:
+            f.write('{"version": 1000}\n')
+        self.assertRaises(ValueError, statsreplay.StatsReplayer, self._path)
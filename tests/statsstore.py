@@ -0,0 +1,149 @@
+# Copyright (C) 2019 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from virtManager import statsstore
+
+
+# Hour aligned, so every tier's buckets start here
+_BASE = 36000.0
+
+
+class TestStatsStore(unittest.TestCase):
+    """
+    Tests for the on disk round robin stats history
+    """
+    def setUp(self):
+        self._origtiers = statsstore.TIERS[:]
+        # Small tiers so wraparound is quick to hit
+        statsstore.TIERS[:] = [
+            ("raw", 0, 5),
+            ("minute", 60, 4),
+            ("hour", 3600, 3),
+        ]
+        self._tmpdir = tempfile.mkdtemp(prefix="virtmanager-statsstore")
+        self._path = os.path.join(self._tmpdir, "vm", "history")
+
+    def tearDown(self):
+        statsstore.TIERS[:] = self._origtiers
+        shutil.rmtree(self._tmpdir)
+
+    def _make_store(self, columns=None):
+        store = statsstore.StatsStore(self._path, columns or ["a", "b"])
+        self.addCleanup(store.close)
+        return store
+
+    def testEmpty(self):
+        store = self._make_store()
+        tiername, timestamps, values = store.fetch(0, _BASE)
+        self.assertEqual(tiername, "hour")
+        self.assertEqual(timestamps, [])
+        self.assertEqual(values, {"a": [], "b": []})
+        self.assertTrue(os.path.exists(self._path))
+
+    def testDownsample(self):
+        store = self._make_store()
+        for offset, value in [(0, 1), (20, 2), (40, 3), (60, 10)]:
+            store.append(_BASE + offset, {"a": value, "b": value * 2})
+
+        self.assertEqual(store.fetch(_BASE, _BASE + 1000),
+                ("raw", [_BASE, _BASE + 20, _BASE + 40, _BASE + 60],
+                 {"a": [1, 2, 3, 10], "b": [2, 4, 6, 20]}))
+
+        # The finished minute is averaged, the current one is the
+        # average so far
+        self.assertEqual(store.fetch(_BASE, _BASE + 1000, resolution=60),
+                ("minute", [_BASE, _BASE + 60],
+                 {"a": [2, 10], "b": [4, 20]}))
+        self.assertEqual(store.fetch(_BASE, _BASE + 1000, resolution=3600),
+                ("hour", [_BASE], {"a": [4], "b": [8]}))
+
+        # Asking for more than the coarsest tier gives the coarsest
+        self.assertEqual(store.fetch(_BASE, _BASE + 1000,
+                                     resolution=86400)[0], "hour")
+
+    def testMissingValues(self):
+        store = self._make_store()
+        store.append(_BASE, {"a": 5, "b": None})
+        store.append(_BASE + 1, {"a": 6})
+        self.assertEqual(store.fetch(_BASE, _BASE + 1)[2],
+                         {"a": [5, 6], "b": [0, 0]})
+
+    def testWraparound(self):
+        store = self._make_store()
+        for idx in range(8):
+            store.append(_BASE + idx, {"a": idx, "b": 0})
+
+        # Only the newest 5 raw samples are left, oldest first
+        tiername, timestamps, values = store.fetch(_BASE + 3, _BASE + 100)
+        self.assertEqual(tiername, "raw")
+        self.assertEqual(timestamps, [_BASE + idx for idx in range(3, 8)])
+        self.assertEqual(values["a"], [3, 4, 5, 6, 7])
+
+        # Only part of the range
+        self.assertEqual(store.fetch(_BASE + 4, _BASE + 5)[1],
+                         [_BASE + 4, _BASE + 5])
+
+        # Raw doesn't go back far enough anymore, so the minute tier
+        # is used, with its in progress average
+        self.assertEqual(store.fetch(_BASE, _BASE + 100),
+                ("minute", [_BASE], {"a": [3.5], "b": [0]}))
+
+    def testTierWraparound(self):
+        store = self._make_store()
+        for idx in range(6):
+            store.append(_BASE + idx * 60, {"a": idx, "b": 0})
+
+        # Minutes 0-4 were flushed to a 4 slot ring, 5 is in progress
+        tiername, timestamps, values = store.fetch(
+                _BASE + 60, _BASE + 1000, resolution=60)
+        self.assertEqual(tiername, "minute")
+        self.assertEqual(timestamps,
+                         [_BASE + idx * 60 for idx in range(1, 6)])
+        self.assertEqual(values["a"], [1, 2, 3, 4, 5])
+
+        # Minute 0 is gone from there, but the hour average has it
+        self.assertEqual(store.fetch(_BASE, _BASE + 1000, resolution=60),
+                ("hour", [_BASE], {"a": [2.5], "b": [0]}))
+
+    def testReopen(self):
+        store = self._make_store()
+        for offset, value in [(0, 1), (20, 2), (60, 3)]:
+            store.append(_BASE + offset, {"a": value, "b": value})
+        before = [store.fetch(_BASE, _BASE + 100, resolution=res)
+                  for res in [None, 60, 3600]]
+        store.close()
+        self.assertFalse(store.is_open())
+
+        # Data and in progress averages survive reopening
+        store = self._make_store()
+        after = [store.fetch(_BASE, _BASE + 100, resolution=res)
+                 for res in [None, 60, 3600]]
+        self.assertEqual(before, after)
+
+        store.append(_BASE + 80, {"a": 5, "b": 5})
+        self.assertEqual(store.fetch(_BASE, _BASE + 100, resolution=60)[2],
+                         {"a": [1.5, 4], "b": [1.5, 4]})
+
+    def testColumnsChanged(self):
+        store = self._make_store()
+        store.append(_BASE, {"a": 1, "b": 2})
+        store.close()
+
+        # Same number of columns, so only the checksum differs
+        store = self._make_store(["a", "c"])
+        self.assertEqual(store.fetch(0, _BASE + 100)[1], [])
+        store.append(_BASE + 1, {"a": 3, "c": 4})
+        store.close()
+
+        # Different file size
+        store = self._make_store(["a"])
+        self.assertEqual(store.fetch(0, _BASE + 100)[1], [])
+        store.append(_BASE + 2, {"a": 5})
+        self.assertEqual(store.fetch(0, _BASE + 100)[2], {"a": [5]})
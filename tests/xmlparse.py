@@ -1504,3 +1504,109 @@ class XMLParseTest(unittest.TestCase):
         guest = virtinst.Guest(self.conn, parsexml=open(infile).read())
 
         utils.diff_compare(guest.get_xml(), outfile)
+
+    def testXPathCache(self):
+        # Repeated property reads should be served from the xpath cache
+        infile = "tests/xmlparse-xml/domain-roundtrip.xml"
+        guest = virtinst.Guest(self.conn, parsexml=open(infile).read())
+
+        ignore = guest.name
+        before = virtinst.xmlapi.get_xpath_cache_stats()
+        ignore = guest.name
+        after = virtinst.xmlapi.get_xpath_cache_stats()
+        self.assertEqual(after["misses"], before["misses"])
+        self.assertTrue(after["hits"] > before["hits"])
+        self.assertTrue(after["size"] <= after["maxsize"])
+
+    def testNodeCacheInvalidation(self):
+        # Looked up nodes are cached per document, every change must
+        # be visible to the next lookup
+        xml = ("<domain>\n"
+               "  <name>foo</name>\n"
+               "  <devices>\n"
+               "    <disk device='disk'>\n"
+               "      <target dev='vda'/>\n"
+               "    </disk>\n"
+               "  </devices>\n"
+               "</domain>\n")
+        api = virtinst.xmlapi.XMLAPI(xml)
+        diskxpath = "./devices/disk[@device='disk']/target/@dev"
+        cdromxpath = "./devices/disk[@device='cdrom']/target/@dev"
+        self.assertEqual(api.get_xpath_content(diskxpath, False), "vda")
+        self.assertEqual(api.get_xpath_content(cdromxpath, False), None)
+
+        # Text change
+        self.assertEqual(api.get_xpath_content("./name", False), "foo")
+        api.set_xpath_content("./name", "bar")
+        self.assertEqual(api.get_xpath_content("./name", False), "bar")
+
+        # Changing the attribute flips which condition matches
+        api.set_xpath_content("./devices/disk/@device", "cdrom")
+        self.assertEqual(api.get_xpath_content(diskxpath, False), None)
+        self.assertEqual(api.get_xpath_content(cdromxpath, False), "vda")
+        api.set_xpath_content(cdromxpath, "hdc")
+        self.assertEqual(api.get_xpath_content(cdromxpath, False), "hdc")
+
+        # Removing and adding nodes
+        api.node_force_remove("./devices/disk[@device='cdrom']")
+        self.assertEqual(api.get_xpath_content(cdromxpath, False), None)
+        api.node_add_xml("<disk device='disk'><target dev='vdb'/></disk>",
+                         "./devices")
+        self.assertEqual(api.get_xpath_content(diskxpath, False), "vdb")
+
+        # Clearing a node drops its attributes
+        api.node_clear("./devices/disk")
+        self.assertEqual(api.get_xpath_content(
+            "./devices/disk/@device", False), None)
+        self.assertEqual(api.get_xpath_content(diskxpath, False), None)
+
+    def testLazyChildParse(self):
+        # Child objects should only be built when first accessed
+        infile = "tests/xmlparse-xml/change-disk-in.xml"
+        guest = virtinst.Guest(self.conn, parsexml=open(infile).read())
+        self.assertTrue("devices" not in guest._propstore)
+
+        ignore = guest.name
+        self.assertTrue("devices" not in guest._propstore)
+
+        disks = guest.devices.disk
+        self.assertTrue("disk" in guest.devices._propstore)
+        self.assertTrue("interface" not in guest.devices._propstore)
+        self.assertTrue(len(disks) > 1)
+
+        # Removing a device must still leave unparsed siblings pointing
+        # at the correct XML nodes
+        guest = virtinst.Guest(self.conn, parsexml=open(infile).read())
+        paths = [d.path for d in guest.devices.disk]
+        guest = virtinst.Guest(self.conn, parsexml=open(infile).read())
+        guest.remove_device(guest.devices.disk[0])
+        self.assertEqual([d.path for d in guest.devices.disk], paths[1:])
+
+    def testXMLAPIBackends(self):
+        # Every available XML backend should roundtrip identically
+        origbackend = virtinst.xmlapi.get_xmlapi_backend()
+        try:
+            for backend in virtinst.xmlapi.get_available_xmlapi_backends():
+                virtinst.xmlapi.set_xmlapi_backend(backend)
+                self._roundtrip_compare(
+                        "tests/xmlparse-xml/domain-roundtrip.xml")
+        finally:
+            virtinst.xmlapi.set_xmlapi_backend(origbackend)
+
+        self.assertRaises(ValueError,
+                virtinst.xmlapi.set_xmlapi_backend, "fakebackend")
+
+
+@unittest.skipIf("lxml" not in
+                 virtinst.xmlapi.get_available_xmlapi_backends(),
+                 "lxml not installed")
+class XMLParseLxmlTest(XMLParseTest):
+    """
+    Run the whole XMLParseTest suite again with the lxml XML backend
+    """
+    def setUp(self):
+        self._origbackend = virtinst.xmlapi.get_xmlapi_backend()
+        virtinst.xmlapi.set_xmlapi_backend("lxml")
+
+    def tearDown(self):
+        virtinst.xmlapi.set_xmlapi_backend(self._origbackend)
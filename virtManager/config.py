@@ -105,6 +105,56 @@ class _SettingsWrapper(object):
                                   *args, **kwargs)
 
 
+class _StatsConfig(object):
+    """
+    Typed, in process copy of the stats settings that are read from the
+    polling hot path, once per VM per tick. Values are refreshed by
+    gsettings change notifications, so readers only pay for a plain
+    attribute lookup instead of a gsettings get_value().unpack().
+    """
+    # attribute name -> (gsettings key, conversion function)
+    _KEYS = {
+        "update_interval": ("/stats/update-interval", int),
+        "adaptive_interval": ("/stats/adaptive-interval", bool),
+        "adaptive_interval_min": ("/stats/adaptive-interval-min", int),
+        "adaptive_interval_max": ("/stats/adaptive-interval-max", int),
+        "enable_cpu_poll": ("/stats/enable-cpu-poll", bool),
+        "enable_disk_poll": ("/stats/enable-disk-poll", bool),
+        "enable_net_poll": ("/stats/enable-net-poll", bool),
+        "enable_memory_poll": ("/stats/enable-memory-poll", bool),
+        "persistent_history": ("/stats/persistent-history", bool),
+        "alert_rules": ("/stats/alert-rules", tuple),
+    }
+
+    # Not a gsettings key, but read just as often
+    history_length = 120
+
+    def __init__(self, conf):
+        self._conf = conf
+
+        self.update_interval = 1
+        self.adaptive_interval = False
+        self.adaptive_interval_min = 1
+        self.adaptive_interval_max = 1
+        self.enable_cpu_poll = False
+        self.enable_disk_poll = False
+        self.enable_net_poll = False
+        self.enable_memory_poll = False
+        self.persistent_history = False
+        self.alert_rules = ()
+
+        # Registered before anyone else can connect to these keys, so
+        # the snapshot is already current when their callbacks run
+        for attrname in self._KEYS:
+            self._refresh(attrname)
+            self._conf.notify_add(self._KEYS[attrname][0],
+                                  self._refresh, attrname)
+
+    def _refresh(self, attrname):
+        key, convert = self._KEYS[attrname]
+        setattr(self, attrname, convert(self._conf.get(key)))
+
+
 class vmmConfig(object):
     # key names for saving last used paths
     CONFIG_DIR_IMAGE = "image"
@@ -169,6 +219,7 @@ class vmmConfig(object):
         self.test_leak_debug = False
 
         self.conf = _SettingsWrapper("org.virt-manager.virt-manager")
+        self.stats = _StatsConfig(self.conf)
 
         # We don't create it straight away, since we don't want
         # to block the app pending user authorization to access
@@ -291,6 +342,13 @@ class vmmConfig(object):
     def set_vmlist_network_traffic_visible(self, state):
         self.conf.set("/vmlist-fields/network-traffic", state)
 
+    def is_vmlist_flat(self):
+        return self.conf.get("/vmlist-fields/flat-list")
+    def set_vmlist_flat(self, state):
+        self.conf.set("/vmlist-fields/flat-list", state)
+    def on_vmlist_flat_changed(self, cb):
+        return self.conf.notify_add("/vmlist-fields/flat-list", cb)
+
     def on_vmlist_guest_cpu_usage_visible_changed(self, cb):
         return self.conf.notify_add("/vmlist-fields/cpu-usage", cb)
     def on_vmlist_host_cpu_usage_visible_changed(self, cb):
@@ -375,27 +433,65 @@ class vmmConfig(object):
 
     # Stats history and interval length
     def get_stats_history_length(self):
-        return 120
+        return self.stats.history_length
     def get_stats_update_interval(self):
-        interval = self.conf.get("/stats/update-interval")
-        if interval < 1:
-            return 1
-        return interval
+        return max(1, self.stats.update_interval)
     def set_stats_update_interval(self, interval):
         self.conf.set("/stats/update-interval", interval)
     def on_stats_update_interval_changed(self, cb):
         return self.conf.notify_add("/stats/update-interval", cb)
 
+    # Per connection adaptive update interval
+    def get_stats_adaptive_interval(self):
+        return self.stats.adaptive_interval
+    def get_stats_adaptive_interval_min(self):
+        return max(1, self.stats.adaptive_interval_min)
+    def get_stats_adaptive_interval_max(self):
+        return max(self.get_stats_adaptive_interval_min(),
+                   self.stats.adaptive_interval_max)
+    def set_stats_adaptive_interval(self, val):
+        self.conf.set("/stats/adaptive-interval", val)
+    def set_stats_adaptive_interval_min(self, val):
+        self.conf.set("/stats/adaptive-interval-min", val)
+    def set_stats_adaptive_interval_max(self, val):
+        self.conf.set("/stats/adaptive-interval-max", val)
+    def on_stats_adaptive_interval_changed(self, cb):
+        return self.conf.notify_add("/stats/adaptive-interval", cb)
+    def on_stats_adaptive_interval_min_changed(self, cb):
+        return self.conf.notify_add("/stats/adaptive-interval-min", cb)
+
+    # On disk stats history
+    def get_stats_persistent_history(self):
+        return self.stats.persistent_history
+    def set_stats_persistent_history(self, val):
+        self.conf.set("/stats/persistent-history", val)
+    def on_stats_persistent_history_changed(self, cb):
+        return self.conf.notify_add("/stats/persistent-history", cb)
+
+    # Stats threshold alert rules, like 'cpu>90:75'
+    def get_stats_alert_rules(self):
+        return list(self.stats.alert_rules)
+    def set_stats_alert_rules(self, val):
+        self.conf.set("/stats/alert-rules", val)
+
+    # OpenMetrics exporter listen address
+    def get_stats_exporter_address(self):
+        return self.conf.get("/stats/exporter-address")
+    def set_stats_exporter_address(self, val):
+        self.conf.set("/stats/exporter-address", val)
+    def on_stats_exporter_address_changed(self, cb):
+        return self.conf.notify_add("/stats/exporter-address", cb)
+
 
     # Disable/Enable different stats polling
     def get_stats_enable_cpu_poll(self):
-        return self.conf.get("/stats/enable-cpu-poll")
+        return self.stats.enable_cpu_poll
     def get_stats_enable_disk_poll(self):
-        return self.conf.get("/stats/enable-disk-poll")
+        return self.stats.enable_disk_poll
     def get_stats_enable_net_poll(self):
-        return self.conf.get("/stats/enable-net-poll")
+        return self.stats.enable_net_poll
     def get_stats_enable_memory_poll(self):
-        return self.conf.get("/stats/enable-memory-poll")
+        return self.stats.enable_memory_poll
 
     def set_stats_enable_cpu_poll(self, val):
         self.conf.set("/stats/enable-cpu-poll", val)
@@ -587,7 +683,25 @@ class vmmConfig(object):
         self.conf.set("/manager-window-width", w)
         self.conf.set("/manager-window-height", h)
 
+    # Max manager list redraws per second, 0 means once per frame
+    def get_manager_update_rate(self):
+        return max(0, self.conf.get("/manager-update-rate"))
+    def set_manager_update_rate(self, val):
+        self.conf.set("/manager-update-rate", val)
+    def on_manager_update_rate_changed(self, cb):
+        return self.conf.notify_add("/manager-update-rate", cb)
+
     # URI autoconnect
+    def get_conn_progressive_load(self):
+        return self.conf.get("/connections/progressive-load")
+    def set_conn_progressive_load(self, val):
+        self.conf.set("/connections/progressive-load", val)
+
+    def get_conn_init_workers(self):
+        return max(1, self.conf.get("/connections/init-workers"))
+    def set_conn_init_workers(self, val):
+        self.conf.set("/connections/init-workers", val)
+
     def get_conn_autoconnect(self, uri):
         uris = self.conf.get("/connections/autoconnect")
         return ((uris is not None) and (uri in uris))
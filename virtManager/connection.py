@@ -4,6 +4,7 @@
 # This work is licensed under the GNU GPLv2 or later.
 # See the COPYING file in the top-level directory.
 
+import collections
 import logging
 import os
 import threading
@@ -43,12 +44,20 @@ class _ObjectList(vmmGObject):
     def __init__(self):
         vmmGObject.__init__(self)
 
-        self._objects = []
+        # Maps object class -> OrderedDict of connkey -> object
+        self._objects = {}
+        # Maps object -> the connkey it is indexed under in _objects
+        self._keys = {}
+        # Maps object class -> dict of connkey -> object, for objects
+        # that are queued for init but not added yet
+        self._pending = {}
         self._blacklist = {}
         self._lock = threading.Lock()
 
     def _cleanup(self):
-        self._objects = []
+        self._objects = {}
+        self._keys = {}
+        self._pending = {}
 
     def _blacklist_key(self, obj):
         return str(obj.__class__) + obj.get_connkey()
@@ -84,6 +93,44 @@ class _ObjectList(vmmGObject):
         """
         return self._blacklist.get(self._blacklist_key(obj), 0) > _ObjectList.BLACKLIST_COUNT
 
+    def _rekey(self, obj):
+        """
+        Move obj in the index to its current connkey, if it changed.
+        Must be called with the lock held
+        """
+        oldkey = self._keys.get(obj)
+        newkey = obj.get_connkey()
+        if oldkey is None or oldkey == newkey:
+            return
+
+        objmap = self._objects[obj.__class__]
+        if objmap.get(oldkey) is obj:
+            del(objmap[oldkey])
+        objmap[newkey] = obj
+        self._keys[obj] = newkey
+
+    def _lookup(self, classobj, connkey):
+        """
+        Return the object of classobj tracked under connkey. Must be
+        called with the lock held
+        """
+        objmap = self._objects.get(classobj)
+        if not objmap:
+            return None
+        obj = objmap.get(connkey)
+        if obj is not None and obj.get_connkey() != connkey:
+            # Renamed, but rekey() wasn't called yet
+            self._rekey(obj)
+            obj = objmap.get(connkey)
+        return obj
+
+    def rekey(self, obj):
+        """
+        Reindex obj after its connkey changed, which happens on rename
+        """
+        with self._lock:
+            self._rekey(obj)
+
     def remove(self, obj):
         """
         Remove an object from the list.
@@ -94,15 +141,19 @@ class _ObjectList(vmmGObject):
         with self._lock:
             # Identity check is sufficient here, since we should never be
             # asked to remove an object that wasn't at one point in the list.
-            if obj not in self._objects:
+            key = self._keys.get(obj)
+            objmap = self._objects.get(obj.__class__, {})
+            if key is None or objmap.get(key) is not obj:
                 return self.remove_blacklist(obj)
 
-            self._objects.remove(obj)
+            del(objmap[key])
+            del(self._keys[obj])
             return True
 
     def add(self, obj):
         """
-        Add an object to the list.
+        Add an object to the list, moving it out of the pending list
+        if it was there.
 
         :param obj: vmmLibvirtObject to add
         :returns: True if object added, False if object already in the list
@@ -113,36 +164,72 @@ class _ObjectList(vmmGObject):
             #
             # We don't use lookup_object here since we need to hold the
             # lock the whole time to prevent a 'time of check' issue
-            for checkobj in self._objects:
-                if (checkobj.__class__ == obj.__class__ and
-                    checkobj.get_connkey() == obj.get_connkey()):
-                    return False
-            if obj in self._objects:
+            classobj = obj.__class__
+            # Done in the same locked section, so a concurrent poll
+            # always sees the object as either pending or tracked
+            self._remove_pending(obj)
+            if self._lookup(classobj, obj.get_connkey()) is not None:
                 return False
 
-            self._objects.append(obj)
+            if classobj not in self._objects:
+                self._objects[classobj] = collections.OrderedDict()
+            self._objects[classobj][obj.get_connkey()] = obj
+            self._keys[obj] = obj.get_connkey()
             return True
 
+    def add_pending(self, obj):
+        """
+        Track an object that is waiting for its initial XML fetch, so
+        polling doesn't create it again in the meantime
+        """
+        with self._lock:
+            self._pending.setdefault(obj.__class__, {})[
+                obj.get_connkey()] = obj
+
+    def _remove_pending(self, obj):
+        pending = self._pending.get(obj.__class__, {})
+        if pending.get(obj.get_connkey()) is not obj:
+            return False
+        del(pending[obj.get_connkey()])
+        return True
+
+    def remove_pending(self, obj):
+        """
+        :returns: True if obj was pending, False if it was already
+            removed or never added
+        """
+        with self._lock:
+            return self._remove_pending(obj)
+
+    def is_pending(self, obj):
+        with self._lock:
+            pending = self._pending.get(obj.__class__, {})
+            return pending.get(obj.get_connkey()) is obj
+
+    def get_pending_for_class(self, classobj):
+        with self._lock:
+            return list(self._pending.get(classobj, {}).values())
+
     def get_objects_for_class(self, classobj):
         """
         Return all objects over the passed vmmLibvirtObject class
         """
         with self._lock:
-            return [o for o in self._objects if o.__class__ is classobj]
+            return list(self._objects.get(classobj, {}).values())
 
     def lookup_object(self, classobj, connkey):
         """
         Lookup an object with the passed classobj + connkey
         """
-        # Doesn't require locking, since get_objects_for_class covers us
-        for obj in self.get_objects_for_class(classobj):
-            if obj.get_connkey() == connkey:
-                return obj
-        return None
+        with self._lock:
+            return self._lookup(classobj, connkey)
 
     def all_objects(self):
         with self._lock:
-            return self._objects[:]
+            ret = []
+            for objmap in self._objects.values():
+                ret.extend(objmap.values())
+            return ret
 
 
 class vmmConnection(vmmGObject):
@@ -161,6 +248,9 @@ class vmmConnection(vmmGObject):
         "resources-sampled": (vmmGObject.RUN_FIRST, None, []),
         "state-changed": (vmmGObject.RUN_FIRST, None, []),
         "open-completed": (vmmGObject.RUN_FIRST, None, [object]),
+        "stats-alert-changed": (vmmGObject.RUN_FIRST, None,
+                                [str, str, bool]),
+        "top-vms-changed": (vmmGObject.RUN_FIRST, None, []),
     }
 
     (_STATE_DISCONNECTED,
@@ -183,6 +273,13 @@ class vmmConnection(vmmGObject):
 
         self._init_object_count = None
         self._init_object_event = None
+        self._init_progressive = False
+
+        # Queue of new objects waiting for init_libvirt_state, drained
+        # by at most conn/init-workers threads
+        self._init_queue = collections.deque()
+        self._init_workers = 0
+        self._init_lock = threading.Lock()
 
         self._network_capable = None
         self._storage_capable = None
@@ -206,6 +303,13 @@ class vmmConnection(vmmGObject):
         self._stats = []
         self._hostinfo = None
 
+        # Lifecycle events, objects added or removed, and VMs whose
+        # stats changed noticeably, seen by the last tick. Used by the
+        # engine to adapt the poll interval. Events arrive between
+        # ticks, so they are counted separately until the next tick
+        self._tick_activity = 0
+        self._event_activity = 0
+
         self.add_gsettings_handle(
             self._on_config_pretty_name_changed(
                 self._config_pretty_name_changed_cb))
@@ -708,9 +812,17 @@ class vmmConnection(vmmGObject):
                 # Reinsert handle into new obj
                 obj.change_name_backend(newobj)
 
+        self._objects.rekey(obj)
         if newobj and obj.is_domain():
             self.emit("vm-renamed", oldconnkey, obj.get_connkey())
 
+    def object_connkey_changed(self, obj):
+        """
+        Called by vmmLibvirtObject when a failed rename put back the
+        original connkey, so lookups by name keep working
+        """
+        self._objects.rekey(obj)
+
 
     #########################
     # Domain event handling #
@@ -743,6 +855,7 @@ class vmmConnection(vmmGObject):
         name = domain.name()
         logging.debug("domain lifecycle event: domain=%s %s", name,
                 LibvirtEnumMap.domain_lifecycle_str(state, reason))
+        self._event_activity += 1
 
         obj = self.get_vm(name)
 
@@ -758,6 +871,7 @@ class vmmConnection(vmmGObject):
         name = domain.name()
         logging.debug("domain agent lifecycle event: domain=%s %s", name,
                 LibvirtEnumMap.domain_agent_lifecycle_str(state, reason))
+        self._event_activity += 1
 
         obj = self.get_vm(name)
 
@@ -773,6 +887,7 @@ class vmmConnection(vmmGObject):
         name = network.name()
         logging.debug("network lifecycle event: network=%s %s",
                 name, LibvirtEnumMap.network_lifecycle_str(state, reason))
+        self._event_activity += 1
         obj = self.get_net(name)
 
         if obj:
@@ -788,6 +903,7 @@ class vmmConnection(vmmGObject):
         name = pool.name()
         logging.debug("storage pool lifecycle event: pool=%s %s",
             name, LibvirtEnumMap.storage_lifecycle_str(state, reason))
+        self._event_activity += 1
 
         obj = self.get_pool(name)
 
@@ -818,6 +934,7 @@ class vmmConnection(vmmGObject):
         name = dev.name()
         logging.debug("node device lifecycle event: nodedev=%s %s",
             name, LibvirtEnumMap.nodedev_lifecycle_str(state, reason))
+        self._event_activity += 1
 
         self.schedule_priority_tick(pollnodedev=True, force=True)
 
@@ -961,6 +1078,8 @@ class vmmConnection(vmmGObject):
 
         self._stats = []
 
+        with self._init_lock:
+            self._init_queue.clear()
         if self._init_object_event:
             self._init_object_event.clear()
 
@@ -1068,9 +1187,13 @@ class vmmConnection(vmmGObject):
         # trigger after all the polled libvirt objects are fully initialized.
         # That way we only report the connection is open when everything is
         # nicely setup for the rest of the app.
+        #
+        # In progressive mode the event triggers as soon as the objects
+        # are listed, and they are reported as they finish initializing.
 
         self._init_object_event = threading.Event()
         self._init_object_count = 0
+        self._init_progressive = self.config.get_conn_progressive_load()
 
         self.schedule_priority_tick(stats_update=True,
             pollvm=True, pollnet=True,
@@ -1137,6 +1260,8 @@ class vmmConnection(vmmGObject):
                 continue
 
             logging.debug("%s=%s removed", class_name, name)
+            if obj.is_domain():
+                self.statsmanager.remove_vm(obj)
             self._remove_object_signal(obj)
             obj.cleanup()
 
@@ -1147,7 +1272,14 @@ class vmmConnection(vmmGObject):
         try:
             class_name = obj.class_name()
 
+            if not self._objects.is_pending(obj):
+                logging.debug("%s=%s disappeared during init, dropping it",
+                    class_name, obj.get_name())
+                obj.cleanup()
+                return
+
             if initialize_failed:
+                self._objects.remove_pending(obj)
                 logging.debug("Blacklisting %s=%s", class_name, obj.get_name())
                 count = self._objects.add_blacklist(obj)
                 if count <= _ObjectList.BLACKLIST_COUNT:
@@ -1161,6 +1293,7 @@ class vmmConnection(vmmGObject):
             if not self._objects.add(obj):
                 logging.debug("New %s=%s requested, but it's already tracked.",
                     class_name, obj.get_name())
+                obj.cleanup()
                 return
 
             if not obj.is_nodedev():
@@ -1178,41 +1311,52 @@ class vmmConnection(vmmGObject):
             elif obj.is_nodedev():
                 self.emit("nodedev-added", obj.get_connkey())
         finally:
-            if self._init_object_event:
+            if self._init_object_event and not self._init_progressive:
                 self._init_object_count -= 1
                 if self._init_object_count <= 0:
                     self._init_object_event.set()
 
+    def _make_poll_keymap(self, classobj, objs):
+        """
+        Return the connkey -> object map the poll helpers compare
+        against. Objects still waiting on init are included, so a poll
+        doesn't treat them as brand new again
+        """
+        keymap = dict((o.get_connkey(), o) for o in objs)
+        for obj in self._objects.get_pending_for_class(classobj):
+            keymap[obj.get_connkey()] = obj
+        return keymap
+
     def _update_nets(self, dopoll):
-        keymap = dict((o.get_connkey(), o) for o in self.list_nets())
+        keymap = self._make_poll_keymap(vmmNetwork, self.list_nets())
         if not dopoll or not self.is_network_capable():
             return [], [], list(keymap.values())
         return pollhelpers.fetch_nets(self._backend, keymap,
                     (lambda obj, key: vmmNetwork(self, obj, key)))
 
     def _update_pools(self, dopoll):
-        keymap = dict((o.get_connkey(), o) for o in self.list_pools())
+        keymap = self._make_poll_keymap(vmmStoragePool, self.list_pools())
         if not dopoll or not self.is_storage_capable():
             return [], [], list(keymap.values())
         return pollhelpers.fetch_pools(self._backend, keymap,
                     (lambda obj, key: vmmStoragePool(self, obj, key)))
 
     def _update_interfaces(self, dopoll):
-        keymap = dict((o.get_connkey(), o) for o in self.list_interfaces())
+        keymap = self._make_poll_keymap(vmmInterface, self.list_interfaces())
         if not dopoll or not self.is_interface_capable():
             return [], [], list(keymap.values())
         return pollhelpers.fetch_interfaces(self._backend, keymap,
                     (lambda obj, key: vmmInterface(self, obj, key)))
 
     def _update_nodedevs(self, dopoll):
-        keymap = dict((o.get_connkey(), o) for o in self.list_nodedevs())
+        keymap = self._make_poll_keymap(vmmNodeDevice, self.list_nodedevs())
         if not dopoll or not self.is_nodedev_capable():
             return [], [], list(keymap.values())
         return pollhelpers.fetch_nodedevs(self._backend, keymap,
                     (lambda obj, key: vmmNodeDevice(self, obj, key)))
 
     def _update_vms(self, dopoll):
-        keymap = dict((o.get_connkey(), o) for o in self.list_vms())
+        keymap = self._make_poll_keymap(vmmDomain, self.list_vms())
         if not dopoll:
             return [], [], list(keymap.values())
         return pollhelpers.fetch_vms(self._backend, keymap,
@@ -1226,15 +1370,27 @@ class vmmConnection(vmmGObject):
         """
         gone_objects = []
         preexisting_objects = []
+        pending = set()
+        for classobj in [vmmDomain, vmmNetwork, vmmStoragePool,
+                         vmmInterface, vmmNodeDevice]:
+            pending.update(self._objects.get_pending_for_class(classobj))
 
         def _process_objects(polloutput):
             gone, new, master = polloutput
+            self._tick_activity += len(gone) + len(new)
 
-            if initial_poll:
+            if initial_poll and not self._init_progressive:
                 self._init_object_count += len(new)
 
-            gone_objects.extend(gone)
-            preexisting_objects.extend([o for o in master if o not in new])
+            # Objects still waiting on init aren't tracked yet. If they
+            # are gone already, dropping them from the pending list
+            # makes _new_object_cb discard them once init finishes
+            for obj in gone:
+                if not self._objects.remove_pending(obj):
+                    gone_objects.append(obj)
+            preexisting_objects.extend([o for o in master if
+                                        o not in new and
+                                        o not in pending])
             new = [n for n in new if not self._objects.in_blacklist(n)]
             return new
 
@@ -1244,34 +1400,64 @@ class vmmConnection(vmmGObject):
         new_ifaces = _process_objects(self._update_interfaces(polliface))
         new_nodedevs = _process_objects(self._update_nodedevs(pollnodedev))
 
-        # Kick off one thread per object type to handle the initial
-        # XML fetching. Going any more fine grained then this probably
-        # won't be that useful due to libvirt's locking structure.
+        if initial_poll and self._init_progressive:
+            # Get running VMs in front of the user first. ID() doesn't
+            # need a round trip to libvirtd
+            def _is_inactive(vm):
+                try:
+                    return vm.get_backend().ID() < 0
+                except Exception:
+                    return True
+            new_vms.sort(key=_is_inactive)
+
+        # Hand the new objects to the init worker pool, which fetches
+        # the initial XML concurrently. libvirtd handles parallel RPCs
+        # fine, so this mostly helps on high latency remote links.
         #
         # Would prefer to start refreshing some objects before all polling
         # is complete, but we need init_object_count to be fully accurate
         # before we start initializing objects
 
-        if initial_poll and self._init_object_count == 0:
+        if initial_poll and (self._init_progressive or
+                             self._init_object_count == 0):
             # If the connection doesn't have any objects, new_object_cb
-            # is never called and the event is never set, so let's do it here
+            # is never called and the event is never set, so let's do it
+            # here. Progressive mode doesn't wait for object init at all
             self._init_object_event.set()
 
-        for newlist in [new_vms, new_nets, new_pools,
-                new_ifaces, new_nodedevs]:
-            if not newlist:
-                continue
+        self._queue_object_init(new_vms + new_nets + new_pools +
+                                new_ifaces + new_nodedevs)
 
-            def cb(lst):
-                for obj in lst:
-                    obj.connect_once("initialized", self._new_object_cb)
-                    obj.init_libvirt_state()
+        return gone_objects, preexisting_objects
 
-            self._start_thread(cb,
-                "refreshing xml for new %s" % newlist[0].class_name(),
-                args=(newlist,))
+    def _queue_object_init(self, objs):
+        if not objs:
+            return
 
-        return gone_objects, preexisting_objects
+        for obj in objs:
+            self._objects.add_pending(obj)
+        with self._init_lock:
+            self._init_queue.extend(objs)
+            maxworkers = self.config.get_conn_init_workers()
+            count = min(maxworkers, len(self._init_queue))
+            while self._init_workers < count:
+                self._init_workers += 1
+                self._start_thread(self._object_init_worker,
+                    "refreshing xml for new objects %s %d" %
+                    (self.get_uri(), self._init_workers))
+
+    def _object_init_worker(self):
+        while True:
+            with self._init_lock:
+                if not self._init_queue:
+                    self._init_workers -= 1
+                    return
+                obj = self._init_queue.popleft()
+
+            obj.connect_once("initialized", self._new_object_cb)
+            obj.init_libvirt_state()
+            # Need to clear reference to make leak check happy
+            obj = None
 
     def _tick(self, stats_update=False,
              pollvm=False, pollnet=False,
@@ -1308,7 +1494,10 @@ class vmmConnection(vmmGObject):
         self._hostinfo = self._backend.getInfo()
         if stats_update:
             self.statsmanager.cache_all_stats(self)
+            self.statsmanager.refresh_host_stats(self)
 
+        self._tick_activity = self._event_activity
+        self._event_activity = 0
         gone_objects, preexisting_objects = self._poll(
             initial_poll, pollvm, pollnet, pollpool, polliface, pollnodedev)
         self.idle_add(self._gone_object_signals, gone_objects)
@@ -1343,42 +1532,35 @@ class vmmConnection(vmmGObject):
                                   "Ignoring.")
 
         if stats_update:
-            self._recalculate_stats(
-                [o for o in preexisting_objects if o.reports_stats()])
+            # Steady state running VMs don't count, only real changes
+            self._tick_activity += self.statsmanager.pop_stats_activity()
+            self._recalculate_stats()
             self.idle_emit("resources-sampled")
+            if self.statsmanager.check_top_vms_changed():
+                self.idle_emit("top-vms-changed")
 
-    def _recalculate_stats(self, vms):
+    def _recalculate_stats(self):
         if not self._backend.is_open():
             return
 
         now = time.time()
-        expected = self.config.get_stats_history_length()
+        expected = self.config.stats.history_length
         current = len(self._stats)
         if current > expected:
             del self._stats[expected:current]
 
-        mem = 0
-        cpuTime = 0
-        rdRate = 0
-        wrRate = 0
-        rxRate = 0
-        txRate = 0
-        diskMaxRate = self.disk_io_max_rate() or 10.0
-        netMaxRate = self.network_traffic_max_rate() or 10.0
-
-        for vm in vms:
-            if not vm.is_active():
-                continue
-
-            cpuTime += vm.cpu_time()
-            mem += vm.stats_memory()
-            rdRate += vm.disk_read_rate()
-            wrRate += vm.disk_write_rate()
-            rxRate += vm.network_rx_rate()
-            txRate += vm.network_tx_rate()
-
-            netMaxRate = max(netMaxRate, vm.network_traffic_max_rate())
-            diskMaxRate = max(diskMaxRate, vm.disk_io_max_rate())
+        # Kept up to date by the statsmanager as each VM is sampled
+        totals = self.statsmanager.get_aggregate_stats()
+        mem = totals["curmem"]
+        cpuTime = totals["cpuTime"]
+        rdRate = totals["diskRdRate"]
+        wrRate = totals["diskWrRate"]
+        rxRate = totals["netRxRate"]
+        txRate = totals["netTxRate"]
+        diskMaxRate = max(self.disk_io_max_rate() or 10.0,
+                          totals["diskMaxRate"])
+        netMaxRate = max(self.network_traffic_max_rate() or 10.0,
+                         totals["netMaxRate"])
 
         pcentHostCpu = 0
         pcentMem = mem * 100.0 / self.host_memory_size()
@@ -1391,6 +1573,13 @@ class vmmConnection(vmmGObject):
                             ((now - prevTimestamp) *
                              1000.0 * 1000.0 * 1000.0 * host_cpus))
 
+        hoststats = self.statsmanager.get_host_statslist()
+        if hoststats.has_stats():
+            # Real host utilization, including non-VM overhead
+            mem = hoststats.get_record("memUsed")
+            pcentMem = hoststats.get_record("memPercent")
+            pcentHostCpu = hoststats.get_record("cpuPercent")
+
         pcentHostCpu = max(0.0, min(100.0, pcentHostCpu))
         pcentMem = max(0.0, min(100.0, pcentMem))
 
@@ -1409,8 +1598,17 @@ class vmmConnection(vmmGObject):
         }
 
         self._stats.insert(0, newStats)
+        self.statsmanager.record_conn_stats(self, newStats)
 
 
+    def get_tick_activity(self):
+        """
+        Return a count of lifecycle events, objects added or removed,
+        and VMs with noticeable stats changes seen by the last tick.
+        Zero means the connection looks idle
+        """
+        return self._tick_activity
+
     def schedule_priority_tick(self, **kwargs):
         from .engine import vmmEngine
         vmmEngine.get_instance().schedule_priority_tick(self, kwargs)
@@ -1462,7 +1660,7 @@ class vmmConnection(vmmGObject):
 
     def _vector_helper(self, record_name, limit, ceil=100.0):
         vector = []
-        statslen = self.config.get_stats_history_length() + 1
+        statslen = self.config.stats.history_length + 1
         if limit is not None:
             statslen = min(statslen, limit)
 
@@ -1497,6 +1695,43 @@ class vmmConnection(vmmGObject):
     def disk_io_max_rate(self):
         return self._get_record_helper("diskMaxRate")
 
+    def host_numa_cells(self):
+        """
+        List of NUMA cell ids we have host stats for. Empty if the
+        host has a single cell, doesn't support host stats, or the
+        host window isn't open
+        """
+        return self.statsmanager.get_host_statslist().get_cells()
+    def host_cell_cpu_percentage(self, cell):
+        return self.statsmanager.get_host_statslist().get_record(
+                "cpuPercent", cell=cell)
+    def host_cell_memory(self, cell):
+        stats = self.statsmanager.get_host_statslist()
+        return (stats.get_record("memUsed", cell=cell),
+                stats.get_record("memTotal", cell=cell))
+    def host_cell_cpu_vector(self, cell, limit=None):
+        return self.statsmanager.get_host_statslist().get_vector(
+                "cpuPercent", limit, cell=cell)
+    def host_cell_memory_vector(self, cell, limit=None):
+        return self.statsmanager.get_host_statslist().get_vector(
+                "memPercent", limit, cell=cell)
+
+    def get_top_vms(self, metric):
+        """
+        Return a list of (vmmDomain, value) of the busiest running VMs
+        by metric, one of statsanalysis.TOP_METRICS
+        """
+        ret = []
+        for connkey, value in self.statsmanager.get_top_vms(metric):
+            vm = self.get_vm(connkey)
+            if vm:
+                ret.append((vm, value))
+        return ret
+
+    def get_stats_history(self, start, end, resolution=None):
+        return self.statsmanager.get_conn_history(
+                self, start, end, resolution)
+
 
     ###########################
     # Per-conn config helpers #
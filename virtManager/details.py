@@ -5,6 +5,7 @@
 # See the COPYING file in the top-level directory.
 
 import logging
+import time
 import traceback
 
 from gi.repository import Gdk
@@ -476,6 +477,11 @@ class vmmDetails(vmmGObjectUI):
         self._window_size = None
 
         self.oldhwkey = None
+        # Set when the VM changed while the details page wasn't on
+        # screen, so it is refreshed once the user looks at it again
+        self._details_dirty = True
+        # ((start, end, resolution), history) of the last history fetch
+        self._history_cache = None
         self.addhwmenu = None
         self._addhwmenuitems = None
         self._shutdownmenu = None
@@ -614,6 +620,8 @@ class vmmDetails(vmmGObjectUI):
 
             "on_tpm_model_combo_changed": lambda *x: self.enable_apply(x, EDIT_TPM_MODEL),
 
+            "on_overview_history_range_changed": self._history_range_changed,
+
             # Listeners stored in vmmConsolePages
             "on_details_menu_view_fullscreen_activate": (
                 self.console.details_toggle_fullscreen),
@@ -639,8 +647,11 @@ class vmmDetails(vmmGObjectUI):
         # Deliberately keep all this after signal connection
         self.vm.connect("state-changed", self.refresh_vm_state)
         self.vm.connect("resources-sampled", self.refresh_resources)
-        self.vm.connect("inspection-changed",
-                lambda *x: self.refresh_os_page())
+        self.vm.connect("inspection-changed", self._inspection_changed)
+        self.add_gsettings_handle(
+            self.config.on_stats_persistent_history_changed(
+                self._refresh_history_visible))
+        self._refresh_history_visible()
 
         self.populate_hw_list()
 
@@ -699,6 +710,7 @@ class vmmDetails(vmmGObjectUI):
             return
 
         vmmEngine.get_instance().increment_window_counter()
+        self.vm.conn.statsmanager.set_vm_watched(self.vm, True)
         self.refresh_vm_state()
 
     def customize_finish(self, src):
@@ -744,6 +756,7 @@ class vmmDetails(vmmGObjectUI):
             return
 
         self.topwin.hide()
+        self.vm.conn.statsmanager.set_vm_watched(self.vm, False)
         if self.console.details_viewer_is_visible():
             try:
                 self.console.details_close_viewer()
@@ -833,6 +846,37 @@ class vmmDetails(vmmGObjectUI):
         self.widget("overview-network-traffic-align").add(
             self.network_traffic_graph)
 
+        def _history_source(columns, ceil=None):
+            def _fetch(start, end, resolution):
+                history = self._get_stats_history(start, end, resolution)
+                if not history:
+                    return None
+                datasets = [history[2][c] for c in columns]
+                scale = ceil or max([10.0] + [max(d or [0]) for d in datasets])
+                return [[v / scale for v in d] for d in datasets]
+            return _fetch
+
+        self.cpu_usage_graph.set_history_source(
+                _history_source(["cpuGuestPercent"], 100.0))
+        self.memory_usage_graph.set_history_source(
+                _history_source(["currMemPercent"], 100.0))
+        self.disk_io_graph.set_history_source(
+                _history_source(["diskRdRate", "diskWrRate"]))
+        self.network_traffic_graph.set_history_source(
+                _history_source(["netRxRate", "netTxRate"]))
+
+        # [label, seconds back, resolution]
+        combo = self.widget("overview-history-range")
+        model = Gtk.ListStore(str, int, int)
+        combo.set_model(model)
+        uiutil.init_combo_text_column(combo, 0)
+        model.append([_("Live"), 0, 0])
+        model.append([_("Last hour"), 60 * 60, 0])
+        model.append([_("Last day"), 24 * 60 * 60, 60])
+        model.append([_("Last week"), 7 * 24 * 60 * 60, 60 * 60])
+        model.append([_("Last month"), 30 * 24 * 60 * 60, 60 * 60])
+        combo.set_active(0)
+
     def init_details(self):
         # Hardware list
         # [ label, icon name, icon size, hw type, hw data/class]
@@ -1298,6 +1342,9 @@ class vmmDetails(vmmGObjectUI):
             if self.has_unapplied_changes(self.get_hw_row()):
                 self.sync_details_console_view(True)
                 return
+            if self.widget("config-apply").get_sensitive():
+                # Discarded edits are still in the widgets
+                self._details_dirty = True
             self.disable_apply()
 
         if is_details:
@@ -1337,7 +1384,7 @@ class vmmDetails(vmmGObjectUI):
             w = notebook.get_nth_page(i)
             w.set_visible(i == newpage)
 
-        self.page_refresh(newpage)
+        self._refresh_dirty_page(newpage)
 
         self.sync_details_console_view(newpage)
         self.console.details_refresh_can_fullscreen()
@@ -1397,8 +1444,9 @@ class vmmDetails(vmmGObjectUI):
         self.widget("overview-status-icon").set_from_icon_name(
                             self.vm.run_status_icon_name(), Gtk.IconSize.BUTTON)
 
+        self._details_dirty = True
         details = self.widget("details-pages")
-        self.page_refresh(details.get_current_page())
+        self._refresh_dirty_page(details.get_current_page())
 
         errmsg = self.vm.snapshots_supported()
         cansnap = not bool(errmsg)
@@ -2398,15 +2446,47 @@ class vmmDetails(vmmGObjectUI):
     # Details page refresh #
     ########################
 
+    def _get_visible_hw_type(self):
+        """
+        Return the HW_LIST_TYPE of the hardware page that is on screen,
+        or None if the window or the details page isn't showing
+        """
+        if not self.is_visible():
+            return None
+        page = self.widget("details-pages").get_current_page()
+        if page != DETAILS_PAGE_DETAILS:
+            return None
+        row = self.get_hw_row()
+        return row and row[HW_LIST_COL_TYPE]
+
+    def _refresh_dirty_page(self, page):
+        """
+        Refresh the details page if the VM changed since it was last
+        shown. Nothing is done while the page isn't on screen, it
+        stays dirty until the user switches to it or shows the window.
+        """
+        if (not self._details_dirty or
+            page != DETAILS_PAGE_DETAILS or
+            not self.is_visible()):
+            return
+
+        self._details_dirty = False
+        self.page_refresh(page)
+
+    def _inspection_changed(self, src):
+        ignore = src
+        # Otherwise the OS page is filled in when it is selected
+        if self._get_visible_hw_type() == HW_LIST_TYPE_OS:
+            self.refresh_os_page()
+
     def refresh_resources(self, ignore):
-        details = self.widget("details-pages")
-        page = details.get_current_page()
+        if not self.is_visible():
+            return
 
         # If the dialog is visible, we want to make sure the XML is always
         # up to date
         try:
-            if self.is_visible():
-                self.vm.ensure_latest_xml()
+            self.vm.ensure_latest_xml()
         except libvirt.libvirtError as e:
             if util.exception_is_libvirt_error(e, "VIR_ERR_NO_DOMAIN"):
                 self.close()
@@ -2414,8 +2494,7 @@ class vmmDetails(vmmGObjectUI):
             raise
 
         # Stats page needs to be refreshed every tick
-        if (page == DETAILS_PAGE_DETAILS and
-            self.get_hw_row()[HW_LIST_COL_TYPE] == HW_LIST_TYPE_STATS):
+        if self._get_visible_hw_type() == HW_LIST_TYPE_STATS:
             self.refresh_stats_page()
 
     def page_refresh(self, page):
@@ -2564,11 +2643,23 @@ class vmmDetails(vmmGObjectUI):
             opts = {"received": rx, "transferred": tx, "units": unit}
             return _multi_color(_("%(received)d %(units)s in") % opts,
                                 _("%(transferred)d %(units)s out") % opts)
+        def _devices_text(rates, textfunc):
+            # A breakdown for a single device just repeats the total
+            if len(rates) < 2:
+                return None
+            lines = []
+            for name in sorted(rates):
+                rx, tx = rates[name]
+                lines.append("%s: %s" % (util.xml_escape(name),
+                                         textfunc(rx, tx, "KiB/s")))
+            return "\n".join(lines)
 
         cpu_txt = _("Disabled")
         mem_txt = _("Disabled")
         dsk_txt = _("Disabled")
         net_txt = _("Disabled")
+        dsk_devs_txt = None
+        net_devs_txt = None
 
         if self.config.get_stats_enable_cpu_poll():
             cpu_txt = "%d %%" % self.vm.guest_cpu_time_percentage()
@@ -2584,16 +2675,26 @@ class vmmDetails(vmmGObjectUI):
         if self.config.get_stats_enable_disk_poll():
             dsk_txt = _dsk_rx_tx_text(self.vm.disk_read_rate(),
                                       self.vm.disk_write_rate(), "KiB/s")
+            dsk_devs_txt = _devices_text(self.vm.disk_device_io_rates(),
+                                         _dsk_rx_tx_text)
 
         if self.config.get_stats_enable_net_poll():
             net_txt = _net_rx_tx_text(self.vm.network_rx_rate(),
                                       self.vm.network_tx_rate(), "KiB/s")
+            net_devs_txt = _devices_text(
+                    self.vm.network_device_traffic_rates(), _net_rx_tx_text)
 
         self.widget("overview-cpu-usage-text").set_text(cpu_txt)
         self.widget("overview-memory-usage-text").set_text(mem_txt)
         self.widget("overview-network-traffic-text").set_markup(net_txt)
         self.widget("overview-disk-usage-text").set_markup(dsk_txt)
 
+        for widgetname, txt in [
+                ("overview-disk-devices-text", dsk_devs_txt),
+                ("overview-network-devices-text", net_devs_txt)]:
+            self.widget(widgetname).set_markup(txt or "")
+            self.widget(widgetname).set_visible(bool(txt))
+
         self.cpu_usage_graph.set_property("data_array",
                                           self.vm.guest_cpu_time_vector())
         self.memory_usage_graph.set_property("data_array",
@@ -2605,6 +2706,43 @@ class vmmDetails(vmmGObjectUI):
         n1, n2 = self.vm.network_traffic_vectors()
         self.network_traffic_graph.set_property("data_array", n1 + n2)
 
+        if self.widget("overview-history-range").get_active() > 0:
+            self._refresh_history_graphs()
+
+    def _refresh_history_visible(self):
+        enabled = self.config.get_stats_persistent_history()
+        self.widget("overview-history-box").set_visible(enabled)
+        if not enabled:
+            self.widget("overview-history-range").set_active(0)
+
+    def _get_stats_history(self, start, end, resolution):
+        # All graphs ask for the same range in a row, so only the
+        # first one reads the history file
+        key = (start, end, resolution)
+        if not self._history_cache or self._history_cache[0] != key:
+            self._history_cache = (key, self.vm.get_stats_history(
+                    start, end, resolution))
+        return self._history_cache[1]
+
+    def _refresh_history_graphs(self):
+        row = uiutil.get_list_selected_row(
+                self.widget("overview-history-range"))
+        graphs = [self.cpu_usage_graph, self.memory_usage_graph,
+                  self.disk_io_graph, self.network_traffic_graph]
+        if not row or not row[1]:
+            for graph in graphs:
+                graph.show_live()
+            return
+
+        now = time.time()
+        for graph in graphs:
+            graph.show_time_range(now - row[1], now, row[2] or None)
+        self._history_cache = None
+
+    def _history_range_changed(self, src):
+        ignore = src
+        self._refresh_history_graphs()
+
     def _cpu_secure_is_available(self):
         domcaps = self.vm.get_domain_capabilities()
         features = domcaps.get_cpu_security_features()
@@ -3149,86 +3287,36 @@ class vmmDetails(vmmGObjectUI):
         self.repopulate_hw_list()
         self.set_hw_selection(0)
 
-    def repopulate_hw_list(self):
-        hw_list = self.widget("hw-list")
-        hw_list_model = hw_list.get_model()
-
-        currentDevices = []
-
-        def dev_cmp(origdev, newdev):
-            if isinstance(origdev, str):
-                return False
-
-            if origdev == newdev:
-                return True
-
-            return origdev.get_xml_id() == newdev.get_xml_id()
-
-        def add_hw_list_option(idx, name, page_id, info, icon_name):
-            hw_list_model.insert(idx, [name, icon_name,
-                                       Gtk.IconSize.LARGE_TOOLBAR,
-                                       page_id, info])
-
-        def update_hwlist(hwtype, dev):
-            """
-            See if passed hw is already in list, and if so, update info.
-            If not in list, add it!
-            """
-            label = _label_for_device(dev)
-            icon = _icon_for_device(dev)
-
-            currentDevices.append(dev)
-
-            insertAt = 0
-            for row in hw_list_model:
-                rowdev = row[HW_LIST_COL_DEVICE]
-                if dev_cmp(rowdev, dev):
-                    # Update existing HW info
-                    row[HW_LIST_COL_DEVICE] = dev
-                    row[HW_LIST_COL_LABEL] = label
-                    row[HW_LIST_COL_ICON_NAME] = icon
-                    return
-
-                if row[HW_LIST_COL_TYPE] <= hwtype:
-                    insertAt += 1
-
-            # Add the new HW row
-            add_hw_list_option(insertAt, label, hwtype, dev, icon)
-
-
-        consoles = self.vm.xmlobj.devices.console
-        serials = self.vm.xmlobj.devices.serial
+    def _get_hw_list_devices(self):
+        """
+        Return a list of (HW_LIST_TYPE, device) for every device that
+        gets a hw-list row, in display order
+        """
+        devices = self.vm.xmlobj.devices
+        consoles = devices.console
+        serials = devices.serial
         if serials and consoles and self.vm.serial_is_console_dup(serials[0]):
             consoles.pop(0)
 
-        for dev in _calculate_disk_bus_index(self.vm.xmlobj.devices.disk):
-            update_hwlist(HW_LIST_TYPE_DISK, dev)
-        for dev in self.vm.xmlobj.devices.interface:
-            update_hwlist(HW_LIST_TYPE_NIC, dev)
-        for dev in self.vm.xmlobj.devices.input:
-            update_hwlist(HW_LIST_TYPE_INPUT, dev)
-        for dev in self.vm.xmlobj.devices.graphics:
-            update_hwlist(HW_LIST_TYPE_GRAPHICS, dev)
-        for dev in self.vm.xmlobj.devices.sound:
-            update_hwlist(HW_LIST_TYPE_SOUND, dev)
-        for dev in serials:
-            update_hwlist(HW_LIST_TYPE_CHAR, dev)
-        for dev in self.vm.xmlobj.devices.parallel:
-            update_hwlist(HW_LIST_TYPE_CHAR, dev)
-        for dev in consoles:
-            update_hwlist(HW_LIST_TYPE_CHAR, dev)
-        for dev in self.vm.xmlobj.devices.channel:
-            update_hwlist(HW_LIST_TYPE_CHAR, dev)
-        for dev in self.vm.xmlobj.devices.hostdev:
-            update_hwlist(HW_LIST_TYPE_HOSTDEV, dev)
-        for dev in self.vm.xmlobj.devices.redirdev:
-            update_hwlist(HW_LIST_TYPE_REDIRDEV, dev)
-        for dev in self.vm.xmlobj.devices.video:
-            update_hwlist(HW_LIST_TYPE_VIDEO, dev)
-        for dev in self.vm.xmlobj.devices.watchdog:
-            update_hwlist(HW_LIST_TYPE_WATCHDOG, dev)
-
-        for dev in self.vm.xmlobj.devices.controller:
+        ret = []
+        def add(hwtype, devs):
+            ret.extend((hwtype, dev) for dev in devs)
+
+        add(HW_LIST_TYPE_DISK, _calculate_disk_bus_index(devices.disk))
+        add(HW_LIST_TYPE_NIC, devices.interface)
+        add(HW_LIST_TYPE_INPUT, devices.input)
+        add(HW_LIST_TYPE_GRAPHICS, devices.graphics)
+        add(HW_LIST_TYPE_SOUND, devices.sound)
+        add(HW_LIST_TYPE_CHAR, serials)
+        add(HW_LIST_TYPE_CHAR, devices.parallel)
+        add(HW_LIST_TYPE_CHAR, consoles)
+        add(HW_LIST_TYPE_CHAR, devices.channel)
+        add(HW_LIST_TYPE_HOSTDEV, devices.hostdev)
+        add(HW_LIST_TYPE_REDIRDEV, devices.redirdev)
+        add(HW_LIST_TYPE_VIDEO, devices.video)
+        add(HW_LIST_TYPE_WATCHDOG, devices.watchdog)
+
+        for dev in devices.controller:
             # skip USB2 ICH9 companion controllers
             if dev.model in ["ich9-uhci1", "ich9-uhci2", "ich9-uhci3"]:
                 continue
@@ -3239,32 +3327,67 @@ class vmmDetails(vmmGObjectUI):
                              "pci-bridge"]:
                 continue
 
-            update_hwlist(HW_LIST_TYPE_CONTROLLER, dev)
-
-        for dev in self.vm.xmlobj.devices.filesystem:
-            update_hwlist(HW_LIST_TYPE_FILESYSTEM, dev)
-        for dev in self.vm.xmlobj.devices.smartcard:
-            update_hwlist(HW_LIST_TYPE_SMARTCARD, dev)
-        for dev in self.vm.xmlobj.devices.tpm:
-            update_hwlist(HW_LIST_TYPE_TPM, dev)
-        for dev in self.vm.xmlobj.devices.rng:
-            update_hwlist(HW_LIST_TYPE_RNG, dev)
-        for dev in self.vm.xmlobj.devices.panic:
-            update_hwlist(HW_LIST_TYPE_PANIC, dev)
-        for dev in self.vm.xmlobj.devices.vsock:
-            update_hwlist(HW_LIST_TYPE_VSOCK, dev)
-
-        devs = list(range(len(hw_list_model)))
-        devs.reverse()
-        for i in devs:
-            _iter = hw_list_model.iter_nth_child(None, i)
-            olddev = hw_list_model[i][HW_LIST_COL_DEVICE]
-
-            # Existing device, don't remove it
-            if isinstance(olddev, str) or olddev in currentDevices:
-                continue
+            ret.append((HW_LIST_TYPE_CONTROLLER, dev))
+
+        add(HW_LIST_TYPE_FILESYSTEM, devices.filesystem)
+        add(HW_LIST_TYPE_SMARTCARD, devices.smartcard)
+        add(HW_LIST_TYPE_TPM, devices.tpm)
+        add(HW_LIST_TYPE_RNG, devices.rng)
+        add(HW_LIST_TYPE_PANIC, devices.panic)
+        add(HW_LIST_TYPE_VSOCK, devices.vsock)
+        return ret
 
-            hw_list_model.remove(_iter)
+    def repopulate_hw_list(self):
+        """
+        Sync the device rows of hw-list with the VM XML. The list is
+        diffed in place, devices are matched by XML id, so rows that
+        didn't change aren't touched and the selection is kept.
+        """
+        hw_list_model = self.widget("hw-list").get_model()
+
+        def row_key(row):
+            dev = row[HW_LIST_COL_DEVICE]
+            if isinstance(dev, str):
+                return None
+            return dev.get_xml_id()
+
+        # Skip the fixed Overview, CPUs, ... rows at the top
+        idx = 0
+        while (idx < len(hw_list_model) and
+               row_key(hw_list_model[idx]) is None):
+            idx += 1
+
+        newdevs = self._get_hw_list_devices()
+        wanted = set(dev.get_xml_id() for ignore, dev in newdevs)
+
+        for hwtype, dev in newdevs:
+            key = dev.get_xml_id()
+
+            # Drop rows for devices that were removed
+            while (idx < len(hw_list_model) and
+                   row_key(hw_list_model[idx]) not in wanted):
+                hw_list_model.remove(hw_list_model.get_iter(idx))
+
+            label = _label_for_device(dev)
+            icon = _icon_for_device(dev)
+            if (idx < len(hw_list_model) and
+                row_key(hw_list_model[idx]) == key):
+                row = hw_list_model[idx]
+                if row[HW_LIST_COL_DEVICE] is not dev:
+                    row[HW_LIST_COL_DEVICE] = dev
+                if row[HW_LIST_COL_LABEL] != label:
+                    row[HW_LIST_COL_LABEL] = label
+                if row[HW_LIST_COL_ICON_NAME] != icon:
+                    row[HW_LIST_COL_ICON_NAME] = icon
+            else:
+                hw_list_model.insert(idx, [label, icon,
+                                           Gtk.IconSize.LARGE_TOOLBAR,
+                                           hwtype, dev])
+            idx += 1
+
+        # Anything left over was removed, or moved up in the list
+        while idx < len(hw_list_model):
+            hw_list_model.remove(hw_list_model.get_iter(idx))
 
     def _make_boot_rows(self):
         if not self.vm.can_use_device_boot_order():
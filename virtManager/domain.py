@@ -1404,6 +1404,8 @@ class vmmDomain(vmmLibvirtObject):
         return self.conn.statsmanager.get_vm_statslist(self)
     def stats_memory(self):
         return self._get_stats().get_record("curmem")
+    def stats_memory_percentage(self):
+        return self._get_stats().get_record("currMemPercent")
     def cpu_time(self):
         return self._get_stats().get_record("cpuTime")
     def host_cpu_time_percentage(self):
@@ -1429,6 +1431,10 @@ class vmmDomain(vmmLibvirtObject):
     def disk_io_max_rate(self):
         stats = self._get_stats()
         return max(stats.diskRdMaxRate, stats.diskWrMaxRate)
+    def disk_device_io_rates(self):
+        return self._get_stats().get_disk_device_rates()
+    def network_device_traffic_rates(self):
+        return self._get_stats().get_net_device_rates()
 
     def host_cpu_time_vector(self, limit=None):
         return self._get_stats().get_vector("cpuHostPercent", limit)
@@ -1442,6 +1448,21 @@ class vmmDomain(vmmLibvirtObject):
     def disk_io_vectors(self, limit=None, ceil=None):
         return self._get_stats().get_in_out_vector(
                 "diskRdRate", "diskWrRate", limit, ceil)
+    def stats_generation(self):
+        """
+        Counter that changes whenever a new stats sample is recorded
+        """
+        return self._get_stats().generation
+
+    def get_stats_alerts(self):
+        """
+        List of threshold rule strings currently alerting for this VM
+        """
+        return self.conn.statsmanager.get_vm_alerts(self)
+
+    def get_stats_history(self, start, end, resolution=None):
+        return self.conn.statsmanager.get_vm_history(
+                self, start, end, resolution)
 
 
     ###################
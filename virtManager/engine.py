@@ -4,6 +4,7 @@
 # This work is licensed under the GNU GPLv2 or later.
 # See the COPYING file in the top-level directory.
 
+import collections
 import logging
 import os
 import queue
@@ -18,11 +19,16 @@ from .baseclass import vmmGObject
 from .connect import vmmConnect
 from .connmanager import vmmConnectionManager
 from .inspection import vmmInspection
+from .statsexporter import vmmStatsExporter
 from .systray import vmmSystray
 
 (PRIO_HIGH,
  PRIO_LOW) = range(1, 3)
 
+# Upper limit of tick worker threads. Workers are only started when
+# all existing ones are busy, so usually this is never reached
+TICK_POOL_MAX_WORKERS = 16
+
 
 def _show_startup_error(fn):
     """
@@ -40,6 +46,80 @@ def _show_startup_error(fn):
     return newfn
 
 
+class _TickLatency(object):
+    """
+    Per connection tick timing bookkeeping
+    """
+    # Weight of the newest sample in the moving average
+    _ALPHA = 0.3
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.merged = 0
+        self.last = 0.0
+        self.average = 0.0
+        self.maximum = 0.0
+        self.last_wait = 0.0
+
+    def record(self, duration, wait):
+        self.count += 1
+        self.last = duration
+        self.last_wait = wait
+        self.maximum = max(self.maximum, duration)
+        if self.count == 1:
+            self.average = duration
+        else:
+            self.average = ((self._ALPHA * duration) +
+                            ((1 - self._ALPHA) * self.average))
+
+
+class _AdaptiveInterval(object):
+    """
+    Tracks the poll interval for a single connection when the
+    stats/adaptive-interval setting is enabled
+    """
+    # Growth factor applied to the interval for each idle tick
+    _IDLE_BACKOFF = 1.5
+    # Never spend more than 1/_COST_FACTOR of the time ticking
+    _COST_FACTOR = 4
+
+    def __init__(self):
+        self.interval = 0
+        self.next_due = 0
+
+    def update(self, base, minval, maxval, tick_cost, activity):
+        """
+        :param base: The fixed stats-update-interval
+        :param tick_cost: Average tick duration of the connection
+        :param activity: Events, object churn and stats changes seen by
+            the connection's last tick. If zero we treat the conn as idle
+        """
+        if activity or not self.interval:
+            interval = base
+        else:
+            interval = self.interval * self._IDLE_BACKOFF
+
+        interval = max(interval, tick_cost * self._COST_FACTOR)
+        self.interval = max(minval, min(maxval, interval))
+
+
+class _PendingTick(object):
+    """
+    A queued tick request for a single connection. Requests that come in
+    while one is already queued are merged into it.
+    """
+    def __init__(self, isprio, kwargs):
+        self.isprio = isprio
+        self.kwargs = kwargs
+        self.queued_time = time.time()
+
+    def merge(self, isprio, kwargs):
+        self.isprio = self.isprio or isprio
+        for key, val in kwargs.items():
+            self.kwargs[key] = self.kwargs.get(key) or val
+
+
 class vmmEngine(vmmGObject):
     CLI_SHOW_MANAGER = "manager"
     CLI_SHOW_DOMAIN_CREATOR = "creator"
@@ -69,13 +149,23 @@ class vmmEngine(vmmGObject):
         self._init_gtk_application()
 
         self._timer = None
-        self._tick_counter = 0
-        self._tick_thread_slow = False
-        self._tick_thread = threading.Thread(name="Tick thread",
-                                            target=self._handle_tick_queue,
-                                            args=())
-        self._tick_thread.daemon = True
-        self._tick_queue = queue.PriorityQueue(100)
+        self._timer_period = 0
+        self._adaptive_intervals = {}
+
+        # Tick requests are run by a pool of worker threads, but only
+        # one tick per connection is ever queued or running at a time,
+        # so a slow connection can't hold up polling of the others.
+        # All of this state is protected by _tick_cond
+        self._tick_cond = threading.Condition()
+        self._tick_pending = {}
+        self._tick_running = set()
+        self._tick_ready = {
+            PRIO_HIGH: collections.deque(),
+            PRIO_LOW: collections.deque(),
+        }
+        self._tick_workers = 0
+        self._tick_idle_workers = 0
+        self._tick_latency = {}
 
 
     @property
@@ -98,13 +188,19 @@ class vmmEngine(vmmGObject):
         """
         vmmSystray.get_instance()
         vmmInspection.get_instance()
+        vmmStatsExporter.get_instance()
 
         self.add_gsettings_handle(
             self.config.on_stats_update_interval_changed(
                 self._timer_changed_cb))
+        self.add_gsettings_handle(
+            self.config.on_stats_adaptive_interval_changed(
+                self._timer_changed_cb))
+        self.add_gsettings_handle(
+            self.config.on_stats_adaptive_interval_min_changed(
+                self._timer_changed_cb))
 
         self._schedule_timer()
-        self._tick_thread.start()
         self._tick()
 
         uris = list(self._connobjs.keys())
@@ -330,51 +426,164 @@ class vmmEngine(vmmGObject):
         self._schedule_timer()
 
     def _schedule_timer(self):
-        interval = self.config.get_stats_update_interval() * 1000
+        interval = self.config.get_stats_update_interval()
+        if self.config.get_stats_adaptive_interval():
+            # Each connection decides at every timer pass whether it's
+            # due, so fire often enough to honor the smallest interval
+            interval = min(interval,
+                           self.config.get_stats_adaptive_interval_min())
+        self._timer_period = interval
+        self._adaptive_intervals = {}
 
         if self._timer is not None:
             self.remove_gobject_timeout(self._timer)
             self._timer = None
 
-        self._timer = self.timeout_add(interval, self._tick)
+        self._timer = self.timeout_add(interval * 1000, self._tick)
 
     def _add_obj_to_tick_queue(self, obj, isprio, **kwargs):
-        if self._tick_queue.full():
-            if not self._tick_thread_slow:
-                logging.debug("Tick is slow, not running at requested rate.")
-                self._tick_thread_slow = True
-            return
-
-        self._tick_counter += 1
-        self._tick_queue.put((isprio and PRIO_HIGH or PRIO_LOW,
-                              self._tick_counter,
-                              obj, kwargs))
+        with self._tick_cond:
+            pending = self._tick_pending.get(obj)
+            if pending:
+                # A tick is already queued for this connection, just
+                # fold our poll flags into it
+                wasprio = pending.isprio
+                pending.merge(isprio, kwargs)
+                self._get_tick_latency(obj).merged += 1
+                if (pending.isprio and not wasprio and
+                    obj not in self._tick_running):
+                    self._tick_ready[PRIO_LOW].remove(obj)
+                    self._tick_ready[PRIO_HIGH].append(obj)
+                return
+
+            self._tick_pending[obj] = _PendingTick(isprio, kwargs)
+            if obj in self._tick_running:
+                # Requeued by the worker once the running tick completes
+                return
+
+            self._tick_ready[isprio and PRIO_HIGH or PRIO_LOW].append(obj)
+            self._wake_tick_worker()
 
     def schedule_priority_tick(self, conn, kwargs):
         # Called directly from connection
         self._add_obj_to_tick_queue(conn, True, **kwargs)
 
+    def _adaptive_tick_due(self, conn, now, base, minval, maxval):
+        uri = conn.get_uri()
+        state = self._adaptive_intervals.get(uri)
+        if not state:
+            state = _AdaptiveInterval()
+            self._adaptive_intervals[uri] = state
+
+        # Allow for timer jitter, otherwise a conn whose interval matches
+        # the timer period could end up skipping every other pass
+        if now < state.next_due - (self._timer_period / 2.0):
+            return False
+
+        oldinterval = state.interval
+        state.update(base, minval, maxval,
+                     self.get_tick_latency(conn).average,
+                     conn.get_tick_activity())
+        state.next_due = now + state.interval
+        if int(oldinterval) != int(state.interval):
+            logging.debug("Adaptive tick interval for %s is now %.1fs",
+                          uri, state.interval)
+        return True
+
     def _tick(self):
+        adaptive = self.config.get_stats_adaptive_interval()
+        if adaptive:
+            now = time.time()
+            base = self.config.get_stats_update_interval()
+            minval = self.config.get_stats_adaptive_interval_min()
+            maxval = self.config.get_stats_adaptive_interval_max()
+
         for conn in self._connobjs.values():
+            if (adaptive and
+                not self._adaptive_tick_due(conn, now, base, minval, maxval)):
+                continue
             self._add_obj_to_tick_queue(conn, False,
                                         stats_update=True, pollvm=True)
         return 1
 
+    def _get_tick_latency(self, conn):
+        uri = conn.get_uri()
+        if uri not in self._tick_latency:
+            self._tick_latency[uri] = _TickLatency()
+        return self._tick_latency[uri]
+
+    def get_tick_latency(self, conn):
+        """
+        Return the _TickLatency bookkeeping for the passed connection
+        """
+        with self._tick_cond:
+            return self._get_tick_latency(conn)
+
+    def _wake_tick_worker(self):
+        """
+        Hand newly queued work to an idle worker, or start a new one.
+        Must be called with _tick_cond held
+        """
+        if self._tick_idle_workers:
+            # Claim the idle worker here, so a second request that comes
+            # in before it wakes up doesn't assume it's still available
+            self._tick_idle_workers -= 1
+            self._tick_cond.notify()
+        elif self._tick_workers < TICK_POOL_MAX_WORKERS:
+            self._tick_workers += 1
+            self._start_thread(self._handle_tick_queue,
+                "Tick worker %d" % self._tick_workers)
+
+    def _get_next_tick(self):
+        with self._tick_cond:
+            while True:
+                for prio in [PRIO_HIGH, PRIO_LOW]:
+                    if self._tick_ready[prio]:
+                        conn = self._tick_ready[prio].popleft()
+                        self._tick_running.add(conn)
+                        return conn, self._tick_pending.pop(conn)
+
+                # _wake_tick_worker takes care of the decrement
+                self._tick_idle_workers += 1
+                self._tick_cond.wait()
+
+    def _finish_tick(self, conn, duration, wait, failed):
+        with self._tick_cond:
+            self._tick_running.discard(conn)
+            latency = self._get_tick_latency(conn)
+            latency.record(duration, wait)
+            if failed:
+                latency.errors += 1
+
+            pending = self._tick_pending.get(conn)
+            if pending:
+                # Merged requests that arrived while we were running.
+                # The calling worker will pick it up if nobody else does
+                prio = pending.isprio and PRIO_HIGH or PRIO_LOW
+                self._tick_ready[prio].append(conn)
+
     def _handle_tick_queue(self):
         while True:
-            ignore1, ignore2, conn, kwargs = self._tick_queue.get()
+            conn, pending = self._get_next_tick()
+            start = time.time()
+            failed = False
             try:
-                conn.tick_from_engine(**kwargs)
+                conn.tick_from_engine(**pending.kwargs)
             except Exception:
                 # Don't attempt to show any UI error here, since it
                 # can cause dialogs to appear from nowhere if say
                 # libvirtd is shut down
+                failed = True
                 logging.debug("Error polling connection %s",
                         conn.get_uri(), exc_info=True)
 
+            end = time.time()
+            self._finish_tick(conn, end - start,
+                              start - pending.queued_time, failed)
+
             # Need to clear reference to make leak check happy
             conn = None
-            self._tick_queue.task_done()
+            pending = None
         return 1
 
 
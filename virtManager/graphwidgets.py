@@ -3,6 +3,10 @@
 # This work is licensed under the GNU GPLv2 or later.
 # See the COPYING file in the top-level directory.
 
+import weakref
+
+import cairo
+
 from gi.repository import GObject
 from gi.repository import Gtk
 
@@ -105,6 +109,30 @@ class CellRendererSparkline(Gtk.CellRenderer):
         self.reversed = False
         self.rgb = None
 
+        # Set by set_data_source. Row object -> (generation, data_array,
+        # (width, height), cairo surface) of its last render
+        self._source = None
+        self._generation = None
+        self._cache = weakref.WeakKeyDictionary()
+
+    def set_data_source(self, obj, generation, datafunc):
+        """
+        Set the graph data for the row of obj, for use from a cell data
+        func. datafunc returns the data array, and is only called when
+        generation changed since obj was last drawn. Until then, renders
+        of the same size just paint the cached surface.
+        """
+        self._source = obj
+        self._generation = generation
+
+        entry = self._cache.get(obj)
+        if entry and entry[0] == generation:
+            self.data_array = entry[1]
+            return
+
+        self.data_array = datafunc()
+        self._cache[obj] = (generation, self.data_array, None, None)
+
     def do_render(self, cr, widget, background_area, cell_area,
                   flags):
         # cr                : Cairo context
@@ -118,6 +146,26 @@ class CellRendererSparkline(Gtk.CellRenderer):
         ignore = background_area
         ignore = flags
 
+        entry = None
+        if self._source is not None:
+            entry = self._cache.get(self._source)
+        if not entry or entry[0] != self._generation:
+            self._draw(cr, cell_area.x, cell_area.y,
+                       cell_area.width, cell_area.height)
+            return
+
+        size = (cell_area.width, cell_area.height)
+        surface = entry[3]
+        if entry[2] != size:
+            surface = cr.get_target().create_similar(
+                    cairo.CONTENT_COLOR_ALPHA, *size)
+            self._draw(cairo.Context(surface), 0, 0, *size)
+            self._cache[self._source] = (entry[0], entry[1], size, surface)
+
+        cr.set_source_surface(surface, cell_area.x, cell_area.y)
+        cr.paint()
+
+    def _draw(self, cr, cell_x, cell_y, cell_width, cell_height):
         # Indent of the gray border around the graph
         BORDER_PADDING = 2
         # Indent of graph from border
@@ -129,10 +177,10 @@ class CellRendererSparkline(Gtk.CellRenderer):
         xalign = self.get_property("xalign")
 
         # Set up graphing bounds
-        graph_x      = (cell_area.x + GRAPH_PAD)
-        graph_y      = (cell_area.y + GRAPH_PAD)
-        graph_width  = (cell_area.width - (GRAPH_PAD * 2))
-        graph_height = (cell_area.height - (GRAPH_PAD * 2))
+        graph_x      = (cell_x + GRAPH_PAD)
+        graph_y      = (cell_y + GRAPH_PAD)
+        graph_width  = (cell_width - (GRAPH_PAD * 2))
+        graph_height = (cell_height - (GRAPH_PAD * 2))
 
         pixels_per_point = (graph_width // max(1, len(self.data_array) - 1))
 
@@ -144,10 +192,10 @@ class CellRendererSparkline(Gtk.CellRenderer):
         border_width = graph_width + (GRAPH_INDENT * 2)
 
         # Align the widget
-        empty_space = cell_area.width - border_width - (BORDER_PADDING * 2)
+        empty_space = cell_width - border_width - (BORDER_PADDING * 2)
         if empty_space:
             xalign_space = int(empty_space * xalign)
-            cell_area.x += xalign_space
+            cell_x += xalign_space
             graph_x += xalign_space
 
         cr.set_line_width(3)
@@ -156,18 +204,18 @@ class CellRendererSparkline(Gtk.CellRenderer):
 
         # Draw gray graph border
         cr.set_source_rgb(0.8828125, 0.8671875, 0.8671875)
-        cr.rectangle(cell_area.x + BORDER_PADDING,
-                     cell_area.y + BORDER_PADDING,
+        cr.rectangle(cell_x + BORDER_PADDING,
+                     cell_y + BORDER_PADDING,
                      border_width,
-                     cell_area.height - (BORDER_PADDING * 2))
+                     cell_height - (BORDER_PADDING * 2))
         cr.stroke()
 
         # Fill in white box inside graph outline
         cr.set_source_rgb(1, 1, 1)
-        cr.rectangle(cell_area.x + BORDER_PADDING,
-                     cell_area.y + BORDER_PADDING,
+        cr.rectangle(cell_x + BORDER_PADDING,
+                     cell_y + BORDER_PADDING,
                      border_width,
-                     cell_area.height - (BORDER_PADDING * 2))
+                     cell_height - (BORDER_PADDING * 2))
         cr.fill()
 
         def get_y(index):
@@ -193,21 +241,16 @@ class CellRendererSparkline(Gtk.CellRenderer):
             points.append((x, y))
 
 
-        cell_area.x = graph_x
-        cell_area.y = graph_y
-        cell_area.width = graph_width
-        cell_area.height = graph_height
-
         # Set color to dark blue for the actual sparkline
         cr.set_line_width(2)
         cr.set_source_rgb(0.421875, 0.640625, 0.73046875)
-        draw_line(cr, cell_area.y, cell_area.height, points)
+        draw_line(cr, graph_y, graph_height, points)
 
         # Set color to light blue for the fill
         cr.set_source_rgba(0.71484375, 0.84765625, 0.89453125, .5)
         draw_fill(cr,
-                  cell_area.x, cell_area.y,
-                  cell_area.width, cell_area.height,
+                  graph_x, graph_y,
+                  graph_width, graph_height,
                   points)
         return
 
@@ -279,16 +322,59 @@ class Sparkline(Gtk.DrawingArea):
         self.reversed = False
         self.rgb = []
 
+        # Set by show_time_range, overrides the live data_array
+        self._history_source = None
+        self._history_array = None
+
         ctxt = self.get_style_context()
         ctxt.add_class(Gtk.STYLE_CLASS_ENTRY)
 
     def set_data_array(self, val):
         self._data_array = val
-        self.queue_draw()
+        if self._history_array is None:
+            self.queue_draw()
     def get_data_array(self):
+        if self._history_array is not None:
+            return self._history_array
         return self._data_array
     data_array = property(get_data_array, set_data_array)
 
+    def set_history_source(self, func):
+        """
+        Set the callback used by show_time_range. It is called as
+        func(start, end, resolution) and returns a list of num_sets
+        data sets, oldest sample first, values scaled to 0.0 - 1.0
+        """
+        self._history_source = func
+
+    def show_time_range(self, start, end, resolution=None):
+        """
+        Graph stored history between start and end instead of the
+        live data_array, until show_live() is called.
+
+        :returns: False if there is no history to show
+        """
+        datasets = None
+        if self._history_source:
+            datasets = self._history_source(start, end, resolution)
+        if not datasets or not datasets[0]:
+            self.show_live()
+            return False
+
+        data = []
+        for dataset in datasets[:self.num_sets]:
+            # Match the live data ordering
+            if self.reversed:
+                dataset = dataset[::-1]
+            data.extend(dataset)
+        self._history_array = data
+        self.queue_draw()
+        return True
+
+    def show_live(self):
+        self._history_array = None
+        self.queue_draw()
+
 
     def do_draw(self, cr):
         cr.save()
@@ -6,6 +6,8 @@
 
 import logging
 
+from gi.repository import Gtk
+
 from virtinst import util
 
 from .baseclass import vmmGObjectUI
@@ -49,6 +51,8 @@ class vmmHost(vmmGObjectUI):
 
         self._cpu_usage_graph = None
         self._memory_usage_graph = None
+        # NUMA cell id -> (GtkLabel, Sparkline)
+        self._cell_graphs = {}
         self._init_conn_state()
 
         self._storagelist = None
@@ -91,6 +95,7 @@ class vmmHost(vmmGObjectUI):
         if vis:
             return
 
+        self.conn.statsmanager.set_host_watched(True)
         vmmEngine.get_instance().increment_window_counter()
 
     def close(self, src=None, event=None):
@@ -101,6 +106,7 @@ class vmmHost(vmmGObjectUI):
             return
 
         self.topwin.hide()
+        self.conn.statsmanager.set_host_watched(False)
         vmmEngine.get_instance().decrement_window_counter()
 
         return 1
@@ -123,6 +129,11 @@ class vmmHost(vmmGObjectUI):
         self._memory_usage_graph.destroy()
         self._memory_usage_graph = None
 
+        for label, graph in self._cell_graphs.values():
+            label.destroy()
+            graph.destroy()
+        self._cell_graphs = {}
+
 
     ###########
     # UI init #
@@ -174,6 +185,56 @@ class vmmHost(vmmGObjectUI):
         self._cpu_usage_graph.set_property("data_array", cpu_vector)
         self._memory_usage_graph.set_property("data_array", memory_vector)
 
+        self._refresh_numa_cells()
+
+    def _add_cell_graph(self, cell):
+        label = Gtk.Label()
+        label.set_halign(Gtk.Align.START)
+        label.show()
+
+        graph = Sparkline()
+        graph.set_property("reversed", True)
+        graph.set_property("filled", False)
+        graph.set_property("num_sets", 2)
+        graph.set_property("rgb", [x / 255.0 for x in
+                                   [0x82, 0x00, 0x3B, 0x29, 0x5C, 0x45]])
+        graph.set_size_request(-1, 40)
+        graph.show()
+
+        box = self.widget("performance-numa-box")
+        box.pack_start(label, False, True, 0)
+        box.pack_start(graph, False, True, 0)
+        self._cell_graphs[cell] = (label, graph)
+
+    def _refresh_numa_cells(self):
+        cells = self.conn.host_numa_cells()
+        self.widget("performance-numa-frame").set_visible(bool(cells))
+
+        for cell in list(self._cell_graphs):
+            if cell in cells:
+                continue
+            label, graph = self._cell_graphs.pop(cell)
+            label.destroy()
+            graph.destroy()
+
+        for cell in cells:
+            if cell not in self._cell_graphs:
+                self._add_cell_graph(cell)
+            label, graph = self._cell_graphs[cell]
+
+            used, total = self.conn.host_cell_memory(cell)
+            label.set_markup(
+                _("Cell %(cell)d: "
+                  "<span color=\"#82003B\">%(cpu)d %% CPU</span>, "
+                  "<span color=\"#295C45\">%(used)s of %(total)s</span>") % {
+                    "cell": cell,
+                    "cpu": self.conn.host_cell_cpu_percentage(cell),
+                    "used": util.pretty_mem(used),
+                    "total": util.pretty_mem(total)})
+            graph.set_property("data_array",
+                    self.conn.host_cell_cpu_vector(cell) +
+                    self.conn.host_cell_memory_vector(cell))
+
     def _refresh_conn_state(self):
         conn_active = self.conn.is_active()
 
@@ -132,6 +132,7 @@ class vmmLibvirtObject(vmmGObject):
             self.conn.rename_object(self, origxml, newxml, oldconnkey)
         except Exception:
             self._key = oldname
+            self.conn.object_connkey_changed(self)
             raise
         finally:
             self.__force_refresh_xml()
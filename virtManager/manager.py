@@ -6,6 +6,7 @@
 
 import logging
 
+from gi.repository import GLib
 from gi.repository import GObject
 from gi.repository import Gtk
 from gi.repository import Gdk
@@ -18,6 +19,7 @@ from virtinst import util
 from . import vmmenu
 from . import uiutil
 from .baseclass import vmmGObjectUI
+from .connection import vmmConnection
 from .connmanager import vmmConnectionManager
 from .engine import vmmEngine
 from .graphwidgets import CellRendererSparkline
@@ -36,7 +38,23 @@ ROW_IS_CONN_CONNECTED,
 ROW_IS_VM,
 ROW_IS_VM_RUNNING,
 ROW_COLOR,
-ROW_INSPECTION_OS_ICON) = range(11)
+ROW_INSPECTION_OS_ICON,
+ROW_SORT_NAME,
+ROW_SORT_GUEST_CPU,
+ROW_SORT_HOST_CPU,
+ROW_SORT_MEM,
+ROW_SORT_DISK,
+ROW_SORT_NETWORK,
+ROW_SORT_CONN) = range(18)
+
+# Precomputed sort key columns, in the order of _get_sort_keys
+_SORT_KEY_COLUMNS = [ROW_SORT_NAME, ROW_SORT_GUEST_CPU, ROW_SORT_HOST_CPU,
+                     ROW_SORT_MEM, ROW_SORT_DISK, ROW_SORT_NETWORK,
+                     ROW_SORT_CONN]
+
+# Above this many changed sort keys in one flush, the model is resorted
+# once instead of moving every row individually
+_SORT_BATCH_ROWS = 32
 
 # Columns in the tree view
 (COL_NAME,
@@ -54,8 +72,44 @@ def _style_get_prop(widget, propname):
     return value.get_int()
 
 
-def _cmp(a, b):
-    return ((a > b) - (a < b))
+class _SearchIndex(object):
+    """
+    In memory index of row key -> lowercased searchable text, used for
+    type-ahead find in the VM list. The result of the last query is
+    kept, so typing another character only narrows down those matches.
+    """
+    def __init__(self):
+        self._text = {}
+        self._last = None
+
+    def set(self, key, *fields):
+        self._text[key] = "\n".join(f.lower() for f in fields if f)
+        self._last = None
+
+    def remove(self, key):
+        if self._text.pop(key, None) is not None:
+            self._last = None
+
+    def clear(self):
+        self._text = {}
+        self._last = None
+
+    def search(self, query):
+        """
+        Return the set of keys whose text contains query
+        """
+        query = query.strip().lower()
+        candidates = self._text
+        if self._last:
+            if self._last[0] == query:
+                return self._last[1]
+            if query.startswith(self._last[0]):
+                candidates = self._last[1]
+
+        matches = frozenset(k for k in candidates
+                            if query in self._text[k])
+        self._last = (query, matches)
+        return matches
 
 
 def _get_inspection_icon_pixbuf(vm, w, h):
@@ -103,6 +157,22 @@ class vmmManager(vmmGObjectUI):
         self.connmenu = Gtk.Menu()
         self.connmenu_items = {}
 
+        # (uri, connkey) -> Gtk.TreeRowReference, connkey is None for
+        # connection rows. See get_row
+        self._row_refs = {}
+
+        # Row key -> (conn or vm, needs rebuild) waiting to be redrawn,
+        # see _queue_row_update
+        self._dirty_rows = {}
+        self._dirty_sort = {}
+        self._flush_id = None
+        self._last_flush = 0
+        self._search_index = _SearchIndex()
+        self._update_rate = self.config.get_manager_update_rate()
+        self.add_gsettings_handle(
+            self.config.on_manager_update_rate_changed(
+                self._update_rate_changed))
+
         self.builder.connect_signals({
             "on_menu_view_guest_cpu_usage_activate":
             self.toggle_stats_visible_guest_cpu,
@@ -114,6 +184,7 @@ class vmmManager(vmmGObjectUI):
             self.toggle_stats_visible_disk,
             "on_menu_view_network_traffic_activate":
             self.toggle_stats_visible_network,
+            "on_menu_view_flat_list_activate": self.toggle_flat_list,
 
             "on_vm_manager_delete_event": self.close,
             "on_vmm_manager_configure_event": self.window_resized,
@@ -141,6 +212,7 @@ class vmmManager(vmmGObjectUI):
 
         # There seem to be ref counting issues with calling
         # list.get_column, so avoid it
+        self.namecol = None
         self.diskcol = None
         self.netcol = None
         self.memcol = None
@@ -217,6 +289,14 @@ class vmmManager(vmmGObjectUI):
         self.connmenu.destroy()
         self.connmenu = None
         self.connmenu_items = None
+        self.namecol = None
+        self._row_refs = {}
+        self._dirty_rows = {}
+        self._dirty_sort = {}
+        self._search_index = None
+        if self._flush_id is not None:
+            self.widget("vm-list").remove_tick_callback(self._flush_id)
+            self._flush_id = None
 
         if self._window_size:
             self.config.set_manager_window_size(*self._window_size)
@@ -262,6 +342,9 @@ class vmmManager(vmmGObjectUI):
             self.config.on_stats_enable_memory_poll_changed(
                 self.enable_polling, COL_MEM))
 
+        self.add_gsettings_handle(
+            self.config.on_vmlist_flat_changed(self._flat_list_changed))
+
         self.toggle_guest_cpu_usage_visible_widget()
         self.toggle_host_cpu_usage_visible_widget()
         self.toggle_memory_usage_visible_widget()
@@ -322,9 +405,16 @@ class vmmManager(vmmGObjectUI):
         rowtypes.insert(ROW_IS_VM_RUNNING, bool)  # if VM is running
         rowtypes.insert(ROW_COLOR, str)  # row markup color string
         rowtypes.insert(ROW_INSPECTION_OS_ICON, GdkPixbuf.Pixbuf)  # OS icon
+        # Sort keys, compared natively by the model
+        rowtypes.insert(ROW_SORT_NAME, str)
+        rowtypes.insert(ROW_SORT_GUEST_CPU, float)
+        rowtypes.insert(ROW_SORT_HOST_CPU, float)
+        rowtypes.insert(ROW_SORT_MEM, float)
+        rowtypes.insert(ROW_SORT_DISK, float)
+        rowtypes.insert(ROW_SORT_NETWORK, float)
+        rowtypes.insert(ROW_SORT_CONN, str)  # conn grouping key
+        self._rowtypes = rowtypes
 
-        model = Gtk.TreeStore(*rowtypes)
-        vmlist.set_model(model)
         vmlist.set_tooltip_column(ROW_HINT)
         vmlist.set_headers_visible(True)
         vmlist.set_level_indentation(
@@ -332,9 +422,9 @@ class vmmManager(vmmGObjectUI):
 
         nameCol = Gtk.TreeViewColumn(_("Name"))
         nameCol.set_expand(True)
-        nameCol.set_sizing(Gtk.TreeViewColumnSizing.AUTOSIZE)
         nameCol.set_spacing(6)
-        nameCol.set_sort_column_id(COL_NAME)
+        nameCol.set_sort_column_id(ROW_SORT_NAME)
+        self.namecol = nameCol
 
         vmlist.append_column(nameCol)
 
@@ -360,7 +450,7 @@ class vmmManager(vmmGObjectUI):
         self.spacer_txt.set_property("visible", False)
         nameCol.pack_end(self.spacer_txt, False)
 
-        def make_stats_column(title, colnum):
+        def make_stats_column(title, sortcol):
             col = Gtk.TreeViewColumn(title)
             col.set_min_width(140)
 
@@ -376,23 +466,112 @@ class vmmManager(vmmGObjectUI):
             col.pack_start(img, True)
             col.add_attribute(img, 'visible', ROW_IS_VM)
 
-            col.set_sort_column_id(colnum)
+            col.set_sort_column_id(sortcol)
             vmlist.append_column(col)
             return col
 
-        self.guestcpucol = make_stats_column(_("CPU usage"), COL_GUEST_CPU)
-        self.hostcpucol = make_stats_column(_("Host CPU usage"), COL_HOST_CPU)
-        self.memcol = make_stats_column(_("Memory usage"), COL_MEM)
-        self.diskcol = make_stats_column(_("Disk I/O"), COL_DISK)
-        self.netcol = make_stats_column(_("Network I/O"), COL_NETWORK)
+        self.guestcpucol = make_stats_column(_("CPU usage"),
+                                             ROW_SORT_GUEST_CPU)
+        self.hostcpucol = make_stats_column(_("Host CPU usage"),
+                                            ROW_SORT_HOST_CPU)
+        self.memcol = make_stats_column(_("Memory usage"), ROW_SORT_MEM)
+        self.diskcol = make_stats_column(_("Disk I/O"), ROW_SORT_DISK)
+        self.netcol = make_stats_column(_("Network I/O"), ROW_SORT_NETWORK)
+
+        # Type-ahead find, matched against _search_index
+        vmlist.set_enable_search(True)
+        vmlist.set_search_column(ROW_SORT_KEY)
+        vmlist.set_search_equal_func(self._search_equal_func, None)
+
+        self._flat = self.config.is_vmlist_flat()
+        self.widget("menu_view_flat_list").set_active(self._flat)
+        self._set_list_mode()
+        vmlist.set_model(self._make_model())
+
+        # Scrolling, resizing, expanding or sorting can bring rows
+        # with deferred updates into view
+        vmlist.get_vadjustment().connect("value-changed",
+                                         self._schedule_row_flush)
+        vmlist.get_vadjustment().connect("changed",
+                                         self._schedule_row_flush)
+        vmlist.connect("row-expanded", self._schedule_row_flush)
+
+    def _make_model(self):
+        """
+        Build an empty list model: a Gtk.ListStore in flat mode, which
+        sorts and scales better for huge lists, otherwise a TreeStore
+        with VMs nested under their connection
+        """
+        if self._flat:
+            model = Gtk.ListStore(*self._rowtypes)
+            # Keep VMs grouped after their connection row, whichever
+            # column is sorted on
+            for sortcol in _SORT_KEY_COLUMNS:
+                if sortcol != ROW_SORT_CONN:
+                    model.set_sort_func(sortcol, self._flat_sort_func,
+                                        sortcol)
+        else:
+            model = Gtk.TreeStore(*self._rowtypes)
+        model.set_sort_column_id(ROW_SORT_NAME, Gtk.SortType.ASCENDING)
+        model.connect("sort-column-changed", self._schedule_row_flush)
+        return model
 
-        model.set_sort_func(COL_NAME, self.vmlist_name_sorter)
-        model.set_sort_func(COL_GUEST_CPU, self.vmlist_guest_cpu_usage_sorter)
-        model.set_sort_func(COL_HOST_CPU, self.vmlist_host_cpu_usage_sorter)
-        model.set_sort_func(COL_MEM, self.vmlist_memory_usage_sorter)
-        model.set_sort_func(COL_DISK, self.vmlist_disk_io_sorter)
-        model.set_sort_func(COL_NETWORK, self.vmlist_network_usage_sorter)
-        model.set_sort_column_id(COL_NAME, Gtk.SortType.ASCENDING)
+    def _set_list_mode(self):
+        """
+        In flat mode every column gets a fixed size, so the view can
+        use fixed height mode and only measure rows that are on screen
+        """
+        vmlist = self.widget("vm-list")
+        statscols = [self.guestcpucol, self.hostcpucol, self.memcol,
+                     self.diskcol, self.netcol]
+
+        if not self._flat:
+            vmlist.set_fixed_height_mode(False)
+        self.namecol.set_sizing(self._flat and
+                                Gtk.TreeViewColumnSizing.FIXED or
+                                Gtk.TreeViewColumnSizing.AUTOSIZE)
+        for col in statscols:
+            col.set_sizing(self._flat and
+                           Gtk.TreeViewColumnSizing.FIXED or
+                           Gtk.TreeViewColumnSizing.GROW_ONLY)
+            if self._flat:
+                col.set_fixed_width(col.get_min_width())
+        if self._flat:
+            vmlist.set_fixed_height_mode(True)
+        vmlist.set_show_expanders(not self._flat)
+
+    def _rebuild_model(self):
+        vmlist = self.widget("vm-list")
+        sortid, order = self.model.get_sort_column_id()
+
+        self._row_refs = {}
+        self._dirty_rows = {}
+        self._dirty_sort = {}
+        self._search_index.clear()
+
+        self._set_list_mode()
+        model = self._make_model()
+        if sortid is not None:
+            model.set_sort_column_id(sortid, order)
+        vmlist.set_model(model)
+
+        for conn in vmmConnectionManager.get_instance().conns.values():
+            self._add_row(None, self._build_row(conn, None))
+            for vm in conn.list_vms():
+                self._add_vm_row(conn, vm)
+        self.update_current_selection()
+
+    def _flat_list_changed(self):
+        flat = self.config.is_vmlist_flat()
+        self.widget("menu_view_flat_list").set_active(flat)
+        if flat == self._flat:
+            return
+        self._flat = flat
+        self._rebuild_model()
+
+    def toggle_flat_list(self, src):
+        if src.get_active() != self._flat:
+            self.config.set_vmlist_flat(src.get_active())
 
 
     ##################
@@ -422,21 +601,125 @@ class vmmManager(vmmGObjectUI):
             return handle
         return handle.conn
 
+    def _get_row_key(self, conn_or_vm):
+        if isinstance(conn_or_vm, vmmConnection):
+            return (conn_or_vm.get_uri(), None)
+        return (conn_or_vm.conn.get_uri(), conn_or_vm.get_connkey())
+
+    def _add_row(self, parent, row):
+        handle = row[ROW_HANDLE]
+        key = self._get_row_key(handle)
+        if self._flat:
+            rowiter = self.model.append(row)
+        else:
+            rowiter = self.model.append(parent, row)
+        self._row_refs[key] = Gtk.TreeRowReference.new(
+                self.model, self.model.get_path(rowiter))
+        if row[ROW_IS_VM]:
+            self._search_index.set(key, row[ROW_SORT_KEY],
+                                   handle.get_uuid(), row[ROW_HINT])
+        return rowiter
+
+    def _remove_row(self, rowiter):
+        key = self._get_row_key(self.model[rowiter][ROW_HANDLE])
+        self._row_refs.pop(key, None)
+        self._dirty_rows.pop(key, None)
+        self._dirty_sort.pop(key, None)
+        self._search_index.remove(key)
+        self.model.remove(rowiter)
+
+    def _remove_vm_rows(self, uri):
+        """
+        Remove the rows of every VM on the connection uri
+        """
+        for key in [k for k in self._row_refs
+                    if k[0] == uri and k[1] is not None]:
+            ref = self._row_refs[key]
+            if ref.valid():
+                self._remove_row(self.model.get_iter(ref.get_path()))
+            else:
+                self._row_refs.pop(key)
+
+    def _search_equal_func(self, model, column, key, rowiter, data):
+        # Returns False for a match, like strcmp
+        ignore = column
+        ignore = data
+        handle = model[rowiter][ROW_HANDLE]
+        return (self._get_row_key(handle) not in
+                self._search_index.search(key))
+
+    def _get_sort_keys(self, conn_or_vm):
+        if isinstance(conn_or_vm, vmmConnection):
+            conn = conn_or_vm
+            name = conn.get_pretty_desc().lower()
+        else:
+            conn = conn_or_vm.conn
+            name = conn_or_vm.get_name_or_title().lower()
+
+        return [name,
+                float(conn_or_vm.guest_cpu_time_percentage()),
+                float(conn_or_vm.host_cpu_time_percentage()),
+                float(conn_or_vm.stats_memory()),
+                float(conn_or_vm.disk_io_rate()),
+                float(conn_or_vm.network_traffic_rate()),
+                "%s\n%s" % (conn.get_pretty_desc().lower(), conn.get_uri())]
+
+    def _flat_sort_func(self, model, iter1, iter2, sortcol):
+        """
+        Sort func for flat mode: rows are grouped by connection, with
+        the connection row first, and only sorted by sortcol within
+        their group. This compares the precomputed keys directly rather
+        than with the default utf8 collation, which ignores separators
+        and would mix up the groups
+        """
+        cols = (ROW_SORT_CONN, ROW_IS_VM, sortcol)
+        conn1, isvm1, value1 = model.get(iter1, *cols)
+        conn2, isvm2, value2 = model.get(iter2, *cols)
+
+        group1 = (conn1, isvm1)
+        group2 = (conn2, isvm2)
+        if group1 != group2:
+            ret = (group1 > group2) - (group1 < group2)
+            # The model flips the result for descending order, but the
+            # groups should stay put
+            if model.get_sort_column_id()[1] == Gtk.SortType.DESCENDING:
+                ret = -ret
+            return ret
+        return (value1 > value2) - (value1 < value2)
+
+    def _flush_sort_keys(self):
+        dirty = self._dirty_sort
+        self._dirty_sort = {}
+        if not dirty:
+            return
+
+        model = self.model
+        sortid, order = model.get_sort_column_id()
+        batch = sortid is not None and len(dirty) > _SORT_BATCH_ROWS
+        if batch:
+            model.set_sort_column_id(
+                    Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID, order)
+
+        try:
+            for obj in dirty.values():
+                row = self.get_row(obj)
+                if row is None:
+                    continue
+                keys = self._get_sort_keys(obj)
+                if list(model.get(row.iter, *_SORT_KEY_COLUMNS)) != keys:
+                    model.set(row.iter, _SORT_KEY_COLUMNS, keys)
+        finally:
+            if batch:
+                model.set_sort_column_id(sortid, order)
+
     def get_row(self, conn_or_vm):
-        def _walk(model, rowiter, obj):
-            while rowiter:
-                row = model[rowiter]
-                if row[ROW_HANDLE] == obj:
-                    return row
-                if model.iter_has_child(rowiter):
-                    ret = _walk(model, model.iter_nth_child(rowiter, 0), obj)
-                    if ret:
-                        return ret
-                rowiter = model.iter_next(rowiter)
-
-        if not len(self.model):
+        ref = self._row_refs.get(self._get_row_key(conn_or_vm))
+        if not ref or not ref.valid():
+            return None
+        row = self.model[ref.get_path()]
+        if row[ROW_HANDLE] != conn_or_vm:
             return None
-        return _walk(self.model, self.model.get_iter_first(), conn_or_vm)
+        return row
 
 
     ####################
@@ -558,30 +841,38 @@ class vmmManager(vmmGObjectUI):
         if not vm:
             return
 
-        vm_row = self._build_row(None, vm)
-        conn_row = self.get_row(conn)
-        self.model.append(conn_row.iter, vm_row)
+        self._add_vm_row(conn, vm)
 
         vm.connect("state-changed", self.vm_changed)
         vm.connect("resources-sampled", self.vm_row_updated)
         vm.connect("inspection-changed", self.vm_inspection_changed)
 
+    def _add_vm_row(self, conn, vm):
+        vm_row = self._build_row(None, vm)
+        conn_row = self.get_row(conn)
+        self._add_row(conn_row.iter, vm_row)
+
         # Expand a connection when adding a vm to it
-        self.widget("vm-list").expand_row(conn_row.path, False)
+        if not self._flat:
+            self.widget("vm-list").expand_row(conn_row.path, False)
 
     def vm_removed(self, conn, connkey):
-        parent = self.get_row(conn).iter
-        for rowidx in range(self.model.iter_n_children(parent)):
-            rowiter = self.model.iter_nth_child(parent, rowidx)
-            vm = self.model[rowiter][ROW_HANDLE]
-            if vm.get_connkey() == connkey:
-                self.model.remove(rowiter)
-                break
+        ref = self._row_refs.get((conn.get_uri(), connkey))
+        if not ref or not ref.valid():
+            return
+        self._remove_row(self.model.get_iter(ref.get_path()))
 
     def _build_conn_hint(self, conn):
         hint = conn.get_uri()
         if conn.is_disconnected():
             hint += " (%s)" % _("Double click to connect")
+            return hint
+
+        top = conn.get_top_vms("cpu")
+        if top:
+            hint += "\n\n" + _("Busiest by CPU:")
+            for vm, value in top:
+                hint += "\n  %s: %d %%" % (vm.get_name_or_title(), value)
         return hint
 
     def _build_conn_markup(self, conn, name):
@@ -601,10 +892,13 @@ class vmmManager(vmmGObjectUI):
             color = "#5b5b5b"
         return color
 
-    def _build_vm_markup(self, name, status):
+    def _build_vm_markup(self, name, status, alerts=None):
         domtext     = ("<span size='smaller' weight='bold'>%s</span>" %
                        util.xml_escape(name))
         statetext   = "<span size='smaller'>%s</span>" % status
+        if alerts:
+            statetext += (" <span size='smaller' color='#C00000'>%s</span>" %
+                          util.xml_escape(", ".join(alerts)))
         return domtext + "\n" + statetext
 
     def _build_row(self, conn, vm):
@@ -620,7 +914,8 @@ class vmmManager(vmmGObjectUI):
         else:
             name = vm.get_name_or_title()
             status = vm.run_status()
-            markup = self._build_vm_markup(name, status)
+            markup = self._build_vm_markup(name, status,
+                                           vm.get_stats_alerts())
             status_icon = vm.run_status_icon_name()
             hint = vm.get_description()
             color = None
@@ -639,6 +934,7 @@ class vmmManager(vmmGObjectUI):
         row.insert(ROW_IS_VM_RUNNING, bool(vm) and vm.is_active())
         row.insert(ROW_COLOR, color)
         row.insert(ROW_INSPECTION_OS_ICON, os_icon)
+        row.extend(self._get_sort_keys(conn or vm))
 
         return row
 
@@ -649,67 +945,149 @@ class vmmManager(vmmGObjectUI):
             return
 
         conn_row = self._build_row(conn, None)
-        self.model.append(None, conn_row)
+        self._add_row(None, conn_row)
 
         conn.connect("vm-added", self.vm_added)
         conn.connect("vm-removed", self.vm_removed)
         conn.connect("resources-sampled", self.conn_row_updated)
         conn.connect("state-changed", self.conn_state_changed)
+        conn.connect("stats-alert-changed", self.vm_stats_alert_changed)
+        conn.connect("top-vms-changed", self.conn_top_vms_changed)
 
         for vm in conn.list_vms():
             self.vm_added(conn, vm.get_connkey())
 
     def _conn_removed(self, _src, uri):
-        conn_row = None
-        for row in self.model:
-            if row[ROW_IS_CONN] and row[ROW_HANDLE].get_uri() == uri:
-                conn_row = row
-                break
-        if conn_row is None:
+        ref = self._row_refs.get((uri, None))
+        if not ref or not ref.valid():
             return
 
-        child = self.model.iter_children(conn_row.iter)
-        while child is not None:
-            self.model.remove(child)
-            child = self.model.iter_children(conn_row.iter)
-        self.model.remove(conn_row.iter)
+        self._remove_vm_rows(uri)
+        self._remove_row(self.model.get_iter(ref.get_path()))
 
 
     #############################
     # State/UI updating methods #
     #############################
 
-    def vm_row_updated(self, vm):
-        row = self.get_row(vm)
-        if row is None:
-            return
-        self.model.row_changed(row.path, row.iter)
+    def _update_rate_changed(self):
+        self._update_rate = self.config.get_manager_update_rate()
 
-    def vm_changed(self, vm):
-        row = self.get_row(vm)
-        if row is None:
+    def _queue_row_update(self, conn_or_vm, rebuild=False):
+        """
+        Mark a row as needing a redraw. Updates are coalesced and
+        flushed at most once per frame, or at the configured max rate.
+        If rebuild is True, the row contents are refreshed from the VM
+        first.
+        """
+        key = self._get_row_key(conn_or_vm)
+        rebuild = rebuild or self._dirty_rows.get(key, (None, False))[1]
+        self._dirty_rows[key] = (conn_or_vm, rebuild)
+        self._dirty_sort[key] = conn_or_vm
+        self._schedule_row_flush()
+
+    def _schedule_row_flush(self, *args, **kwargs):
+        ignore = args
+        ignore = kwargs
+        if self._flush_id is not None or not self._dirty_rows:
             return
+        if not self.model:
+            return
+        # Tick callbacks run once per frame, and not at all while the
+        # window is hidden
+        self._flush_id = self.widget("vm-list").add_tick_callback(
+                self._flush_rows_cb)
 
-        try:
-            if vm == self.current_vm():
-                self.update_current_selection()
+    def _row_is_visible(self, vmlist, visible_range, path):
+        if not visible_range:
+            return False
+        start, end = visible_range
+        if path.compare(start) < 0 or path.compare(end) > 0:
+            return False
+        if path.get_depth() > 1:
+            parent = path.copy()
+            parent.up()
+            return vmlist.row_expanded(parent)
+        return True
 
+    def _flush_rows_cb(self, vmlist, frame_clock):
+        if self._update_rate > 0:
+            now = frame_clock.get_frame_time()
+            if now - self._last_flush < 1000000 // self._update_rate:
+                return GLib.SOURCE_CONTINUE
+            self._last_flush = now
+
+        # Sort keys are refreshed for every changed row, so the order
+        # is right wherever the user scrolls to. Rows scrolled out of
+        # view keep their pending redraw until they are visible again
+        self._flush_sort_keys()
+        visible_range = vmlist.get_visible_range()
+        for key, (obj, rebuild) in list(self._dirty_rows.items()):
+            row = self.get_row(obj)
+            if row is None:
+                self._dirty_rows.pop(key)
+                continue
+            if not self._row_is_visible(vmlist, visible_range, row.path):
+                continue
+
+            self._dirty_rows.pop(key)
+            if rebuild and not self._rebuild_vm_row(obj, row):
+                continue
+            self.model.row_changed(row.path, row.iter)
+
+        self._flush_id = None
+        return GLib.SOURCE_REMOVE
+
+    def vm_row_updated(self, vm):
+        self._queue_row_update(vm)
+
+    def _rebuild_vm_row(self, vm, row):
+        try:
             name = vm.get_name_or_title()
             status = vm.run_status()
 
             row[ROW_SORT_KEY] = name
             row[ROW_STATUS_ICON] = vm.run_status_icon_name()
             row[ROW_IS_VM_RUNNING] = vm.is_active()
-            row[ROW_MARKUP] = self._build_vm_markup(name, status)
+            row[ROW_MARKUP] = self._build_vm_markup(name, status,
+                                                    vm.get_stats_alerts())
 
             desc = vm.get_description()
             row[ROW_HINT] = util.xml_escape(desc)
+            self._search_index.set(self._get_row_key(vm), name,
+                                   vm.get_uuid(), row[ROW_HINT])
+        except libvirt.libvirtError as e:
+            if util.exception_is_libvirt_error(e, "VIR_ERR_NO_DOMAIN"):
+                return False
+            raise
+        return True
+
+    def vm_changed(self, vm):
+        if self.get_row(vm) is None:
+            return
+
+        try:
+            if vm == self.current_vm():
+                self.update_current_selection()
         except libvirt.libvirtError as e:
             if util.exception_is_libvirt_error(e, "VIR_ERR_NO_DOMAIN"):
                 return
             raise
 
-        self.vm_row_updated(vm)
+        self._queue_row_update(vm, rebuild=True)
+
+    def vm_stats_alert_changed(self, conn, connkey, rulestr, active):
+        ignore = rulestr
+        ignore = active
+        vm = conn.get_vm(connkey)
+        if vm:
+            self.vm_changed(vm)
+
+    def conn_top_vms_changed(self, conn):
+        row = self.get_row(conn)
+        if row is None:
+            return
+        row[ROW_HINT] = util.xml_escape(self._build_conn_hint(conn))
 
     def vm_inspection_changed(self, vm):
         row = self.get_row(vm)
@@ -742,25 +1120,20 @@ class vmmManager(vmmGObjectUI):
         row[ROW_MARKUP] = self._build_conn_markup(conn, row[ROW_SORT_KEY])
         row[ROW_IS_CONN_CONNECTED] = not conn.is_disconnected()
         row[ROW_COLOR] = self._build_conn_color(conn)
-        row[ROW_HINT] = self._build_conn_hint(conn)
+        row[ROW_HINT] = util.xml_escape(self._build_conn_hint(conn))
 
         if not conn.is_active():
-            child = self.model.iter_children(row.iter)
-            while child is not None:
-                self.model.remove(child)
-                child = self.model.iter_children(row.iter)
+            self._remove_vm_rows(conn.get_uri())
 
         self.conn_row_updated(conn)
         self.update_current_selection()
 
     def conn_row_updated(self, conn):
-        row = self.get_row(conn)
-
         self.max_disk_rate = max(self.max_disk_rate, conn.disk_io_max_rate())
         self.max_net_rate = max(self.max_net_rate,
                                 conn.network_traffic_max_rate())
 
-        self.model.row_changed(row.path, row.iter)
+        self._queue_row_update(conn)
 
     def change_run_text(self, can_restore):
         if can_restore:
@@ -855,44 +1228,6 @@ class vmmManager(vmmGObjectUI):
     # Stats methods #
     #################
 
-    def vmlist_name_sorter(self, model, iter1, iter2, ignore):
-        key1 = str(model[iter1][ROW_SORT_KEY]).lower()
-        key2 = str(model[iter2][ROW_SORT_KEY]).lower()
-        return _cmp(key1, key2)
-
-    def vmlist_guest_cpu_usage_sorter(self, model, iter1, iter2, ignore):
-        obj1 = model[iter1][ROW_HANDLE]
-        obj2 = model[iter2][ROW_HANDLE]
-
-        return _cmp(obj1.guest_cpu_time_percentage(),
-                   obj2.guest_cpu_time_percentage())
-
-    def vmlist_host_cpu_usage_sorter(self, model, iter1, iter2, ignore):
-        obj1 = model[iter1][ROW_HANDLE]
-        obj2 = model[iter2][ROW_HANDLE]
-
-        return _cmp(obj1.host_cpu_time_percentage(),
-                   obj2.host_cpu_time_percentage())
-
-    def vmlist_memory_usage_sorter(self, model, iter1, iter2, ignore):
-        obj1 = model[iter1][ROW_HANDLE]
-        obj2 = model[iter2][ROW_HANDLE]
-
-        return _cmp(obj1.stats_memory(),
-                   obj2.stats_memory())
-
-    def vmlist_disk_io_sorter(self, model, iter1, iter2, ignore):
-        obj1 = model[iter1][ROW_HANDLE]
-        obj2 = model[iter2][ROW_HANDLE]
-
-        return _cmp(obj1.disk_io_rate(), obj2.disk_io_rate())
-
-    def vmlist_network_usage_sorter(self, model, iter1, iter2, ignore):
-        obj1 = model[iter1][ROW_HANDLE]
-        obj2 = model[iter2][ROW_HANDLE]
-
-        return _cmp(obj1.network_traffic_rate(), obj2.network_traffic_rate())
-
     def enable_polling(self, column):
         # pylint: disable=redefined-variable-type
         if column == COL_GUEST_CPU:
@@ -980,44 +1315,42 @@ class vmmManager(vmmGObjectUI):
     def toggle_stats_visible_network(self, src):
         self.toggle_stats_visible(src, COL_NETWORK)
 
-    def guest_cpu_usage_img(self, column_ignore, cell, model, _iter, data):
+    def _set_graph_data(self, cell, model, _iter, datafunc, ceil=None):
         obj = model[_iter][ROW_HANDLE]
         if obj is None or not hasattr(obj, "conn"):
             return
 
-        data = obj.guest_cpu_time_vector(GRAPH_LEN)
-        cell.set_property('data_array', data)
+        # Vectors are only rebuilt, and the graph redrawn, after a new
+        # sample or a rescale. Otherwise the renderer reuses its cache
+        cell.set_data_source(obj, (obj.stats_generation(), ceil),
+                             lambda: datafunc(obj))
 
-    def host_cpu_usage_img(self, column_ignore, cell, model, _iter, data):
-        obj = model[_iter][ROW_HANDLE]
-        if obj is None or not hasattr(obj, "conn"):
-            return
+    def _in_out_average(self, vectors):
+        d1, d2 = vectors
+        return [(x + y) / 2 for x, y in zip(d1, d2)]
 
-        data = obj.host_cpu_time_vector(GRAPH_LEN)
-        cell.set_property('data_array', data)
+    def guest_cpu_usage_img(self, column_ignore, cell, model, _iter, data):
+        self._set_graph_data(cell, model, _iter,
+            lambda obj: obj.guest_cpu_time_vector(GRAPH_LEN))
 
-    def memory_usage_img(self, column_ignore, cell, model, _iter, data):
-        obj = model[_iter][ROW_HANDLE]
-        if obj is None or not hasattr(obj, "conn"):
-            return
+    def host_cpu_usage_img(self, column_ignore, cell, model, _iter, data):
+        self._set_graph_data(cell, model, _iter,
+            lambda obj: obj.host_cpu_time_vector(GRAPH_LEN))
 
-        data = obj.stats_memory_vector(GRAPH_LEN)
-        cell.set_property('data_array', data)
+    def memory_usage_img(self, column_ignore, cell, model, _iter, data):
+        self._set_graph_data(cell, model, _iter,
+            lambda obj: obj.stats_memory_vector(GRAPH_LEN))
 
     def disk_io_img(self, column_ignore, cell, model, _iter, data):
-        obj = model[_iter][ROW_HANDLE]
-        if obj is None or not hasattr(obj, "conn"):
-            return
-
-        d1, d2 = obj.disk_io_vectors(GRAPH_LEN, self.max_disk_rate)
-        data = [(x + y) / 2 for x, y in zip(d1, d2)]
-        cell.set_property('data_array', data)
+        ceil = self.max_disk_rate
+        self._set_graph_data(cell, model, _iter,
+            lambda obj: self._in_out_average(
+                obj.disk_io_vectors(GRAPH_LEN, ceil)),
+            ceil=ceil)
 
     def network_traffic_img(self, column_ignore, cell, model, _iter, data):
-        obj = model[_iter][ROW_HANDLE]
-        if obj is None or not hasattr(obj, "conn"):
-            return
-
-        d1, d2 = obj.network_traffic_vectors(GRAPH_LEN, self.max_net_rate)
-        data = [(x + y) / 2 for x, y in zip(d1, d2)]
-        cell.set_property('data_array', data)
+        ceil = self.max_net_rate
+        self._set_graph_data(cell, model, _iter,
+            lambda obj: self._in_out_average(
+                obj.network_traffic_vectors(GRAPH_LEN, ceil)),
+            ceil=ceil)
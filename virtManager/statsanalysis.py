@@ -0,0 +1,258 @@
+# Copyright (C) 2019 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+import heapq
+import logging
+import re
+import threading
+
+
+# Number of VMs tracked by get_top()
+TOP_COUNT = 5
+
+# Metric name -> function(vmmDomain) returning the current value.
+# Used for both top-N tracking and threshold rules
+METRICS = {
+    "cpu": lambda vm: vm.host_cpu_time_percentage(),
+    "memory": lambda vm: vm.stats_memory_percentage(),
+    "disk": lambda vm: vm.disk_io_rate(),
+    "net": lambda vm: vm.network_traffic_rate(),
+}
+TOP_METRICS = ["cpu", "disk", "net"]
+
+
+class _IndexedHeap(object):
+    """
+    Binary max-heap of key -> value that supports updating or removing
+    any key in O(log n), by tracking each key's position in the heap.
+    """
+    def __init__(self):
+        self._heap = []
+        self._pos = {}
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _swap(self, i, j):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._pos[heap[i][1]] = i
+        self._pos[heap[j][1]] = j
+
+    def _sift_up(self, idx):
+        heap = self._heap
+        while idx > 0:
+            parent = (idx - 1) // 2
+            if heap[parent][0] >= heap[idx][0]:
+                break
+            self._swap(idx, parent)
+            idx = parent
+
+    def _sift_down(self, idx):
+        heap = self._heap
+        size = len(heap)
+        while True:
+            largest = idx
+            for child in (2 * idx + 1, 2 * idx + 2):
+                if child < size and heap[child][0] > heap[largest][0]:
+                    largest = child
+            if largest == idx:
+                break
+            self._swap(idx, largest)
+            idx = largest
+
+    def update(self, key, value):
+        idx = self._pos.get(key)
+        if idx is None:
+            self._heap.append([value, key])
+            idx = len(self._heap) - 1
+            self._pos[key] = idx
+            self._sift_up(idx)
+            return
+
+        oldvalue = self._heap[idx][0]
+        self._heap[idx][0] = value
+        if value > oldvalue:
+            self._sift_up(idx)
+        elif value < oldvalue:
+            self._sift_down(idx)
+
+    def remove(self, key):
+        idx = self._pos.pop(key, None)
+        if idx is None:
+            return
+        last = self._heap.pop()
+        if idx == len(self._heap):
+            return
+        self._heap[idx] = last
+        self._pos[last[1]] = idx
+        self._sift_up(idx)
+        self._sift_down(self._pos[last[1]])
+
+    def top(self, count):
+        """
+        Return the count largest (key, value) pairs, largest first.
+        Only walks the top of the heap, so this is O(count log count)
+        no matter how many keys are tracked.
+        """
+        ret = []
+        if not self._heap:
+            return ret
+
+        heap = self._heap
+        candidates = [(-heap[0][0], 0)]
+        while candidates and len(ret) < count:
+            ignore, idx = heapq.heappop(candidates)
+            ret.append((heap[idx][1], heap[idx][0]))
+            for child in (2 * idx + 1, 2 * idx + 2):
+                if child < len(heap):
+                    heapq.heappush(candidates, (-heap[child][0], child))
+        return ret
+
+
+class StatsRule(object):
+    """
+    A threshold rule with hysteresis, parsed from a string like
+    'cpu>90:75'. The alert is raised when the metric goes above 90,
+    and only cleared once it drops below 75. The clear value defaults
+    to 90% of the raise value.
+    """
+    _RE = re.compile(r"^\s*(\w+)\s*>\s*([0-9.]+)\s*(?::\s*([0-9.]+))?\s*$")
+
+    def __init__(self, rulestr):
+        match = self._RE.match(rulestr)
+        if not match or match.group(1) not in METRICS:
+            raise ValueError(_("Invalid stats alert rule '%s'") % rulestr)
+
+        self.rulestr = rulestr.strip()
+        self.metric = match.group(1)
+        self.raise_value = float(match.group(2))
+        self.clear_value = self.raise_value * 0.9
+        if match.group(3) is not None:
+            self.clear_value = min(float(match.group(3)), self.raise_value)
+
+    def evaluate(self, value, active):
+        """
+        Return whether the alert should be active for value, given its
+        current state
+        """
+        if active:
+            return value >= self.clear_value
+        return value > self.raise_value
+
+
+class StatsAnalyzer(object):
+    """
+    Incrementally tracks the busiest VMs for each of TOP_METRICS and
+    the state of the user's threshold rules. update_vm is O(log n)
+    in the number of VMs.
+
+    Updates come from the tick thread while the UI reads results, so
+    all state is guarded by a lock.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heaps = dict((m, _IndexedHeap()) for m in TOP_METRICS)
+        self._rules = []
+        self._rulestrs = None
+
+        # connkey -> set of active rule strings
+        self._alerts = {}
+        self._last_top = {}
+
+    def set_rules(self, rulestrs):
+        """
+        Set the threshold rules from a list of rule strings. Invalid
+        rules are logged and skipped
+        """
+        rulestrs = tuple(rulestrs)
+        if rulestrs == self._rulestrs:
+            return
+        self._rulestrs = rulestrs
+
+        rules = []
+        for rulestr in rulestrs:
+            try:
+                rules.append(StatsRule(rulestr))
+            except ValueError as e:
+                logging.debug("%s", e)
+
+        valid = set(r.rulestr for r in rules)
+        with self._lock:
+            self._rules = rules
+            for connkey in list(self._alerts):
+                self._alerts[connkey] &= valid
+
+    def update_vm(self, vm):
+        """
+        Feed the latest stats sample of vm into the analysis
+
+        :returns: List of (rulestr, active) alert state changes
+        """
+        connkey = vm.get_connkey()
+        if not vm.is_active():
+            return [(r, False) for r in self.remove_vm(connkey)]
+
+        values = {}
+        for metric in set(TOP_METRICS + [r.metric for r in self._rules]):
+            values[metric] = METRICS[metric](vm)
+
+        with self._lock:
+            for metric, heap in self._heaps.items():
+                heap.update(connkey, values[metric])
+            return self._update_alerts(connkey, values)
+
+    def _update_alerts(self, connkey, values):
+        changes = []
+        active = self._alerts.get(connkey, set())
+        for rule in self._rules:
+            was_active = rule.rulestr in active
+            is_active = rule.evaluate(values[rule.metric], was_active)
+            if is_active == was_active:
+                continue
+            if is_active:
+                active.add(rule.rulestr)
+            else:
+                active.discard(rule.rulestr)
+            changes.append((rule.rulestr, is_active))
+
+        if active:
+            self._alerts[connkey] = active
+        else:
+            self._alerts.pop(connkey, None)
+        return changes
+
+    def remove_vm(self, connkey):
+        """
+        Drop a VM from the analysis, for example when it shuts off
+
+        :returns: List of rule strings whose alert was cleared
+        """
+        with self._lock:
+            for heap in self._heaps.values():
+                heap.remove(connkey)
+            return sorted(self._alerts.pop(connkey, []))
+
+    def get_alerts(self, connkey):
+        with self._lock:
+            return sorted(self._alerts.get(connkey, []))
+
+    def get_top(self, metric, count=TOP_COUNT):
+        """
+        Return a list of (connkey, value) of the busiest VMs by metric
+        """
+        with self._lock:
+            return self._heaps[metric].top(count)
+
+    def check_top_changed(self):
+        """
+        Return True if the set or order of the busiest VMs changed
+        since the last call
+        """
+        top = dict((m, [k for k, ignore in self.get_top(m)])
+                   for m in TOP_METRICS)
+        changed = top != self._last_top
+        self._last_top = top
+        return changed
@@ -0,0 +1,312 @@
+# Copyright (C) 2019 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+import http.server
+import logging
+import math
+import os
+import socket
+import socketserver
+import stat
+
+from .baseclass import vmmGObject
+from .connmanager import vmmConnectionManager
+
+
+_CONTENT_TYPE = ("application/openmetrics-text; version=1.0.0; "
+                 "charset=utf-8")
+
+# (metric name, vmmDomain method, help text)
+_DOMAIN_GAUGES = [
+    ("domain_cpu_host_percent", "host_cpu_time_percentage",
+     "Domain CPU usage as a percentage of host CPUs"),
+    ("domain_cpu_guest_percent", "guest_cpu_time_percentage",
+     "Domain CPU usage as a percentage of guest vCPUs"),
+    ("domain_memory_kib", "stats_memory",
+     "Domain memory in use, in KiB"),
+    ("domain_disk_read_kib_per_second", "disk_read_rate",
+     "Domain disk read rate"),
+    ("domain_disk_write_kib_per_second", "disk_write_rate",
+     "Domain disk write rate"),
+    ("domain_network_rx_kib_per_second", "network_rx_rate",
+     "Domain network receive rate"),
+    ("domain_network_tx_kib_per_second", "network_tx_rate",
+     "Domain network transmit rate"),
+]
+
+# (metric name, vmmConnection method, help text)
+_CONN_GAUGES = [
+    ("connection_cpu_host_percent", "host_cpu_time_percentage",
+     "CPU usage of all running domains as a percentage of host CPUs"),
+    ("connection_memory_kib", "stats_memory",
+     "Memory in use by all running domains, in KiB"),
+    ("connection_disk_io_kib_per_second", "disk_io_rate",
+     "Disk I/O rate of all running domains"),
+    ("connection_network_kib_per_second", "network_traffic_rate",
+     "Network traffic rate of all running domains"),
+]
+
+
+def _escape_label(value):
+    return (str(value).replace("\\", "\\\\").
+            replace("\"", "\\\"").replace("\n", "\\n"))
+
+
+def _format_value(value):
+    # python would give 'inf' and 'nan', which OpenMetrics doesn't accept
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return value > 0 and "+Inf" or "-Inf"
+    return repr(value)
+
+
+class _MetricsWriter(object):
+    """
+    Collects samples per metric family and formats them as
+    OpenMetrics text
+    """
+    def __init__(self):
+        self._families = []
+        self._samples = {}
+
+    def add(self, name, mtype, helptxt, labels, value):
+        if name not in self._samples:
+            self._families.append((name, mtype, helptxt))
+            self._samples[name] = []
+        self._samples[name].append((labels, value))
+
+    def format(self):
+        lines = []
+        for name, mtype, helptxt in self._families:
+            fullname = "virt_manager_" + name
+            lines.append("# TYPE %s %s" % (fullname, mtype))
+            lines.append("# HELP %s %s" % (fullname, helptxt))
+            suffix = mtype == "counter" and "_total" or ""
+
+            for labels, value in self._samples[name]:
+                labelstr = ",".join('%s="%s"' % (k, _escape_label(v))
+                                    for k, v in labels)
+                lines.append("%s%s{%s} %s" % (fullname, suffix, labelstr,
+                                              _format_value(value)))
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+def _collect_conn(writer, engine, conn):
+    uri = conn.get_uri()
+    connlabels = [("uri", uri)]
+
+    latency = engine.get_tick_latency(conn)
+    for name, mtype, helptxt, value in [
+            ("connection_ticks", "counter",
+             "Number of connection ticks run", latency.count),
+            ("connection_tick_errors", "counter",
+             "Number of connection ticks that raised an error",
+             latency.errors),
+            ("connection_tick_merged", "counter",
+             "Number of tick requests merged into an already queued tick",
+             latency.merged),
+            ("connection_tick_last_seconds", "gauge",
+             "Duration of the last connection tick", latency.last),
+            ("connection_tick_average_seconds", "gauge",
+             "Moving average of connection tick duration",
+             latency.average),
+            ("connection_tick_max_seconds", "gauge",
+             "Longest connection tick", latency.maximum),
+            ("connection_tick_wait_seconds", "gauge",
+             "Time the last tick waited in the queue", latency.last_wait)]:
+        writer.add(name, mtype, helptxt, connlabels, value)
+
+    for call, count in sorted(conn.statsmanager.get_rpc_counts().items()):
+        writer.add("connection_stats_rpc_calls", "counter",
+                   "Number of libvirt calls made to sample stats",
+                   connlabels + [("call", call)], count)
+
+    if not conn.is_active():
+        return
+
+    for name, method, helptxt in _CONN_GAUGES:
+        writer.add(name, "gauge", helptxt, connlabels,
+                   getattr(conn, method)())
+
+    for vm in conn.list_vms():
+        if not vm.is_active():
+            continue
+        vmlabels = connlabels + [("domain", vm.get_name()),
+                                 ("uuid", vm.get_uuid())]
+        for name, method, helptxt in _DOMAIN_GAUGES:
+            writer.add(name, "gauge", helptxt, vmlabels,
+                       getattr(vm, method)())
+
+        for dev, (rd, wr) in sorted(vm.disk_device_io_rates().items()):
+            devlabels = vmlabels + [("device", dev)]
+            writer.add("domain_disk_device_read_kib_per_second", "gauge",
+                       "Per disk read rate", devlabels, rd)
+            writer.add("domain_disk_device_write_kib_per_second", "gauge",
+                       "Per disk write rate", devlabels, wr)
+        for dev, (rx, tx) in sorted(
+                vm.network_device_traffic_rates().items()):
+            devlabels = vmlabels + [("device", dev)]
+            writer.add("domain_network_device_rx_kib_per_second", "gauge",
+                       "Per interface receive rate", devlabels, rx)
+            writer.add("domain_network_device_tx_kib_per_second", "gauge",
+                       "Per interface transmit rate", devlabels, tx)
+
+
+def format_metrics():
+    """
+    Return the latest collected stats for every connection as
+    OpenMetrics text. This only reads data sampled by the regular
+    connection ticks, it never calls into libvirt.
+    """
+    from .engine import vmmEngine
+    engine = vmmEngine.get_instance()
+    writer = _MetricsWriter()
+
+    # This runs in the server thread, while the main thread may be
+    # adding or removing connections. Copying the dict can race with
+    # that, in which case just report nothing for this scrape
+    try:
+        conns = list(vmmConnectionManager.get_instance().conns.items())
+    except RuntimeError:
+        logging.debug("Connection list changed while collecting metrics",
+                      exc_info=True)
+        conns = []
+    for uri, conn in sorted(conns, key=lambda c: c[0]):
+        try:
+            _collect_conn(writer, engine, conn)
+        except Exception:
+            logging.debug("Error collecting metrics for conn=%s",
+                          uri, exc_info=True)
+    return writer.format()
+
+
+class _MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ["/", "/metrics"]:
+            self.send_error(404)
+            return
+
+        try:
+            body = format_metrics().encode("utf-8")
+        except Exception:
+            logging.debug("Error formatting metrics", exc_info=True)
+            self.send_error(500)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", _CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        # client_address is empty for unix sockets, which breaks
+        # the default implementation
+        ignore = fmt
+        ignore = args
+
+
+class _TCPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class _TCP6Server(_TCPServer):
+    address_family = socket.AF_INET6
+
+
+class _UnixServer(socketserver.ThreadingMixIn,
+                  socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class vmmStatsExporter(vmmGObject):
+    """
+    Opt-in OpenMetrics endpoint for the stats we already collect,
+    enabled by the stats/exporter-address setting
+    """
+    @classmethod
+    def get_instance(cls):
+        if not cls._instance:
+            cls._instance = vmmStatsExporter()
+        return cls._instance
+
+    def __init__(self):
+        vmmGObject.__init__(self)
+        self._cleanup_on_app_close()
+
+        self._server = None
+        self._unix_path = None
+
+        self.add_gsettings_handle(
+            self.config.on_stats_exporter_address_changed(
+                self._address_changed_cb))
+        self._start()
+
+    def _cleanup(self):
+        self._stop()
+
+
+    ###################
+    # Private helpers #
+    ###################
+
+    def _make_server(self, address):
+        if address.startswith("unix:"):
+            path = address[len("unix:"):]
+            # Only remove a stale socket left by a previous run, never
+            # a regular file the user pointed us at by mistake. If
+            # something else is there, bind() will report the error
+            if (os.path.exists(path) and
+                    stat.S_ISSOCK(os.stat(path).st_mode)):
+                os.unlink(path)
+            server = _UnixServer(path, _MetricsRequestHandler)
+            self._unix_path = path
+            return server
+
+        host, port = address.rsplit(":", 1)
+        serverclass = _TCPServer
+        if ":" in host:
+            host = host.strip("[]")
+            serverclass = _TCP6Server
+        return serverclass((host, int(port)), _MetricsRequestHandler)
+
+    def _start(self):
+        address = self.config.get_stats_exporter_address()
+        if not address:
+            return
+
+        try:
+            self._server = self._make_server(address)
+        except Exception as e:
+            logging.warning("Error starting stats exporter on %s: %s",
+                            address, e)
+            self._server = None
+            return
+
+        logging.debug("Serving OpenMetrics stats on %s", address)
+        self._start_thread(self._server.serve_forever,
+                           "Stats exporter %s" % address)
+
+    def _stop(self):
+        if not self._server:
+            return
+
+        server = self._server
+        self._server = None
+        server.shutdown()
+        server.server_close()
+        if self._unix_path:
+            try:
+                os.unlink(self._unix_path)
+            except OSError:
+                pass
+            self._unix_path = None
+
+    def _address_changed_cb(self):
+        self._stop()
+        self._start()
@@ -3,15 +3,115 @@
 # This work is licensed under the GNU GPLv2 or later.
 # See the COPYING file in the top-level directory.
 
+import array
+import collections
 import logging
-import re
+import operator
+import os
+import threading
 import time
 
 import libvirt
 
 from virtinst import util
 
+from . import statsreplay
 from .baseclass import vmmGObject
+from .statsanalysis import StatsAnalyzer
+from .statsstore import StatsStore
+
+
+# Stats saved to the on disk history, see statsstore.py
+_VM_HISTORY_COLUMNS = [
+    "cpuHostPercent", "cpuGuestPercent",
+    "curmem", "currMemPercent",
+    "diskRdRate", "diskWrRate",
+    "netRxRate", "netTxRate",
+]
+_CONN_HISTORY_COLUMNS = [
+    "cpuHostPercent",
+    "memory", "memoryPercent",
+    "diskRdRate", "diskWrRate",
+    "netRxRate", "netTxRate",
+]
+_HISTORY_FILENAME = "stats-history"
+
+# Stats group -> (counter, rate) columns that _VMStatsList can
+# extrapolate when the group is skipped for a tick
+_EXTRAPOLATED_COLUMNS = {
+    "disk": [("diskRdKiB", "diskRdRate"), ("diskWrKiB", "diskWrRate")],
+    "net": [("netRxKiB", "netRxRate"), ("netTxKiB", "netTxRate")],
+}
+
+# Minimum change between two samples of a VM for it to count as
+# activity for the adaptive poll interval: (column, delta)
+_ACTIVITY_THRESHOLDS = [
+    ("cpuHostPercent", 5.0),
+    ("currMemPercent", 5.0),
+    ("diskRdRate", 1024.0),
+    ("diskWrRate", 1024.0),
+    ("netRxRate", 1024.0),
+    ("netTxRate", 1024.0),
+]
+
+
+class _DeviceStatsKeys(object):
+    """
+    Index of the getAllDomainStats keys for one device type, like
+    block.N.name and block.N.rd.bytes. Key names are built once per
+    device index, so sampling is plain dict lookups.
+    """
+    def __init__(self, prefix, field1, field2):
+        self._prefix = prefix
+        self._fields = (field1, field2)
+        self._countkey = "%s.count" % prefix
+        self._keys = []
+
+    def _build_keys(self, count):
+        while len(self._keys) < count:
+            idx = len(self._keys)
+            self._keys.append((
+                "%s.%d.name" % (self._prefix, idx),
+                "%s.%d.%s" % (self._prefix, idx, self._fields[0]),
+                "%s.%d.%s" % (self._prefix, idx, self._fields[1])))
+
+    def get_counters(self, allstats):
+        """
+        Return a dict of device name -> (field1, field2) counters
+        """
+        count = allstats.get(self._countkey, 0)
+        self._build_keys(count)
+
+        ret = {}
+        for namekey, key1, key2 in self._keys[:count]:
+            name = allstats.get(namekey)
+            if name is None:
+                continue
+            ret[name] = (allstats.get(key1, 0), allstats.get(key2, 0))
+        return ret
+
+
+_BLOCK_STATS_KEYS = _DeviceStatsKeys("block", "rd.bytes", "wr.bytes")
+_NET_STATS_KEYS = _DeviceStatsKeys("net", "rx.bytes", "tx.bytes")
+_BLOCK_STATS_FLAGS = libvirt.VIR_DOMAIN_STATS_BLOCK
+_NET_STATS_FLAGS = libvirt.VIR_DOMAIN_STATS_INTERFACE
+
+
+def _calculate_device_rates(oldstats, newstats, timediff):
+    """
+    Compute per device rates from two dicts of
+    name -> (counter1, counter2, ...) tuples
+    """
+    ret = {}
+    for name, (new1, new2) in newstats.items():
+        rate1 = 0.0
+        rate2 = 0.0
+        if name in oldstats and timediff > 0:
+            old1, old2 = oldstats[name][:2]
+            rate1 = max(float(new1 - old1) / timediff, 0.0)
+            rate2 = max(float(new2 - old2) / timediff, 0.0)
+        ret[name] = (new1, new2, rate1, rate2)
+    return ret
 
 
 class _VMStatsRecord(object):
@@ -23,7 +123,8 @@ class _VMStatsRecord(object):
                  cpuHostPercent, cpuGuestPercent,
                  curmem, currMemPercent,
                  diskRdBytes, diskWrBytes,
-                 netRxBytes, netTxBytes):
+                 netRxBytes, netTxBytes,
+                 diskDevBytes=None, netDevBytes=None):
         self.timestamp = timestamp
         self.cpuTime = cpuTime
         self.cpuTimeAbs = cpuTimeAbs
@@ -36,6 +137,12 @@ class _VMStatsRecord(object):
         self.netRxKiB = netRxBytes // 1024
         self.netTxKiB = netTxBytes // 1024
 
+        # Dicts of device name -> (rd/rx KiB, wr/tx KiB)
+        self.diskDevKiB = dict((name, (rd // 1024, wr // 1024)) for
+                               name, (rd, wr) in (diskDevBytes or {}).items())
+        self.netDevKiB = dict((name, (rx // 1024, tx // 1024)) for
+                              name, (rx, tx) in (netDevBytes or {}).items())
+
         # These are set in _VMStatsList.append_stats
         self.diskRdRate = None
         self.diskWrRate = None
@@ -43,19 +150,134 @@ class _VMStatsRecord(object):
         self.netTxRate = None
 
 
+class _StatsRing(object):
+    """
+    Fixed capacity, column oriented ring buffer of stats samples.
+
+    Every column is a preallocated array.array, so appending a sample
+    is a handful of item assignments and reading a vector back is a
+    couple of C level slices. Samples are addressed newest first, and
+    slots that were never written read back as 0.
+    """
+    def __init__(self, columns, capacity):
+        self._typecodes = dict(columns)
+        # (columns, capacity, head, count). The tick thread appends and
+        # resizes while the UI reads, so this is only ever replaced as
+        # a whole, and readers take one consistent copy of it
+        self._state = ({}, 0, 0, 0)
+        self.resize(capacity)
+
+    def _get_capacity(self):
+        return self._state[1]
+    capacity = property(_get_capacity)
+
+    def __len__(self):
+        return self._state[3]
+
+    def resize(self, capacity):
+        """
+        Change the number of samples we hold, keeping the newest ones
+        """
+        capacity = max(1, capacity)
+        count = min(len(self), capacity)
+
+        newcolumns = {}
+        for name, typecode in self._typecodes.items():
+            col = array.array(typecode)
+            if count:
+                # Oldest first, ending at slot count - 1
+                col.extend(self.get_column(name, count)[::-1])
+            col.extend(array.array(typecode, [0]) * (capacity - count))
+            newcolumns[name] = col
+
+        # Point head at the newest sample, so the next append goes
+        # in the first free slot
+        self._state = (newcolumns, capacity, (count - 1) % capacity, count)
+
+    def append(self, values):
+        columns, capacity, head, count = self._state
+        head = (head + 1) % capacity
+        for name, col in columns.items():
+            col[head] = values[name]
+        self._state = (columns, capacity, head, min(count + 1, capacity))
+
+    def get_value(self, name):
+        columns, ignore, head, count = self._state
+        if not count:
+            return 0
+        return columns[name][head]
+
+    def get_column(self, name, limit=None):
+        """
+        Return an array of the newest limit samples for column name,
+        newest first, padded with zeros up to the buffer capacity.
+        """
+        columns, capacity, head, ignore = self._state
+        col = columns[name]
+        if limit is None or limit > capacity:
+            limit = capacity
+        if limit <= head:
+            return col[head:head - limit:-1]
+        ret = col[head::-1]
+        if limit > head + 1:
+            ret += col[:head:-1][:limit - head - 1]
+        return ret
+
+
+def _scale_vector(vector, ceil):
+    """
+    Return a 'd' array of vector scaled by 1/ceil, without per element
+    python code
+    """
+    if vector.typecode != "d":
+        vector = array.array("d", vector)
+    if ceil == 1.0:
+        return vector
+    return array.array("d",
+            map(operator.truediv, vector, [float(ceil)] * len(vector)))
+
+
 class _VMStatsList(vmmGObject):
     """
-    Tracks a list of VMStatsRecords for a single VM
+    Tracks the stats history for a single VM. VMStatsRecords are
+    unpacked into a _StatsRing as they come in.
     """
+    _COLUMNS = [
+        ("timestamp", "d"),
+        ("cpuTime", "q"),
+        ("cpuTimeAbs", "q"),
+        ("cpuHostPercent", "d"),
+        ("cpuGuestPercent", "d"),
+        ("curmem", "q"),
+        ("currMemPercent", "d"),
+        ("diskRdKiB", "q"),
+        ("diskWrKiB", "q"),
+        ("netRxKiB", "q"),
+        ("netTxKiB", "q"),
+        ("diskRdRate", "d"),
+        ("diskWrRate", "d"),
+        ("netRxRate", "d"),
+        ("netTxRate", "d"),
+    ]
+
     def __init__(self):
         vmmGObject.__init__(self)
-        self._stats = []
+        self._stats = _StatsRing(self._COLUMNS, self._get_capacity())
 
         self.diskRdMaxRate = 10.0
         self.diskWrMaxRate = 10.0
         self.netRxMaxRate = 10.0
         self.netTxMaxRate = 10.0
 
+        # Dicts of device name -> (rd/rx KiB, wr/tx KiB,
+        # rd/rx rate, wr/tx rate) for the latest sample
+        self.disk_devices = {}
+        self.net_devices = {}
+
+        # Bumped for every appended sample, so consumers can tell
+        # when cached renders of the stats are stale
+        self.generation = 0
+
         self.mem_stats_period_is_set = False
         self.stats_disk_skip = []
         self.stats_net_skip = []
@@ -63,19 +285,47 @@ class _VMStatsList(vmmGObject):
     def _cleanup(self):
         pass
 
-    def append_stats(self, newstats):
-        expected = self.config.get_stats_history_length()
-        current = len(self._stats)
-        if current > expected:
-            del(self._stats[expected:current])
+    def _get_capacity(self):
+        return self.config.stats.history_length + 1
+
+    def _extrapolate(self, newstats, group):
+        """
+        Fill in the counters of a stats group that wasn't sampled this
+        tick by extending the previous rates, so the graphs don't dip
+        to zero. The next real sample corrects any error.
+        """
+        timediff = 0
+        if len(self._stats):
+            timediff = newstats.timestamp - self._stats.get_value("timestamp")
+
+        for counter, rate in _EXTRAPOLATED_COLUMNS[group]:
+            setattr(newstats, counter, int(
+                self._stats.get_value(counter) +
+                self._stats.get_value(rate) * timediff))
+
+        devices = getattr(self, "%s_devices" % group)
+        setattr(newstats, "%sDevKiB" % group, dict(
+            (name, (int(c1 + r1 * timediff), int(c2 + r2 * timediff)))
+            for name, (c1, c2, r1, r2) in devices.items()))
+
+    def append_stats(self, newstats, extrapolate=None):
+        """
+        :param extrapolate: List of stats groups, 'disk' or 'net', that
+            weren't sampled for newstats
+        """
+        expected = self._get_capacity()
+        if self._stats.capacity != expected:
+            self._stats.resize(expected)
+        for group in extrapolate or []:
+            self._extrapolate(newstats, group)
 
         def _calculate_rate(record_name):
             ret = 0.0
-            if self._stats:
-                oldstats = self._stats[0]
+            if len(self._stats):
                 ratediff = (getattr(newstats, record_name) -
-                            getattr(oldstats, record_name))
-                timediff = newstats.timestamp - oldstats.timestamp
+                            self._stats.get_value(record_name))
+                timediff = (newstats.timestamp -
+                            self._stats.get_value("timestamp"))
                 ret = float(ratediff) / float(timediff)
             return max(ret, 0.0)
 
@@ -89,25 +339,27 @@ class _VMStatsList(vmmGObject):
         self.netRxMaxRate = max(newstats.netRxRate, self.netRxMaxRate)
         self.netTxMaxRate = max(newstats.netTxRate, self.netTxMaxRate)
 
-        self._stats.insert(0, newstats)
+        timediff = 0
+        if len(self._stats):
+            timediff = newstats.timestamp - self._stats.get_value("timestamp")
+        self.disk_devices = _calculate_device_rates(
+                self.disk_devices, newstats.diskDevKiB, timediff)
+        self.net_devices = _calculate_device_rates(
+                self.net_devices, newstats.netDevKiB, timediff)
+
+        self._stats.append(newstats.__dict__)
+        self.generation += 1
 
     def get_record(self, record_name):
-        if not self._stats:
-            return 0
-        return getattr(self._stats[0], record_name)
+        return self._stats.get_value(record_name)
 
     def get_vector(self, record_name, limit, ceil=100.0):
-        vector = []
-        statslen = self.config.get_stats_history_length() + 1
-        if limit is not None:
-            statslen = min(statslen, limit)
-
-        for i in range(statslen):
-            if i < len(self._stats):
-                vector.append(getattr(self._stats[i], record_name) / ceil)
-            else:
-                vector.append(0)
-        return vector
+        """
+        Return an array of the newest samples for record_name, scaled
+        by 1/ceil. The array is zero padded to the history length.
+        """
+        return _scale_vector(
+                self._stats.get_column(record_name, limit), ceil)
 
     def get_in_out_vector(self, name1, name2, limit, ceil):
         if ceil is None:
@@ -115,32 +367,264 @@ class _VMStatsList(vmmGObject):
         return (self.get_vector(name1, limit, ceil=ceil),
                 self.get_vector(name2, limit, ceil=ceil))
 
+    def _get_device_rates(self, devices):
+        return dict((name, (vals[2], vals[3])) for
+                    name, vals in devices.items())
+
+    def get_disk_device_rates(self):
+        """
+        Return a dict of disk name -> (read rate, write rate)
+        """
+        return self._get_device_rates(self.disk_devices)
+
+    def get_net_device_rates(self):
+        """
+        Return a dict of interface name -> (rx rate, tx rate)
+        """
+        return self._get_device_rates(self.net_devices)
+
+
+class _StatsAggregate(object):
+    """
+    Running connection wide totals of the latest stats of every running
+    VM. Each VM's contribution is remembered, so a new sample only
+    applies its delta, and totals never need a walk over all VMs.
+    """
+    FIELDS = ["cpuTime", "curmem",
+              "diskRdRate", "diskWrRate",
+              "netRxRate", "netTxRate"]
+
+    # Float deltas drift over time, so every this many updates the
+    # totals are summed again from scratch
+    _RESYNC_UPDATES = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contributions = {}
+        self._totals = [0] * len(self.FIELDS)
+        self._updates = 0
+
+        self.diskMaxRate = 0.0
+        self.netMaxRate = 0.0
+
+    def _set(self, key, values):
+        old = self._contributions.pop(key, None)
+        if values is not None:
+            self._contributions[key] = values
+        if old is None and values is None:
+            return
+
+        self._updates += 1
+        if self._updates >= self._RESYNC_UPDATES:
+            self._updates = 0
+            self._totals = [sum(col) for col in
+                            zip(*self._contributions.values())]
+            self._totals = self._totals or [0] * len(self.FIELDS)
+            return
+
+        old = old or [0] * len(self.FIELDS)
+        values = values or [0] * len(self.FIELDS)
+        self._totals = [t - o + n for t, o, n in
+                        zip(self._totals, old, values)]
+
+    def update(self, key, newstats, statslist):
+        """
+        Replace the contribution of a running VM with its latest sample
+        """
+        with self._lock:
+            self._set(key, [getattr(newstats, f) for f in self.FIELDS])
+            self.diskMaxRate = max(self.diskMaxRate,
+                                   statslist.diskRdMaxRate,
+                                   statslist.diskWrMaxRate)
+            self.netMaxRate = max(self.netMaxRate,
+                                  statslist.netRxMaxRate,
+                                  statslist.netTxMaxRate)
+
+    def remove(self, key):
+        """
+        Drop the contribution of a VM that stopped or was removed
+        """
+        with self._lock:
+            self._set(key, None)
+
+    def get_totals(self):
+        with self._lock:
+            ret = dict(zip(self.FIELDS, self._totals))
+            ret["diskMaxRate"] = self.diskMaxRate
+            ret["netMaxRate"] = self.netMaxRate
+            return ret
+
+
+class _HostStatsList(vmmGObject):
+    """
+    Tracks host CPU and memory stats history for a connection, both
+    host wide and per NUMA cell. Each has its own _StatsRing.
+    """
+    _COLUMNS = [
+        ("timestamp", "d"),
+        ("cpuBusyNs", "q"),
+        ("cpuTotalNs", "q"),
+        # Number of host CPUs summed into cpu*Ns, 0 for host wide
+        ("cpuCount", "q"),
+        ("cpuPercent", "d"),
+        ("memTotal", "q"),
+        ("memUsed", "q"),
+        ("memPercent", "d"),
+    ]
+
+    def __init__(self):
+        vmmGObject.__init__(self)
+        self._stats = self._new_ring()
+        self._cell_stats = {}
+
+        # NUMA cell id -> list of host CPU ids, filled in from caps
+        self.cell_cpus = None
+
+    def _cleanup(self):
+        pass
+
+    def _new_ring(self):
+        return _StatsRing(self._COLUMNS,
+                          self.config.stats.history_length + 1)
+
+    def _append(self, ring, newstats):
+        expected = self.config.stats.history_length + 1
+        if ring.capacity != expected:
+            ring.resize(expected)
+
+        cpuPercent = 0.0
+        if len(ring) and newstats["cpuCount"] != ring.get_value("cpuCount"):
+            # A CPU dropped out, so the totals aren't comparable to the
+            # previous sample. Repeat its percentage for this one
+            cpuPercent = ring.get_value("cpuPercent")
+        elif len(ring):
+            busy = newstats["cpuBusyNs"] - ring.get_value("cpuBusyNs")
+            total = newstats["cpuTotalNs"] - ring.get_value("cpuTotalNs")
+            if total > 0:
+                cpuPercent = busy * 100.0 / total
+        newstats["cpuPercent"] = max(0.0, min(100.0, cpuPercent))
+
+        memPercent = 0.0
+        if newstats["memTotal"]:
+            memPercent = newstats["memUsed"] * 100.0 / newstats["memTotal"]
+        newstats["memPercent"] = max(0.0, min(100.0, memPercent))
+
+        ring.append(newstats)
+
+    def append_stats(self, newstats, cellstats):
+        """
+        :param newstats: dict of host wide cpuBusyNs, cpuTotalNs,
+            cpuCount, memTotal and memUsed, plus timestamp
+        :param cellstats: dict of cell id -> dict of the same values,
+            or None if cells aren't being sampled at all, which drops
+            their history
+        """
+        self._append(self._stats, newstats)
+        if cellstats is None:
+            self._cell_stats = {}
+            return
+
+        # The UI reads this from the main thread, so it's replaced
+        # rather than changed in place. Cells missing from this sample
+        # keep their history
+        cell_stats = self._cell_stats.copy()
+        for cell, stats in cellstats.items():
+            if cell not in cell_stats:
+                cell_stats[cell] = self._new_ring()
+            self._append(cell_stats[cell], stats)
+        self._cell_stats = cell_stats
+
+    def has_stats(self):
+        return bool(len(self._stats))
+
+    def get_cells(self):
+        return sorted(self._cell_stats)
+
+    def _get_ring(self, cell):
+        if cell is None:
+            return self._stats
+        ring = self._cell_stats.get(cell)
+        if ring is None:
+            # The cell was dropped since the caller listed it
+            ring = self._new_ring()
+        return ring
+
+    def get_record(self, record_name, cell=None):
+        return self._get_ring(cell).get_value(record_name)
+
+    def get_vector(self, record_name, limit, ceil=100.0, cell=None):
+        return _scale_vector(
+                self._get_ring(cell).get_column(record_name, limit), ceil)
+
 
 class vmmStatsManager(vmmGObject):
     """
     Class for polling statistics
     """
+    # Minimum number of history files we keep mmap'd at once. The
+    # limit grows with the number of running VMs, which are all
+    # written every tick
+    _MAX_OPEN_STORES = 256
+
+    # Number of running domains at which block and interface stats
+    # start to be sampled on alternating ticks
+    _ALTERNATE_GROUPS_DOMAINS = 32
+
     def __init__(self):
         vmmGObject.__init__(self)
         self._vm_stats = {}
+        self._host_stats = _HostStatsList()
         self._latest_all_stats = {}
+        # path -> StatsStore, least recently used first. The tick
+        # thread records while the UI fetches, so every use of a store
+        # happens with _stores_lock held
+        self._stores = collections.OrderedDict()
+        self._stores_lock = threading.Lock()
+        self._max_open_stores = self._MAX_OPEN_STORES
+
+        self._analyzer = StatsAnalyzer()
+        self._aggregate = _StatsAggregate()
+
+        # connkeys of VMs with a details window open, see set_vm_watched
+        self._watched_vms = set()
+        # Whether the host details window is open, see set_host_watched
+        self._host_watched = False
+        self._plan_tick = 0
+
+        # libvirt API name -> number of calls made while sampling
+        self._rpc_counts = collections.Counter()
+
+        # Number of VMs whose stats changed noticeably since the last
+        # pop_stats_activity call
+        self._stats_activity = 0
 
         self._all_stats_supported = True
+        self._list_stats_supported = True
         self._net_stats_supported = True
         self._disk_stats_supported = True
         self._disk_stats_lxc_supported = True
         self._mem_stats_supported = True
+        self._host_stats_supported = True
 
 
     def _cleanup(self):
         self._latest_all_stats = None
+        self._host_stats.cleanup()
+        with self._stores_lock:
+            for store in self._stores.values():
+                store.close()
+            self._stores = collections.OrderedDict()
 
 
     ######################
     # CPU stats handling #
     ######################
 
+    def _count_rpc(self, name):
+        self._rpc_counts[name] += 1
+
     def _old_cpu_stats_helper(self, vm):
+        self._count_rpc("info")
         info = vm.get_backend().info()
         state = info[0]
         guestcpus = info[3]
@@ -150,7 +634,7 @@ class vmmStatsManager(vmmGObject):
     def _sample_cpu_stats(self, vm, allstats):
         timestamp = time.time()
         if (not vm.is_active() or
-            not self.config.get_stats_enable_cpu_poll()):
+            not self.config.stats.enable_cpu_poll):
             return 0, 0, 0, 0, timestamp
 
         cpuTime = 0
@@ -198,6 +682,7 @@ class vmmStatsManager(vmmGObject):
     def _old_net_stats_helper(self, vm, dev):
         statslist = self.get_vm_statslist(vm)
         try:
+            self._count_rpc("interfaceStats")
             io = vm.get_backend().interfaceStats(dev)
             if io:
                 rx = io[0]
@@ -222,20 +707,22 @@ class vmmStatsManager(vmmGObject):
     def _sample_net_stats(self, vm, allstats):
         rx = 0
         tx = 0
+        devices = {}
         statslist = self.get_vm_statslist(vm)
         if (not self._net_stats_supported or
             not vm.is_active() or
-            not self.config.get_stats_enable_net_poll()):
+            not self.config.stats.enable_net_poll):
             statslist.stats_net_skip = []
-            return rx, tx
+            return rx, tx, devices
 
         if allstats:
-            for key in allstats.keys():
-                if re.match(r"net.[0-9]+.rx.bytes", key):
-                    rx += allstats[key]
-                if re.match(r"net.[0-9]+.tx.bytes", key):
-                    tx += allstats[key]
-            return rx, tx
+            if not allstats["virt-manager.statflags"] & _NET_STATS_FLAGS:
+                return None
+            devices = _NET_STATS_KEYS.get_counters(allstats)
+            for devrx, devtx in devices.values():
+                rx += devrx
+                tx += devtx
+            return rx, tx, devices
 
         for iface in vm.get_interface_devices_norefresh():
             dev = iface.target_dev
@@ -245,10 +732,11 @@ class vmmStatsManager(vmmGObject):
                 continue
 
             devrx, devtx = self._old_net_stats_helper(vm, dev)
+            devices[dev] = (devrx, devtx)
             rx += devrx
             tx += devtx
 
-        return rx, tx
+        return rx, tx, devices
 
 
     #######################
@@ -258,6 +746,7 @@ class vmmStatsManager(vmmGObject):
     def _old_disk_stats_helper(self, vm, dev):
         statslist = self.get_vm_statslist(vm)
         try:
+            self._count_rpc("blockStats")
             io = vm.get_backend().blockStats(dev)
             if io:
                 rd = io[1]
@@ -282,29 +771,32 @@ class vmmStatsManager(vmmGObject):
     def _sample_disk_stats(self, vm, allstats):
         rd = 0
         wr = 0
+        devices = {}
         statslist = self.get_vm_statslist(vm)
         if (not self._disk_stats_supported or
             not vm.is_active() or
-            not self.config.get_stats_enable_disk_poll()):
+            not self.config.stats.enable_disk_poll):
             statslist.stats_disk_skip = []
-            return rd, wr
+            return rd, wr, devices
 
         if allstats:
-            for key in allstats.keys():
-                if re.match(r"block.[0-9]+.rd.bytes", key):
-                    rd += allstats[key]
-                if re.match(r"block.[0-9]+.wr.bytes", key):
-                    wr += allstats[key]
-            return rd, wr
+            if not allstats["virt-manager.statflags"] & _BLOCK_STATS_FLAGS:
+                return None
+            devices = _BLOCK_STATS_KEYS.get_counters(allstats)
+            for diskrd, diskwr in devices.values():
+                rd += diskrd
+                wr += diskwr
+            return rd, wr, devices
 
         # LXC has a special blockStats method
         if vm.conn.is_lxc() and self._disk_stats_lxc_supported:
             try:
+                self._count_rpc("blockStats")
                 io = vm.get_backend().blockStats('')
                 if io:
                     rd = io[1]
                     wr = io[3]
-                    return rd, wr
+                    return rd, wr, devices
             except libvirt.libvirtError as e:
                 logging.debug("LXC style disk stats not supported: %s", e)
                 self._disk_stats_lxc_supported = False
@@ -317,10 +809,11 @@ class vmmStatsManager(vmmGObject):
                 continue
 
             diskrd, diskwr = self._old_disk_stats_helper(vm, dev)
+            devices[dev] = (diskrd, diskwr)
             rd += diskrd
             wr += diskwr
 
-        return rd, wr
+        return rd, wr, devices
 
 
     #########################
@@ -341,6 +834,7 @@ class vmmStatsManager(vmmGObject):
 
         try:
             secs = 5
+            self._count_rpc("setMemoryStatsPeriod")
             vm.get_backend().setMemoryStatsPeriod(secs,
                 libvirt.VIR_DOMAIN_AFFECT_LIVE)
         except Exception as e:
@@ -350,6 +844,7 @@ class vmmStatsManager(vmmGObject):
         totalmem = 1
         curmem = 0
         try:
+            self._count_rpc("memoryStats")
             stats = vm.get_backend().memoryStats()
             totalmem = stats.get("actual", 1)
             curmem = max(0, totalmem - stats.get("unused", totalmem))
@@ -366,7 +861,7 @@ class vmmStatsManager(vmmGObject):
         statslist = self.get_vm_statslist(vm)
         if (not self._mem_stats_supported or
             not vm.is_active() or
-            not self.config.get_stats_enable_memory_poll()):
+            not self.config.stats.enable_memory_poll):
             statslist.mem_stats_period_is_set = False
             return 0, 0
 
@@ -391,41 +886,244 @@ class vmmStatsManager(vmmGObject):
     # alltats handling #
     ####################
 
-    def _get_all_stats(self, conn):
-        if not self._all_stats_supported:
-            return {}
-
+    def _get_stats_flags(self):
+        """
+        Return (cheap flags, [expensive flag groups]) for the enabled
+        stats. The expensive groups scale with the number of devices
+        """
         statflags = 0
-        if self.config.get_stats_enable_cpu_poll():
+        if self.config.stats.enable_cpu_poll:
             statflags |= libvirt.VIR_DOMAIN_STATS_STATE
             statflags |= libvirt.VIR_DOMAIN_STATS_CPU_TOTAL
             statflags |= libvirt.VIR_DOMAIN_STATS_VCPU
-        if self.config.get_stats_enable_memory_poll():
+        if self.config.stats.enable_memory_poll:
             statflags |= libvirt.VIR_DOMAIN_STATS_BALLOON
-        if self.config.get_stats_enable_disk_poll():
-            statflags |= libvirt.VIR_DOMAIN_STATS_BLOCK
-        if self.config.get_stats_enable_net_poll():
-            statflags |= libvirt.VIR_DOMAIN_STATS_INTERFACE
-        if statflags == 0:
-            return {}
 
-        ret = {}
-        try:
+        expensive = []
+        if self.config.stats.enable_disk_poll:
+            expensive.append(_BLOCK_STATS_FLAGS)
+        if self.config.stats.enable_net_poll:
+            expensive.append(_NET_STATS_FLAGS)
+        return statflags, expensive
+
+    def _plan_all_stats(self, conn, statflags, expensive):
+        """
+        Decide which domains to sample, and with which stats flags.
+        Only running domains have anything to report. On big hosts the
+        expensive groups are spread over alternating ticks, except for
+        VMs that have a details window open.
+
+        :returns: dict of flags -> list of virDomain, or None to
+            sample every domain with getAllDomainStats
+        """
+        if not self._list_stats_supported:
+            # Without an explicit domain list we can only ask for
+            # everything, for every domain
+            for groupflags in expensive:
+                statflags |= groupflags
+            return {statflags: None}
+
+        vms = [vm for vm in conn.list_vms() if vm.is_active()]
+        tickgroups = expensive
+        if (len(expensive) > 1 and
+            len(vms) >= self._ALTERNATE_GROUPS_DOMAINS):
+            tickgroups = [expensive[self._plan_tick % len(expensive)]]
+
+        plan = collections.defaultdict(list)
+        for vm in vms:
+            flags = statflags
+            for groupflags in expensive:
+                if (groupflags in tickgroups or
+                    vm.get_connkey() in self._watched_vms):
+                    flags |= groupflags
+            plan[flags].append(vm.get_backend())
+        return plan
+
+    def _call_all_stats(self, conn, statflags, domains):
+        if domains is None:
+            self._count_rpc("getAllDomainStats")
+            return conn.get_backend().getAllDomainStats(statflags, 0)
+        self._count_rpc("domainListGetStats")
+        return conn.get_backend().domainListGetStats(domains, statflags, 0)
+
+    def _run_all_stats_plan(self, conn, plan, ret):
+        """
+        Make the stats calls for every batch in plan, adding the
+        results to ret. Only a 'not supported' error is raised, any
+        other error just skips that batch.
+        """
+        for flags, domains in plan.items():
             timestamp = time.time()
-            rawallstats = conn.get_backend().getAllDomainStats(statflags, 0)
+            try:
+                rawallstats = self._call_all_stats(conn, flags, domains)
+            except libvirt.libvirtError as err:
+                if util.is_error_nosupport(err):
+                    raise
+                logging.debug("Error getting domain stats for flags=%s: %s",
+                              flags, err)
+                continue
 
             # Reformat the output to be a bit more friendly
             for dom, domallstats in rawallstats:
                 domallstats["virt-manager.timestamp"] = timestamp
+                domallstats["virt-manager.statflags"] = flags
                 ret[dom.UUIDString()] = domallstats
-        except libvirt.libvirtError as err:
-            if util.is_error_nosupport(err):
-                logging.debug("conn does not support getAllDomainStats()")
-                self._all_stats_supported = False
-            else:
-                logging.debug("Error call getAllDomainStats(): %s", err)
+
+    def _get_all_stats(self, conn):
+        if not self._all_stats_supported:
+            return {}
+
+        statflags, expensive = self._get_stats_flags()
+        if statflags == 0 and not expensive:
+            return {}
+        self._plan_tick += 1
+
+        ret = {}
+        while self._all_stats_supported:
+            plan = self._plan_all_stats(conn, statflags, expensive)
+            try:
+                self._run_all_stats_plan(conn, plan, ret)
+                break
+            except libvirt.libvirtError:
+                # The API the plan was built around isn't supported.
+                # Stop using it for this conn, and replan without it
+                if self._list_stats_supported:
+                    logging.debug(
+                        "conn does not support domainListGetStats()")
+                    self._list_stats_supported = False
+                else:
+                    logging.debug(
+                        "conn does not support getAllDomainStats()")
+                    self._all_stats_supported = False
+        return ret
+
+
+    ######################
+    # Host stats support #
+    ######################
+
+    def _get_cell_cpus(self, conn):
+        ret = {}
+        topology = conn.caps.host.topology
+        for idx, cell in enumerate(topology and topology.cells or []):
+            cellid = cell.id if cell.id is not None else idx
+            ret[cellid] = [int(cpu.id) for cpu in cell.cpus]
         return ret
 
+    def _sample_host_cpu(self, conn, cpunum):
+        self._count_rpc("getCPUStats")
+        stats = conn.get_backend().getCPUStats(cpunum, 0)
+        busy = stats.get("kernel", 0) + stats.get("user", 0)
+        total = busy + stats.get("idle", 0) + stats.get("iowait", 0)
+        return busy, total
+
+    def _sample_host_mem(self, conn, cellnum):
+        self._count_rpc("getMemoryStats")
+        stats = conn.get_backend().getMemoryStats(cellnum, 0)
+        total = stats.get("total", 0)
+        used = total - stats.get("free", 0)
+        # Only reported host wide, page cache isn't really 'used'
+        used -= stats.get("buffers", 0) + stats.get("cached", 0)
+        return total, max(0, used)
+
+    def _sample_host_stats(self, conn):
+        timestamp = time.time()
+        busy, total = self._sample_host_cpu(
+                conn, libvirt.VIR_NODE_CPU_STATS_ALL_CPUS)
+        memtotal, memused = self._sample_host_mem(
+                conn, libvirt.VIR_NODE_MEMORY_STATS_ALL_CELLS)
+        newstats = {"timestamp": timestamp,
+                    "cpuBusyNs": busy, "cpuTotalNs": total, "cpuCount": 0,
+                    "memTotal": memtotal, "memUsed": memused}
+
+        cellstats = None
+        # Per cell stats take a call per host CPU, so only sample them
+        # while the host window is there to show them
+        if self._host_watched:
+            cellstats = self._sample_cell_stats(conn, timestamp)
+        return newstats, cellstats
+
+    def _sample_cell_stats(self, conn, timestamp):
+        if self._host_stats.cell_cpus is None:
+            self._host_stats.cell_cpus = self._get_cell_cpus(conn)
+
+        cellstats = {}
+        # A single cell is just a copy of the host wide numbers
+        if len(self._host_stats.cell_cpus) <= 1:
+            return cellstats
+
+        for cell, cpus in self._host_stats.cell_cpus.items():
+            busy = 0
+            total = 0
+            failed = []
+            for cpu in cpus:
+                try:
+                    cpubusy, cputotal = self._sample_host_cpu(conn, cpu)
+                except libvirt.libvirtError as err:
+                    # Usually an offline CPU, stop asking for it
+                    logging.debug("Error sampling host cpu=%s: %s",
+                                  cpu, err)
+                    failed.append(cpu)
+                    continue
+                busy += cpubusy
+                total += cputotal
+
+            if failed:
+                self._host_stats.cell_cpus[cell] = [
+                        cpu for cpu in cpus if cpu not in failed]
+
+            memtotal, memused = self._sample_host_mem(conn, cell)
+            cellstats[cell] = {"timestamp": timestamp,
+                               "cpuBusyNs": busy, "cpuTotalNs": total,
+                               "cpuCount": len(cpus) - len(failed),
+                               "memTotal": memtotal, "memUsed": memused}
+        return cellstats
+
+
+    ###########################
+    # On disk history support #
+    ###########################
+
+    def _get_store(self, path, columns):
+        """
+        Return the open StatsStore for path. Must be called with
+        _stores_lock held
+        """
+        store = self._stores.pop(path, None)
+        if store is None:
+            store = StatsStore(path, columns)
+        self._stores[path] = store
+
+        while len(self._stores) > self._max_open_stores:
+            ignore, oldstore = self._stores.popitem(last=False)
+            oldstore.close()
+        return store
+
+    def _set_open_stores_limit(self, conn):
+        # Every running VM plus the connection itself is recorded each
+        # tick, keep them all open so round robin access doesn't
+        # reopen every file
+        active = len([vm for vm in conn.list_vms() if vm.is_active()])
+        self._max_open_stores = max(self._MAX_OPEN_STORES, active + 1)
+
+    def _record_history(self, path, columns, timestamp, stats):
+        try:
+            with self._stores_lock:
+                self._get_store(path, columns).append(timestamp, stats)
+        except Exception as e:
+            logging.debug("Error recording stats history to %s: %s",
+                          path, e)
+
+    def _fetch_history(self, path, columns, start, end, resolution):
+        try:
+            with self._stores_lock:
+                return self._get_store(path, columns).fetch(
+                        start, end, resolution)
+        except Exception as e:
+            logging.debug("Error reading stats history from %s: %s",
+                          path, e)
+            return None
+
 
     ##############
     # Public API #
@@ -437,19 +1135,186 @@ class vmmStatsManager(vmmGObject):
         (cpuTime, cpuTimeAbs, cpuHostPercent, cpuGuestPercent, timestamp) = \
                 self._sample_cpu_stats(vm, domallstats)
         currMemPercent, curmem = self._sample_mem_stats(vm, domallstats)
-        diskRdBytes, diskWrBytes = self._sample_disk_stats(vm, domallstats)
-        netRxBytes, netTxBytes = self._sample_net_stats(vm, domallstats)
+        extrapolate = []
+        diskstats = self._sample_disk_stats(vm, domallstats)
+        if diskstats is None:
+            extrapolate.append("disk")
+            diskstats = (0, 0, {})
+        netstats = self._sample_net_stats(vm, domallstats)
+        if netstats is None:
+            extrapolate.append("net")
+            netstats = (0, 0, {})
+        diskRdBytes, diskWrBytes, diskDevBytes = diskstats
+        netRxBytes, netTxBytes, netDevBytes = netstats
 
         newstats = _VMStatsRecord(
                 timestamp, cpuTime, cpuTimeAbs,
                 cpuHostPercent, cpuGuestPercent,
                 curmem, currMemPercent,
                 diskRdBytes, diskWrBytes,
-                netRxBytes, netTxBytes)
-        self.get_vm_statslist(vm).append_stats(newstats)
+                netRxBytes, netTxBytes,
+                diskDevBytes, netDevBytes)
+        statslist = self.get_vm_statslist(vm)
+        prevstats = None
+        if statslist.get_record("timestamp"):
+            prevstats = dict((name, statslist.get_record(name))
+                             for name, ignore in _ACTIVITY_THRESHOLDS)
+        statslist.append_stats(newstats, extrapolate)
+        if prevstats:
+            for name, delta in _ACTIVITY_THRESHOLDS:
+                if abs(getattr(newstats, name) - prevstats[name]) >= delta:
+                    self._stats_activity += 1
+                    break
+        if vm.is_active():
+            self._aggregate.update(vm.get_connkey(), newstats, statslist)
+        else:
+            self._aggregate.remove(vm.get_connkey())
+
+        if vm.is_active() and self.config.stats.persistent_history:
+            self._record_history(
+                    os.path.join(vm.get_cache_dir(), _HISTORY_FILENAME),
+                    _VM_HISTORY_COLUMNS, timestamp, newstats.__dict__)
+
+        self._analyzer.set_rules(self.config.stats.alert_rules)
+        for rulestr, active in self._analyzer.update_vm(vm):
+            logging.debug("Stats alert '%s' %s for vm=%s", rulestr,
+                          active and "raised" or "cleared", vm.get_name())
+            vm.conn.idle_emit("stats-alert-changed",
+                              vm.get_connkey(), rulestr, active)
+
+    def remove_vm(self, vm):
+        """
+        Drop analysis and aggregate state for a VM that was removed
+        from the conn
+        """
+        self._analyzer.remove_vm(vm.get_connkey())
+        self._aggregate.remove(vm.get_connkey())
+        self._watched_vms.discard(vm.get_connkey())
+
+    def set_vm_watched(self, vm, watched):
+        """
+        Mark whether a VM's stats are being looked at in detail, so
+        every stats group is sampled for it on every tick
+        """
+        if watched:
+            self._watched_vms.add(vm.get_connkey())
+        else:
+            self._watched_vms.discard(vm.get_connkey())
+
+    def set_host_watched(self, watched):
+        """
+        Mark whether the host details window is open, so per NUMA cell
+        stats are sampled on every tick
+        """
+        self._host_watched = watched
+
+    def get_vm_alerts(self, vm):
+        return self._analyzer.get_alerts(vm.get_connkey())
+
+    def get_top_vms(self, metric):
+        """
+        Return a list of (connkey, value) of the busiest VMs by metric
+        """
+        return self._analyzer.get_top(metric)
+
+    def check_top_vms_changed(self):
+        return self._analyzer.check_top_changed()
+
+    def get_aggregate_stats(self):
+        """
+        Return a dict of connection wide totals of the latest stats of
+        all running VMs: see _StatsAggregate.FIELDS, plus the max disk
+        and network rates seen
+        """
+        return self._aggregate.get_totals()
+
+    def record_conn_stats(self, conn, stats):
+        """
+        Save a sample of the connection wide stats to the on disk
+        history, if enabled
+        """
+        if not self.config.stats.persistent_history:
+            return
+        self._record_history(
+                os.path.join(conn.get_cache_dir(), _HISTORY_FILENAME),
+                _CONN_HISTORY_COLUMNS, stats["timestamp"], stats)
+
+    def get_vm_history(self, vm, start, end, resolution=None):
+        """
+        Return on disk stats history for the VM, in the format of
+        StatsStore.fetch, or None if history is disabled
+        """
+        if not self.config.stats.persistent_history:
+            return None
+        return self._fetch_history(
+                os.path.join(vm.get_cache_dir(), _HISTORY_FILENAME),
+                _VM_HISTORY_COLUMNS, start, end, resolution)
+
+    def get_conn_history(self, conn, start, end, resolution=None):
+        if not self.config.stats.persistent_history:
+            return None
+        return self._fetch_history(
+                os.path.join(conn.get_cache_dir(), _HISTORY_FILENAME),
+                _CONN_HISTORY_COLUMNS, start, end, resolution)
+
+    def pop_stats_activity(self):
+        """
+        Return the number of VMs whose stats changed by more than
+        _ACTIVITY_THRESHOLDS since the last call, and reset it
+        """
+        ret = self._stats_activity
+        self._stats_activity = 0
+        return ret
+
+    def get_rpc_counts(self):
+        """
+        Return a dict of libvirt API name -> number of times stats
+        sampling has called it
+        """
+        return dict(self._rpc_counts)
+
+    def refresh_host_stats(self, conn):
+        """
+        Sample host CPU and memory stats with getCPUStats and
+        getMemoryStats. Returns False if the connection doesn't
+        support them.
+        """
+        if not self._host_stats_supported:
+            return False
+
+        try:
+            newstats, cellstats = self._sample_host_stats(conn)
+        except libvirt.libvirtError as err:
+            if util.is_error_nosupport(err):
+                logging.debug("conn does not support host CPU/memory stats")
+                self._host_stats_supported = False
+            else:
+                logging.debug("Error sampling host stats: %s", err)
+            return False
+
+        self._host_stats.append_stats(newstats, cellstats)
+        return True
+
+    def get_host_statslist(self):
+        return self._host_stats
 
     def cache_all_stats(self, conn):
+        if self.config.stats.persistent_history:
+            self._set_open_stores_limit(conn)
+
+        replayer = statsreplay.get_replayer(conn)
+        if replayer:
+            vms = sorted([vm for vm in conn.list_vms() if vm.is_active()],
+                         key=lambda vm: vm.get_connkey())
+            self._latest_all_stats = replayer.next_stats(vms)
+            return
+
+        start = time.time()
         self._latest_all_stats = self._get_all_stats(conn)
+        recorder = statsreplay.get_recorder()
+        if recorder and self._latest_all_stats:
+            recorder.record(conn.get_uri(), start, time.time() - start,
+                            self._latest_all_stats)
 
     def get_vm_statslist(self, vm):
         if vm.get_connkey() not in self._vm_stats:
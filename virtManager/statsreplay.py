@@ -0,0 +1,205 @@
+# Copyright (C) 2019 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+"""
+Recording and replay of bulk domain stats, for repeatable performance
+testing without a real host.
+
+A recording is a gzip'd file of JSON lines. The first line is a
+header, every following line holds one tick of reformatted
+getAllDomainStats output, with the time offset of the tick and how
+long the libvirt calls took. Replay maps the recorded domains onto the
+running domains of a test:/// connection, so a recording of a few VMs
+can drive thousands of test driver VMs.
+"""
+
+import atexit
+import gzip
+import json
+import logging
+import threading
+import time
+
+
+_VERSION = 1
+_TIMESTAMP_KEY = "virt-manager.timestamp"
+
+# Set by the virt-manager --test-stats-record/--test-stats-replay options
+RECORD_PATH = None
+REPLAY_PATH = None
+
+
+class StatsRecorder(object):
+    """
+    Append bulk stats samples to a recording file. record() can be
+    called from the tick threads of several connections at once, use
+    get_recorder to get the shared instance.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._start = None
+        self._file = gzip.open(path, "wt")
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+            self._file = None
+
+    def record(self, uri, timestamp, elapsed, allstats):
+        """
+        Save one tick of stats
+
+        :param timestamp: Time the stats were sampled
+        :param elapsed: Seconds spent in libvirt sampling them
+        :param allstats: dict of UUID -> domain stats dict
+        """
+        domains = {}
+        for uuid, domstats in allstats.items():
+            domstats = dict(domstats)
+            domstats.pop(_TIMESTAMP_KEY, None)
+            domains[uuid] = domstats
+
+        with self._lock:
+            if not self._file:
+                return
+            if self._start is None:
+                self._start = timestamp
+                self._write({"version": _VERSION, "start": timestamp})
+            self._write({"uri": uri,
+                         "time": timestamp - self._start,
+                         "elapsed": elapsed,
+                         "domains": domains})
+
+    def _write(self, data):
+        self._file.write(json.dumps(data, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+
+class StatsReplayer(object):
+    """
+    Feed recorded stats back, one tick per next_stats call. When the
+    recording runs out it starts over. Cumulative counters jump back
+    at that point, so rates read as zero for one tick.
+
+    :param simulate_latency: Sleep for as long as the recorded libvirt
+        calls took, so tick timing matches the recording
+    """
+    def __init__(self, path, simulate_latency=True):
+        self.path = path
+        self.simulate_latency = simulate_latency
+        self._ticks = self._load(path)
+        self._pos = 0
+        self._loops = 0
+        self._base = None
+
+        # Recorded UUIDs, in a stable order for mapping onto test VMs
+        uuids = set()
+        for tick in self._ticks:
+            uuids.update(tick["domains"])
+        self._uuids = sorted(uuids)
+
+        # Length of one pass through the recording, including the
+        # interval before the first tick of the next pass
+        self._duration = 0
+        if self._ticks:
+            lasttime = self._ticks[-1]["time"]
+            interval = 1.0
+            if len(self._ticks) > 1 and lasttime > 0:
+                interval = lasttime / (len(self._ticks) - 1)
+            self._duration = lasttime + interval
+
+    def _load(self, path):
+        ticks = []
+        with gzip.open(path, "rt") as f:
+            header = json.loads(f.readline() or "{}")
+            if header.get("version") != _VERSION:
+                raise ValueError(_("Unsupported stats recording '%s'") %
+                                 path)
+
+            uri = None
+            try:
+                for line in f:
+                    tick = json.loads(line)
+                    # Only replay the first connection that was recorded
+                    if uri is None:
+                        uri = tick["uri"]
+                    if tick["uri"] == uri:
+                        ticks.append(tick)
+            except (EOFError, ValueError):
+                # The recording app didn't exit cleanly, use what
+                # was written out
+                logging.debug("Stats recording %s is truncated", path)
+
+        logging.debug("Loaded %d ticks of stats from %s", len(ticks), path)
+        return ticks
+
+    def next_stats(self, vms):
+        """
+        Return the next recorded tick in the format of
+        vmmStatsManager._get_all_stats, for the passed running vms
+
+        :param vms: List of vmmDomain to map the recorded domains on to
+        """
+        if not self._ticks or not self._uuids:
+            return {}
+
+        tick = self._ticks[self._pos]
+        if self.simulate_latency:
+            time.sleep(tick["elapsed"])
+
+        if self._base is None:
+            self._base = time.time()
+        timestamp = (self._base + tick["time"] +
+                     (self._loops * self._duration))
+
+        self._pos += 1
+        if self._pos >= len(self._ticks):
+            self._pos = 0
+            self._loops += 1
+
+        ret = {}
+        for idx, vm in enumerate(vms):
+            domstats = tick["domains"].get(
+                    self._uuids[idx % len(self._uuids)])
+            if domstats is None:
+                continue
+            domstats = dict(domstats)
+            domstats[_TIMESTAMP_KEY] = timestamp
+            ret[vm.get_uuid()] = domstats
+        return ret
+
+
+_recorder = None
+_replayers = {}
+# get_recorder and get_replayer are called from every conn tick thread
+_lock = threading.Lock()
+
+
+def get_recorder():
+    """
+    Return the shared StatsRecorder if recording was requested
+    """
+    global _recorder
+    with _lock:
+        if RECORD_PATH and not _recorder:
+            _recorder = StatsRecorder(RECORD_PATH)
+            atexit.register(_recorder.close)
+        return _recorder
+
+
+def get_replayer(conn):
+    """
+    Return a StatsReplayer for conn if replay was requested. Replay is
+    only done for test driver connections
+    """
+    if not REPLAY_PATH or not conn.is_test():
+        return None
+    uri = conn.get_uri()
+    with _lock:
+        if uri not in _replayers:
+            _replayers[uri] = StatsReplayer(REPLAY_PATH)
+        return _replayers[uri]
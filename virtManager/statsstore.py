@@ -0,0 +1,255 @@
+# Copyright (C) 2019 Red Hat, Inc.
+#
+# This work is licensed under the GNU GPLv2 or later.
+# See the COPYING file in the top-level directory.
+
+"""
+On disk round robin stats history.
+
+Each StatsStore is a single fixed size file that is mmap'd while open.
+It holds several tiers, each a ring of rows of (timestamp, values...):
+raw samples as they arrive, plus 1 minute and 1 hour averages that
+are downsampled as data is appended. The in progress average for each
+tier is kept in the file too, so restarting the app doesn't lose it.
+"""
+
+import collections
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+
+_MAGIC = b"VMMSTATS"
+_VERSION = 1
+
+# magic, version, column checksum, column count
+_HEADER = struct.Struct("<8sIII")
+# Leading timestamp of every row
+_TIMESTAMP = struct.Struct("<d")
+
+# (name, step in seconds, number of rows). A step of 0 means every
+# appended sample gets its own row.
+TIERS = [
+    ("raw", 0, 1200),
+    ("minute", 60, 1440),
+    ("hour", 3600, 2160),
+]
+
+
+class _Tier(object):
+    """
+    Offsets and struct layouts of a single tier inside the file
+    """
+    def __init__(self, name, step, slots, ncolumns, offset):
+        self.name = name
+        self.step = step
+        self.slots = slots
+
+        # newest row index, bucket start, bucket sample count, sums...
+        self.meta = struct.Struct("<qdd%dd" % ncolumns)
+        self.row = struct.Struct("<d%dd" % ncolumns)
+
+        self.meta_offset = offset
+        self.data_offset = offset + self.meta.size
+        self.end_offset = self.data_offset + (self.row.size * slots)
+
+
+class StatsStore(object):
+    """
+    A fixed size, multi resolution, round robin stats file
+
+    :param path: File path. Created or reinitialized as needed
+    :param columns: List of stats names that are stored per row
+    """
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = list(columns)
+        self._mmap = None
+
+        ncolumns = len(self.columns)
+        self._checksum = zlib.crc32(
+                ",".join(self.columns).encode("utf-8")) & 0xffffffff
+
+        self._tiers = []
+        offset = _HEADER.size
+        for name, step, slots in TIERS:
+            tier = _Tier(name, step, slots, ncolumns, offset)
+            self._tiers.append(tier)
+            offset = tier.end_offset
+        self._size = offset
+
+
+    ###################
+    # Private helpers #
+    ###################
+
+    def _header_is_valid(self, mapped):
+        magic, version, checksum, ncolumns = _HEADER.unpack_from(mapped, 0)
+        return (magic == _MAGIC and
+                version == _VERSION and
+                checksum == self._checksum and
+                ncolumns == len(self.columns))
+
+    def _init_file(self, mapped):
+        mapped[:] = b"\0" * self._size
+        _HEADER.pack_into(mapped, 0, _MAGIC, _VERSION,
+                          self._checksum, len(self.columns))
+        empty = [0.0] * len(self.columns)
+        for tier in self._tiers:
+            tier.meta.pack_into(mapped, tier.meta_offset, -1, 0, 0, *empty)
+
+    def _open(self):
+        dirname = os.path.dirname(self.path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname, 0o755)
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            reinit = os.fstat(fd).st_size != self._size
+            if reinit:
+                os.ftruncate(fd, self._size)
+            mapped = mmap.mmap(fd, self._size)
+        finally:
+            os.close(fd)
+
+        if reinit or not self._header_is_valid(mapped):
+            logging.debug("Initializing stats store %s", self.path)
+            self._init_file(mapped)
+        return mapped
+
+    def _get_mmap(self):
+        if self._mmap is None:
+            self._mmap = self._open()
+        return self._mmap
+
+    def _write_row(self, mapped, tier, head, timestamp, values):
+        head = (head + 1) % tier.slots
+        tier.row.pack_into(mapped, tier.data_offset + head * tier.row.size,
+                           timestamp, *values)
+        return head
+
+    def _append_tier(self, mapped, tier, timestamp, values):
+        meta = tier.meta.unpack_from(mapped, tier.meta_offset)
+        head, bucket, count, sums = meta[0], meta[1], meta[2], list(meta[3:])
+
+        if not tier.step:
+            head = self._write_row(mapped, tier, head, timestamp, values)
+            tier.meta.pack_into(mapped, tier.meta_offset,
+                                head, bucket, count, *sums)
+            return
+
+        newbucket = timestamp - (timestamp % tier.step)
+        if count and newbucket != bucket:
+            # Flush the finished bucket as a single averaged row
+            head = self._write_row(mapped, tier, head, bucket,
+                                   [s / count for s in sums])
+            count = 0
+            sums = [0.0] * len(sums)
+
+        sums = [s + v for s, v in zip(sums, values)]
+        tier.meta.pack_into(mapped, tier.meta_offset,
+                            head, newbucket, count + 1, *sums)
+
+    def _read_tier(self, mapped, tier):
+        """
+        Return all rows in the tier, oldest first, including the
+        in progress bucket average
+        """
+        meta = tier.meta.unpack_from(mapped, tier.meta_offset)
+        head, bucket, count, sums = meta[0], meta[1], meta[2], meta[3:]
+        if head < 0 and not count:
+            return []
+
+        data = mapped[tier.data_offset:tier.end_offset]
+        rows = list(tier.row.iter_unpack(data))
+        if head >= 0:
+            rows = rows[head + 1:] + rows[:head + 1]
+        rows = [r for r in rows if r[0]]
+        if count:
+            rows.append((bucket,) + tuple(s / count for s in sums))
+        return rows
+
+    def _tier_start(self, mapped, tier):
+        """
+        Return the timestamp of the oldest row in the tier, or None if
+        it is empty. Only reads a couple of slots, not the whole tier
+        """
+        meta = tier.meta.unpack_from(mapped, tier.meta_offset)
+        head, bucket, count = meta[0], meta[1], meta[2]
+        if head >= 0:
+            # The slot after head is the oldest row once the ring has
+            # wrapped, and still empty before that
+            for idx in ((head + 1) % tier.slots, 0):
+                timestamp = _TIMESTAMP.unpack_from(
+                        mapped, tier.data_offset + idx * tier.row.size)[0]
+                if timestamp:
+                    return timestamp
+        if count:
+            return bucket
+        return None
+
+    def _pick_tier(self, mapped, start, resolution):
+        candidates = [t for t in self._tiers if
+                      not resolution or t.step >= resolution]
+        if not candidates:
+            candidates = self._tiers[-1:]
+
+        # Finest tier that still goes back far enough
+        for tier in candidates:
+            tierstart = self._tier_start(mapped, tier)
+            if tierstart is not None and tierstart <= start:
+                return tier, self._read_tier(mapped, tier)
+        tier = candidates[-1]
+        return tier, self._read_tier(mapped, tier)
+
+
+    ##############
+    # Public API #
+    ##############
+
+    def close(self):
+        if self._mmap is None:
+            return
+        try:
+            self._mmap.close()
+        except Exception:
+            logging.debug("Error closing stats store %s",
+                          self.path, exc_info=True)
+        self._mmap = None
+
+    def is_open(self):
+        return self._mmap is not None
+
+    def append(self, timestamp, stats):
+        """
+        Record a sample
+
+        :param timestamp: Sample time in seconds since the epoch
+        :param stats: dict-like of column name -> value
+        """
+        mapped = self._get_mmap()
+        values = [float(stats.get(c, 0) or 0) for c in self.columns]
+        for tier in self._tiers:
+            self._append_tier(mapped, tier, timestamp, values)
+
+    def fetch(self, start, end, resolution=None):
+        """
+        Return samples between start and end, from the finest tier
+        that covers start and has at least the requested resolution.
+
+        :param resolution: Minimum seconds between samples. None means
+            raw samples if they are available
+        :returns: (tier name, list of timestamps,
+            dict of column name -> list of values), oldest first
+        """
+        mapped = self._get_mmap()
+        tier, rows = self._pick_tier(mapped, start, resolution)
+        rows = [r for r in rows if start <= r[0] <= end]
+
+        timestamps = [r[0] for r in rows]
+        values = collections.OrderedDict()
+        for idx, name in enumerate(self.columns):
+            values[name] = [r[idx + 1] for r in rows]
+        return tier.name, timestamps, values
@@ -216,7 +216,11 @@ class vmmSystray(vmmGObject):
     #################
 
     def _build_vm_menuitem(self, vm):
-        menu_item = Gtk.ImageMenuItem.new_with_label(vm.get_name_or_title())
+        label = vm.get_name_or_title()
+        alerts = vm.get_stats_alerts()
+        if alerts:
+            label += " (%s)" % ", ".join(alerts)
+        menu_item = Gtk.ImageMenuItem.new_with_label(label)
         menu_item.set_use_underline(False)
         vm_action_menu = vmmenu.VMActionMenu(self, lambda: vm)
         vm_action_menu.update_widget_states(vm)
@@ -297,6 +301,7 @@ class vmmSystray(vmmGObject):
         conn.connect("vm-added", self._vm_added_cb)
         conn.connect("vm-removed", self._rebuild_menu)
         conn.connect("state-changed", self._rebuild_menu)
+        conn.connect("stats-alert-changed", self._rebuild_menu)
         self._rebuild_menu()
 
     def _vm_added_cb(self, conn, connkey):
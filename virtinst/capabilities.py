@@ -32,6 +32,7 @@ class _CapsTopologyCPU(XMLBuilder):
 
 class _TopologyCell(XMLBuilder):
     XML_NAME = "cell"
+    id = XMLProperty("./@id", is_int=True)
     cpus = XMLChildProperty(_CapsTopologyCPU, relative_xpath="./cpus")
 
 
@@ -4,7 +4,21 @@
 # This work is licensed under the GNU GPLv2 or later.
 # See the COPYING file in the top-level directory.
 
-import libxml2
+import collections
+import os
+import threading
+
+# Both XML libraries are optional, but at least one of them
+# needs to be installed
+try:
+    import libxml2
+except ImportError:
+    libxml2 = None
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
 
 from . import util
 
@@ -107,6 +121,62 @@ class _XPath(object):
         return self.join(self.segments[:-1])
 
 
+class _XPathCache(object):
+    """
+    Process wide, bounded LRU cache mapping absolute xpath strings to
+    their parsed _XPath objects. XMLProperty access hits the same small
+    set of xpaths over and over, so this saves us from re-splitting the
+    string on every get/set. _XPath objects are treated as immutable
+    after creation, so they are safe to share between documents.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, fullxpath):
+        with self._lock:
+            ret = self._cache.get(fullxpath)
+            if ret is not None:
+                self.hits += 1
+                self._cache.move_to_end(fullxpath)
+                return ret
+            self.misses += 1
+
+        ret = _XPath(fullxpath)
+        with self._lock:
+            self._cache[fullxpath] = ret
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return ret
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Return a dict of cache statistics, for debugging and tests
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self._cache), "maxsize": self.maxsize}
+
+
+_xpathcache = _XPathCache(4096)
+
+
+def get_xpath_cache_stats():
+    """
+    Return hit/miss statistics for the shared xpath parsing cache
+    """
+    return _xpathcache.stats()
+
+
 class _XMLBase(object):
     NAMESPACES = {}
     @classmethod
@@ -156,7 +226,7 @@ class _XMLBase(object):
             return None
         if is_bool:
             return True
-        xpathobj = _XPath(xpath)
+        xpathobj = _xpathcache.get(xpath)
         if xpathobj.is_prop:
             return self._node_get_property(node, xpathobj.propname)
         return self._node_get_text(node)
@@ -188,9 +258,9 @@ class _XMLBase(object):
         """
         Remove the element referenced at the passed xpath, regardless
         of whether it has children or not, and then clean up the XML
-        chain
+        chain. Backends drop any cached node lookups in _node_remove_child
         """
-        xpathobj = _XPath(fullxpath)
+        xpathobj = _xpathcache.get(fullxpath)
         parentnode = self._find(xpathobj.parent_xpath())
         childnode = self._find(fullxpath)
         if parentnode is None or childnode is None:
@@ -198,7 +268,7 @@ class _XMLBase(object):
         self._node_remove_child(parentnode, childnode)
 
     def _node_set_content(self, xpath, node, setval):
-        xpathobj = _XPath(xpath)
+        xpathobj = _xpathcache.get(xpath)
         if setval is not None:
             setval = str(setval)
         if xpathobj.is_prop:
@@ -228,7 +298,7 @@ class _XMLBase(object):
         Even if <bar> didn't exist before. So we fill in the dependent property
         expression values
         """
-        xpathobj = _XPath(fullxpath)
+        xpathobj = _xpathcache.get(fullxpath)
         parentxpath = "."
         parentnode = self._find(parentxpath)
         if parentnode is None:
@@ -262,7 +332,7 @@ class _XMLBase(object):
         if it doesn't have any children or attributes, so we don't
         leave stale elements in the XML
         """
-        xpathobj = _XPath(fullxpath)
+        xpathobj = _xpathcache.get(fullxpath)
         segments = xpathobj.segments[:]
         parent = None
         while segments:
@@ -284,9 +354,21 @@ def node_is_text(n):
     return bool(n and n.type == "text")
 
 
+_NOTFOUND = object()
+
+
 class _Libxml2API(_XMLBase):
+    BACKEND_NAME = "libxml2"
+
     def __init__(self, xml):
         _XMLBase.__init__(self)
+
+        # Maps absolute xpath -> resolved node (or _NOTFOUND), so
+        # repeated property reads don't need to hit xpathEval. Any
+        # change to the document structure or to attribute values
+        # (which [@prop='val'] conditions depend on) drops the cache
+        self._nodecache = {}
+
         self._doc = libxml2.parseDoc(xml)
         self._ctx = self._doc.xpathNewContext()
         self._ctx.setContextNode(self._doc.children)
@@ -310,10 +392,19 @@ class _Libxml2API(_XMLBase):
     def copy_api(self):
         return _Libxml2API(self._doc.children.serialize())
 
+    def _invalidate_node_cache(self):
+        self._nodecache.clear()
+
     def _find(self, fullxpath):
-        xpath = _XPath(fullxpath).xpath
-        node = self._ctx.xpathEval(xpath)
-        return (node and node[0] or None)
+        xpath = _xpathcache.get(fullxpath).xpath
+        node = self._nodecache.get(xpath)
+        if node is None:
+            node = self._ctx.xpathEval(xpath)
+            node = (node and node[0] or _NOTFOUND)
+            self._nodecache[xpath] = node
+        if node is _NOTFOUND:
+            return None
+        return node
 
     def count(self, xpath):
         return len(self._ctx.xpathEval(xpath))
@@ -328,6 +419,7 @@ class _Libxml2API(_XMLBase):
     def _node_set_text(self, node, setval):
         if setval is not None:
             setval = util.xml_escape(setval)
+        self._invalidate_node_cache()
         node.setContent(setval)
 
     def _node_get_property(self, node, propname):
@@ -335,6 +427,7 @@ class _Libxml2API(_XMLBase):
         if prop:
             return prop.content
     def _node_set_property(self, node, propname, setval):
+        self._invalidate_node_cache()
         if setval is None:
             prop = node.hasProp(propname)
             if prop:
@@ -366,6 +459,7 @@ class _Libxml2API(_XMLBase):
     def node_clear(self, xpath):
         node = self._find(xpath)
         if node:
+            self._invalidate_node_cache()
             propnames = [p.name for p in (node.properties or [])]
             for p in propnames:
                 node.unsetProp(p)
@@ -375,6 +469,7 @@ class _Libxml2API(_XMLBase):
         return node.type == "element" and (node.children or node.properties)
 
     def _node_remove_child(self, parentnode, childnode):
+        self._invalidate_node_cache()
         node = childnode
 
         # Look for preceding whitespace and remove it
@@ -390,6 +485,7 @@ class _Libxml2API(_XMLBase):
 
     def _node_add_child(self, parentxpath, parentnode, newnode):
         ignore = parentxpath
+        self._invalidate_node_cache()
         if not node_is_text(parentnode.get_last()):
             prevsib = parentnode.get_prev()
             if node_is_text(prevsib):
@@ -404,4 +500,185 @@ class _Libxml2API(_XMLBase):
         parentnode.addChild(libxml2.newText(endtext))
 
 
-XMLAPI = _Libxml2API
+class _LxmlAPI(_XMLBase):
+    """
+    XMLAPI implementation on top of lxml.etree. lxml has no separate
+    text nodes, whitespace lives in element .text and .tail, so the
+    child add/remove helpers emulate the libxml2 text node handling
+    to produce identical output.
+    """
+    BACKEND_NAME = "lxml"
+
+    def __init__(self, xml):
+        _XMLBase.__init__(self)
+        if not isinstance(xml, bytes):
+            xml = xml.encode("utf-8")
+        self._root = etree.fromstring(xml, parser=self._make_parser())
+
+    @staticmethod
+    def _make_parser():
+        return etree.XMLParser(remove_blank_text=False,
+                               resolve_entities=False)
+
+    def _xpath(self, xpath):
+        return self._root.xpath(xpath, namespaces=self.NAMESPACES)
+
+    def _sanitize_xml(self, xml):
+        if not xml.endswith("\n") and "\n" in xml:
+            xml += "\n"
+        return xml
+
+    def copy_api(self):
+        return _LxmlAPI(self._node_tostring(self._root))
+
+    def _find(self, fullxpath):
+        xpath = _xpathcache.get(fullxpath).xpath
+        node = self._xpath(xpath)
+        # Can't use 'node[0] or None' here, childless lxml
+        # elements evaluate to False
+        if not node:
+            return None
+        return node[0]
+
+    def count(self, xpath):
+        return len(self._xpath(xpath))
+
+    def _node_tostring(self, node):
+        return etree.tostring(node, encoding="unicode", with_tail=False)
+    def _node_from_xml(self, xml):
+        if not isinstance(xml, bytes):
+            xml = xml.encode("utf-8")
+        return etree.fromstring(xml, parser=self._make_parser())
+
+    def _node_get_text(self, node):
+        return "".join(node.itertext())
+    def _node_set_text(self, node, setval):
+        for child in list(node):
+            node.remove(child)
+        node.text = setval
+
+    def _node_get_property(self, node, propname):
+        return node.get(propname)
+    def _node_set_property(self, node, propname, setval):
+        if setval is None:
+            node.attrib.pop(propname, None)
+        else:
+            node.set(propname, setval)
+
+    def _node_new(self, xpathseg, parentnode):
+        if not xpathseg.nsname:
+            return etree.Element(xpathseg.nodename)
+
+        # If the parent already declares the namespace, lxml strips
+        # the redundant declaration when the node is appended
+        ignore = parentnode
+        uri = self.NAMESPACES[xpathseg.nsname]
+        return etree.Element("{%s}%s" % (uri, xpathseg.nodename),
+                             nsmap={xpathseg.nsname: uri})
+
+    def node_clear(self, xpath):
+        node = self._find(xpath)
+        if node is not None:
+            node.attrib.clear()
+            self._node_set_text(node, None)
+
+    def _node_has_content(self, node):
+        return bool(len(node) or node.text or node.attrib)
+
+    @staticmethod
+    def _get_prev_text(node):
+        """
+        Return the text directly preceding node, which in libxml2 terms
+        is node's previous sibling text node
+        """
+        prev = node.getprevious()
+        if prev is not None:
+            return prev.tail
+        parent = node.getparent()
+        if parent is not None:
+            return parent.text
+        return None
+
+    @staticmethod
+    def _set_prev_text(node, text):
+        prev = node.getprevious()
+        if prev is not None:
+            prev.tail = text
+        else:
+            node.getparent().text = text
+
+    def _node_remove_child(self, parentnode, childnode):
+        # Drop the preceding whitespace, but keep the text following
+        # the child in place. lxml would remove it along with the node
+        self._set_prev_text(childnode, childnode.tail)
+        parentnode.remove(childnode)
+        if not len(parentnode):
+            parentnode.text = None
+
+    def _node_add_child(self, parentxpath, parentnode, newnode):
+        ignore = parentxpath
+        children = list(parentnode)
+        if children:
+            endtext = children[-1].tail
+        else:
+            endtext = parentnode.text
+
+        if not endtext:
+            endtext = self._get_prev_text(parentnode) or "\n"
+
+        if children:
+            children[-1].tail = endtext + "  "
+        else:
+            parentnode.text = endtext + "  "
+        parentnode.append(newnode)
+        newnode.tail = endtext
+
+
+_BACKENDS = {
+    _Libxml2API.BACKEND_NAME: _Libxml2API,
+    _LxmlAPI.BACKEND_NAME: _LxmlAPI,
+}
+XMLAPI = None
+
+
+def set_xmlapi_backend(name):
+    """
+    Select the XMLAPI implementation used for all newly parsed XML.
+    Valid values are 'libxml2' (the default if it is installed) and
+    'lxml'. The default can also be set with the VIRTINST_XMLAPI
+    environment variable.
+    """
+    global XMLAPI
+    if name not in _BACKENDS:
+        raise ValueError("Unknown XML backend '%s', must be one of: %s" %
+                         (name, ", ".join(sorted(_BACKENDS))))
+    if name not in get_available_xmlapi_backends():
+        raise RuntimeError("XML backend '%s' requested, but the "
+                           "python %s module is not installed" %
+                           (name, name))
+    XMLAPI = _BACKENDS[name]
+
+
+def get_available_xmlapi_backends():
+    """
+    Return the names of the XMLAPI implementations whose python
+    module is installed, preferred one first
+    """
+    ret = []
+    if libxml2:
+        ret.append(_Libxml2API.BACKEND_NAME)
+    if etree:
+        ret.append(_LxmlAPI.BACKEND_NAME)
+    return ret
+
+
+def get_xmlapi_backend():
+    """
+    Return the name of the currently selected XMLAPI implementation
+    """
+    return XMLAPI.BACKEND_NAME
+
+
+set_xmlapi_backend(os.environ.get("VIRTINST_XMLAPI") or
+                   (get_available_xmlapi_backends() or
+                    [_Libxml2API.BACKEND_NAME])[0])
@@ -12,7 +12,7 @@ import os
 import re
 import string  # pylint: disable=deprecated-module
 
-from .xmlapi import XMLAPI
+from . import xmlapi as xmlapimod
 from . import util
 
 
@@ -133,9 +133,14 @@ class XMLChildProperty(_XMLPropertyBase):
 
 
     def _get(self, xmlbuilder):
-        if self.propname not in xmlbuilder._propstore and not self.is_single:
-            xmlbuilder._propstore[self.propname] = []
-        return xmlbuilder._propstore[self.propname]
+        # Child objects are only parsed out of the XML the first time
+        # the property is accessed. setdefault makes sure concurrent
+        # first accesses all end up seeing the same objects
+        propstore = xmlbuilder._propstore
+        if self.propname not in propstore:
+            propstore.setdefault(self.propname,
+                                 xmlbuilder._parse_child_prop(self))
+        return propstore[self.propname]
 
     def _fget(self, xmlbuilder):
         if self.is_single:
@@ -157,9 +162,6 @@ class XMLChildProperty(_XMLPropertyBase):
         self._get(xmlbuilder).append(newobj)
     def remove(self, xmlbuilder, obj):
         self._get(xmlbuilder).remove(obj)
-    def set(self, xmlbuilder, obj):
-        xmlbuilder._propstore[self.propname] = obj
-
     def get_prop_xpath(self, _xmlbuilder, obj):
         return self.relative_xpath + "/" + obj.XML_NAME
 
@@ -337,7 +339,8 @@ class _XMLState(object):
         self._namespace = ""
         if ":" in self._root_name:
             ns = self._root_name.split(":")[0]
-            self._namespace = " xmlns:%s='%s'" % (ns, XMLAPI.NAMESPACES[ns])
+            self._namespace = " xmlns:%s='%s'" % (
+                    ns, xmlapimod.XMLAPI.NAMESPACES[ns])
 
         # xpath of this object relative to its parent. So for a standalone
         # <disk> this is empty, but if the disk is the forth one in a <domain>
@@ -368,7 +371,7 @@ class _XMLState(object):
                     "<" + self._root_name + self._namespace)
 
         try:
-            self.xmlapi = XMLAPI(parsexml)
+            self.xmlapi = xmlapimod.XMLAPI(parsexml)
         except Exception:
             logging.debug("Error parsing xml=\n%s", parsexml)
             raise
@@ -422,7 +425,7 @@ class XMLBuilder(object):
 
     @staticmethod
     def register_namespace(nsname, uri):
-        XMLAPI.register_namespace(nsname, uri)
+        xmlapimod.XMLAPI.register_namespace(nsname, uri)
 
 
     def __init__(self, conn, parsexml=None,
@@ -451,7 +454,6 @@ class XMLBuilder(object):
                                    relative_object_xpath)
 
         self._validate_xmlbuilder()
-        self._initial_child_parse()
 
     def _validate_xmlbuilder(self):
         # This is one time validation we run once per XMLBuilder class
@@ -475,28 +477,49 @@ class XMLBuilder(object):
 
         setattr(self.__class__, cachekey, True)
 
-    def _initial_child_parse(self):
-        # Walk the XML tree and hand of parsing to any registered
-        # child classes
-        for xmlprop in list(self._all_child_props().values()):
-            child_class = xmlprop.child_class
-            prop_path = xmlprop.get_prop_xpath(self, child_class)
+    def _parse_child_prop(self, xmlprop):
+        """
+        Hand off parsing of the XML tree to the passed XMLChildProperty's
+        child class. This is called lazily by XMLChildProperty on first
+        access, so parsing a large document doesn't pay for building
+        objects for subtrees nobody looks at.
+        """
+        child_class = xmlprop.child_class
+        prop_path = xmlprop.get_prop_xpath(self, child_class)
+
+        if xmlprop.is_single:
+            return child_class(self.conn,
+                parentxmlstate=self._xmlstate,
+                relative_object_xpath=prop_path)
+
+        ret = []
+        nodecount = self._xmlstate.xmlapi.count(
+            self._xmlstate.make_abs_xpath(prop_path))
+        for idx in range(nodecount):
+            idxstr = "[%d]" % (idx + 1)
+            ret.append(child_class(self.conn,
+                parentxmlstate=self._xmlstate,
+                relative_object_xpath=(prop_path + idxstr)))
+        return ret
 
-            if xmlprop.is_single:
-                obj = child_class(self.conn,
-                    parentxmlstate=self._xmlstate,
-                    relative_object_xpath=prop_path)
-                xmlprop.set(self, obj)
-                continue
+    def _get_child_objs(self, parsed_only=False):
+        """
+        Return a list of our direct child XMLBuilder objects, parsing
+        any that haven't been accessed yet.
 
-            nodecount = self._xmlstate.xmlapi.count(
-                self._xmlstate.make_abs_xpath(prop_path))
-            for idx in range(nodecount):
-                idxstr = "[%d]" % (idx + 1)
-                obj = child_class(self.conn,
-                    parentxmlstate=self._xmlstate,
-                    relative_object_xpath=(prop_path + idxstr))
-                xmlprop.append(self, obj)
+        :param parsed_only: Only return children that were already
+            parsed. Unparsed children are looked up relative to our
+            xpath whenever they are first accessed, so they never need
+            their xpaths fixed up.
+        """
+        ret = []
+        for propname in self._all_child_props():
+            if parsed_only:
+                objs = self._propstore.get(propname)
+            else:
+                objs = getattr(self, propname)
+            ret.extend(util.listify(objs))
+        return ret
 
     def __repr__(self):
         return "<%s %s %s>" % (self.__class__.__name__.split(".")[-1],
@@ -609,12 +632,12 @@ class XMLBuilder(object):
         """
         Change the object hierarchy's cached xpaths
         """
+        children = self._get_child_objs(parsed_only=True)
         self._xmlstate.set_parent_xpath(parent_xpath)
         if relative_object_xpath != -1:
             self._xmlstate.set_relative_object_xpath(relative_object_xpath)
-        for propname in self._all_child_props():
-            for p in util.listify(getattr(self, propname, [])):
-                p._set_xpaths(self._xmlstate.abs_xpath())
+        for p in children:
+            p._set_xpaths(self._xmlstate.abs_xpath())
 
     def _set_child_xpaths(self):
         """
@@ -624,6 +647,17 @@ class XMLBuilder(object):
         """
         typecount = {}
         for propname, xmlprop in self._all_child_props().items():
+            if propname not in self._propstore:
+                # Not parsed yet, so nothing to fix up, but other props
+                # sharing the child class still need to count its nodes
+                if not xmlprop.is_single:
+                    class_type = xmlprop.child_class
+                    typecount[class_type] = (typecount.get(class_type, 0) +
+                        self._xmlstate.xmlapi.count(
+                            self._xmlstate.make_abs_xpath(
+                                xmlprop.get_prop_xpath(self, class_type))))
+                continue
+
             for obj in util.listify(getattr(self, propname)):
                 idxstr = ""
                 if not xmlprop.is_single:
@@ -703,6 +737,9 @@ class XMLBuilder(object):
         Callback that adds the implicitly tracked XML properties to
         the backing xml.
         """
+        # Make sure lazily parsed children are bound to our real
+        # document before we temporarily swap in the passed xmlapi
+        self._get_child_objs()
         origpropstore = self._propstore.copy()
         origapi = self._xmlstate.xmlapi
         try: